@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+#
+#  run_benchmarks.py
+"""
+Benchmarks for the LC-ESI peak finding pipeline.
+
+Synthetic intensity matrices are generated with a configurable number of scans and m/z channels,
+density of peaks and noise level, and each stage of the pipeline is timed.
+The results, including the peak memory allocated by each stage, are written to a JSON file
+so they can be compared between versions.
+
+Usage:
+
+.. code-block:: bash
+
+	$ python3 benchmarks/run_benchmarks.py --scans 5000 --masses 3000 -o results.json
+"""
+#
+#  Copyright © 2020-2023 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import argparse
+import datetime
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+# 3rd party
+import numpy
+from chemistry_tools.formulae import Formula
+from domdf_python_tools.paths import PathPlus
+from pyms.IntensityMatrix import IntensityMatrix
+
+# this package
+import pyms_lc_esi
+from pyms_lc_esi.adducts import AdductSpectrumCache, get_adduct_spectra, plus_h, plus_sodium
+from pyms_lc_esi.peak_finder import (
+		candidates_from_maxima,
+		make_im_for_adducts,
+		peak_finder,
+		peaks_from_maxima,
+		sum_areas
+		)
+from pyms_lc_esi.spectra import iso_dist_2_mass_spec
+
+#: The analyte used for benchmarking (diphenylamine).
+ANALYTE = Formula.from_string("C12H11N")
+ADDUCTS = [plus_h, plus_sodium]
+
+
+def make_intensity_matrix(
+		n_scans: int = 3000,
+		n_masses: int = 3000,
+		peak_density: float = 0.01,
+		noise: float = 50.0,
+		seed: int = 1,
+		) -> IntensityMatrix:
+	"""
+	Generate a synthetic intensity matrix with Gaussian peaks on a noisy baseline.
+
+	Peaks are placed both on the m/z channels of the adducts of :data:`~.ANALYTE`, and on random channels.
+
+	:param n_scans: The number of scans.
+	:param n_masses: The number of m/z channels, spaced 0.1 apart from m/z 100.
+	:param peak_density: The number of peaks per scan.
+	:param noise: The mean intensity of the (exponentially distributed) baseline noise.
+	:param seed: Seed for the random number generator.
+	"""
+
+	rng = numpy.random.default_rng(seed)
+
+	mass_list = numpy.round(100 + numpy.arange(n_masses) * 0.1, 1)
+	time_list = numpy.arange(n_scans) * 0.5
+	intensity_array = rng.exponential(noise, size=(n_scans, n_masses))
+
+	spectra = get_adduct_spectra(ANALYTE, ADDUCTS, cache=AdductSpectrumCache(maxsize=0))
+	target_masses = [mass for spectrum in spectra.values() for mass in spectrum.mass_list]
+	target_columns = numpy.unique(numpy.searchsorted(mass_list, target_masses).clip(0, n_masses - 1))
+
+	scans = numpy.arange(n_scans)
+	for _ in range(max(1, int(n_scans * peak_density))):
+		centre = rng.uniform(0, n_scans)
+		width = rng.uniform(2, 8)
+		profile = rng.uniform(1e3, 1e5) * numpy.exp(-0.5 * ((scans - centre) / width)**2)
+
+		if rng.random() < 0.5:
+			columns = target_columns
+		else:
+			columns = rng.choice(n_masses, size=min(5, n_masses), replace=False)
+
+		intensity_array[:, columns] += numpy.outer(profile, rng.uniform(0.2, 1, size=len(columns)))
+
+	return IntensityMatrix(time_list.tolist(), mass_list.tolist(), intensity_array)
+
+
+def benchmark(function: Callable[[], Any], repeats: int = 5) -> Dict[str, float]:
+	"""
+	Time ``function``, and measure the peak memory it allocates.
+
+	:param function:
+	:param repeats: The number of times to call the function.
+
+	:returns: The minimum, median and mean duration (in seconds), and the peak memory allocated (in bytes).
+	"""
+
+	durations: List[float] = []
+
+	for _ in range(repeats):
+		start = time.perf_counter()
+		function()
+		durations.append(time.perf_counter() - start)
+
+	tracemalloc.start()
+	try:
+		function()
+		_, peak_memory = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+
+	return {
+			"min": min(durations),
+			"median": statistics.median(durations),
+			"mean": statistics.mean(durations),
+			"repeats": repeats,
+			"peak_memory": peak_memory,
+			}
+
+
+def run_benchmarks(
+		n_scans: int = 3000,
+		n_masses: int = 3000,
+		peak_density: float = 0.01,
+		noise: float = 50.0,
+		seed: int = 1,
+		repeats: int = 5,
+		) -> Dict[str, Any]:
+	"""
+	Run the benchmarks and return the results.
+
+	:param n_scans: The number of scans in the synthetic intensity matrix.
+	:param n_masses: The number of m/z channels in the synthetic intensity matrix.
+	:param peak_density: The number of peaks per scan.
+	:param noise: The mean intensity of the baseline noise.
+	:param seed: Seed for the random number generator.
+	:param repeats: The number of times to run each benchmark.
+	"""
+
+	parameters = {
+			"n_scans": n_scans,
+			"n_masses": n_masses,
+			"peak_density": peak_density,
+			"noise": noise,
+			"seed": seed,
+			"repeats": repeats,
+			}
+
+	im = make_intensity_matrix(n_scans, n_masses, peak_density, noise, seed)
+	e_im = make_im_for_adducts(im, ANALYTE, ADDUCTS)
+	if e_im is None:
+		raise ValueError(f"None of the masses of {ANALYTE} are within the mass range of the intensity matrix.")
+
+	iso_dist = plus_h(ANALYTE).isotope_distribution()
+	apex_indices = candidates_from_maxima(e_im)["apex_index"].tolist()
+
+	benchmarks: Dict[str, Callable[[], Any]] = {
+			"iso_dist_2_mass_spec": lambda: iso_dist_2_mass_spec(iso_dist, 0.001),
+			"get_adduct_spectra": lambda: get_adduct_spectra(ANALYTE, ADDUCTS, cache=AdductSpectrumCache(maxsize=0)),
+			"get_adduct_spectra_cached": lambda: get_adduct_spectra(ANALYTE, ADDUCTS),
+			"make_im_for_adducts": lambda: make_im_for_adducts(im, ANALYTE, ADDUCTS),
+			"peaks_from_maxima": lambda: peaks_from_maxima(e_im),
+			"candidates_from_maxima": lambda: candidates_from_maxima(e_im),
+			"sum_area": lambda: sum_areas(apex_indices, e_im),
+			"peak_finder": lambda: list(peak_finder(e_im)),
+			"end_to_end": lambda: list(peak_finder(make_im_for_adducts(im, ANALYTE, ADDUCTS))),
+			}
+
+	results = {}
+	for name, function in benchmarks.items():
+		results[name] = benchmark(function, repeats=repeats)
+		print(f"{name:<28} {results[name]['median'] * 1000:>10.2f} ms", file=sys.stderr)
+
+	return {
+			"pyms_lc_esi_version": pyms_lc_esi.__version__,
+			"python_version": platform.python_version(),
+			"numpy_version": numpy.__version__,
+			"platform": platform.platform(),
+			"timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+			"parameters": parameters,
+			"n_apexes": len(apex_indices),
+			"results": results,
+			}
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+	"""
+	Command-line entry point.
+
+	:param argv:
+	"""
+
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--scans", type=int, default=3000, help="The number of scans.")
+	parser.add_argument("--masses", type=int, default=3000, help="The number of m/z channels.")
+	parser.add_argument("--peak-density", type=float, default=0.01, help="The number of peaks per scan.")
+	parser.add_argument("--noise", type=float, default=50.0, help="The mean intensity of the baseline noise.")
+	parser.add_argument("--seed", type=int, default=1, help="Seed for the random number generator.")
+	parser.add_argument("--repeats", type=int, default=5, help="The number of times to run each benchmark.")
+	parser.add_argument(
+			"-o",
+			"--output",
+			default="benchmark_results.json",
+			help="The file to write the results to.",
+			)
+	args = parser.parse_args(argv)
+
+	results = run_benchmarks(
+			n_scans=args.scans,
+			n_masses=args.masses,
+			peak_density=args.peak_density,
+			noise=args.noise,
+			seed=args.seed,
+			repeats=args.repeats,
+			)
+
+	PathPlus(args.output).dump_json(results, indent=2)
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
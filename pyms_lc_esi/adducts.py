@@ -27,24 +27,41 @@ Represents LC-MS adducts.
 #
 
 # stdlib
-from typing import Dict, Iterable, Literal, Union
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, Literal, Mapping, Optional, Sequence, Tuple, Union
 
 # 3rd party
 import attr
+import numpy
 from chemistry_tools.elements import ELEMENTS
 from chemistry_tools.formulae import Formula
+from domdf_python_tools.paths import PathPlus
+from domdf_python_tools.typing import PathLike
 from pyms.Spectrum import MassSpectrum
 
 # this package
-from pyms_lc_esi.spectra import iso_dist_2_mass_spec
+from pyms_lc_esi.instrumentation import stage
+from pyms_lc_esi.mass_index import MassIndex, RTWindow, RTWindows
+from pyms_lc_esi.spectra import AbundanceCutoff, iso_dist_2_mass_spec
 
 __all__ = [
 		"Adduct",
+		"AdductSet",
+		"AdductSpectrumCache",
+		"AdductTable",
+		"adduct_spectrum_cache",
 		"plus_h",
 		"plus_sodium",
 		"get_adduct_spectra",
 		]
 
+logger = logging.getLogger(__name__)
+
 
 def _formula_converter(formula: Union[Dict[str, int], Formula, str]) -> Formula:
 	if isinstance(formula, Formula):
@@ -81,7 +98,7 @@ class Adduct:
 	#: The name of the adduct, e.g. ``'[%s + H]⁺'``.
 	name: str = attr.ib(converter=str)
 
-	formula: Union[Dict[str, int], Formula, str] = attr.ib(converter=_formula_converter)
+	formula: Formula = attr.ib(converter=_formula_converter)
 	"""
 	Either:
 
@@ -120,34 +137,450 @@ plus_h = Adduct("[%s + H]⁺", 'H')
 plus_sodium = Adduct("[%s + Na]⁺", "Na")
 
 
+_AdductKey = Tuple[str, str, int, str]
+_CacheKey = Tuple[str, int, str, str, int, str, str, float]
+_CachedSpectrum = Tuple[List[float], List[float]]
+
+
+def _adduct_key(adduct: Adduct) -> _AdductKey:
+	return adduct.name, adduct.formula.hill_formula, adduct.formula.charge, adduct.operation
+
+
+def _cache_key(formula: Formula, adduct: Adduct, min_abundance: AbundanceCutoff) -> _CacheKey:
+	return (formula.hill_formula, formula.charge, *_adduct_key(adduct), min_abundance.mode, min_abundance.value)
+
+
+class AdductSpectrumCache:
+	"""
+	Cache of the theoretical mass spectra of adducts of formulae.
+
+	Spectra are held in memory, up to ``maxsize`` entries, with the least recently used spectra evicted first.
+	If ``cache_dir`` is given spectra are also stored on disk in that directory,
+	allowing them to be shared between processes and reused between runs.
+
+	:param maxsize: The maximum number of spectra to hold in memory. ``0`` disables the in-memory cache.
+	:param cache_dir: Optional directory in which to store spectra on disk.
+	"""
+
+	#: The number of spectra found in the in-memory cache.
+	hits: int
+
+	#: The number of spectra found on disk (but not in memory).
+	disk_hits: int
+
+	#: The number of spectra which had to be calculated.
+	misses: int
+
+	def __init__(self, maxsize: int = 1024, cache_dir: Optional[PathLike] = None):
+		self.maxsize: int = maxsize
+		self.cache_dir: Optional[PathPlus] = None if cache_dir is None else PathPlus(cache_dir)
+
+		self._spectra: "OrderedDict[_CacheKey, _CachedSpectrum]" = OrderedDict()
+		self._lock = threading.Lock()
+		self.hits = self.disk_hits = self.misses = 0
+
+	def __len__(self) -> int:
+		"""
+		Returns the number of spectra held in memory.
+		"""
+
+		return len(self._spectra)
+
+	def clear(self) -> None:
+		"""
+		Remove all spectra from memory and reset the counters.
+
+		Spectra stored on disk are not removed.
+		"""
+
+		with self._lock:
+			self._spectra.clear()
+			self.hits = self.disk_hits = self.misses = 0
+
+	def get_spectrum(
+			self,
+			formula: Formula,
+			adduct: Adduct,
+			min_abundance: Union[float, AbundanceCutoff],
+			) -> MassSpectrum:
+		"""
+		Returns the mass spectrum for the given adduct of ``formula``, calculating it if it is not in the cache.
+
+		:param formula:
+		:param adduct:
+		:param min_abundance: Ignore isotopologues whose (absolute) abundance is below this threshold,
+			or an :class:`~.AbundanceCutoff` giving the isotopologues to include.
+		"""
+
+		if not isinstance(min_abundance, AbundanceCutoff):
+			min_abundance = AbundanceCutoff(min_abundance)
+
+		key = _cache_key(formula, adduct, min_abundance)
+		return self._get_spectrum(key, lambda: adduct(formula), min_abundance)
+
+	def _get_spectrum(
+			self,
+			key: _CacheKey,
+			make_formula: Callable[[], Formula],
+			min_abundance: AbundanceCutoff,
+			) -> MassSpectrum:
+		"""
+		Returns the mass spectrum for ``key``, calculating it from the formula returned by ``make_formula`` if needed.
+
+		:param key:
+		:param make_formula: Returns the formula of the adduct. Only called if the spectrum is not in the cache.
+		:param min_abundance:
+		"""
+
+		with self._lock:
+			cached = self._spectra.get(key)
+			if cached is not None:
+				self._spectra.move_to_end(key)
+				self.hits += 1
+				return MassSpectrum(*cached)
+
+		cached = self._load(key)
+
+		if cached is None:
+			spectrum = iso_dist_2_mass_spec(make_formula().isotope_distribution(), min_abundance)
+			cached = (spectrum.mass_list, spectrum.intensity_list)
+			self._save(key, cached)
+			from_disk = False
+		else:
+			from_disk = True
+
+		with self._lock:
+			if from_disk:
+				self.disk_hits += 1
+			else:
+				self.misses += 1
+
+			if self.maxsize > 0:
+				self._spectra[key] = cached
+				self._spectra.move_to_end(key)
+				while len(self._spectra) > self.maxsize:
+					self._spectra.popitem(last=False)
+
+		# Return a new object each time, as MassSpectrum objects are mutable.
+		return MassSpectrum(*cached)
+
+	def _get_filename(self, key: _CacheKey) -> Optional[PathPlus]:
+		if self.cache_dir is None:
+			return None
+
+		digest = hashlib.sha256(repr(key).encode("UTF-8")).hexdigest()
+		return self.cache_dir / f"{digest}.json"
+
+	def _load(self, key: _CacheKey) -> Optional[_CachedSpectrum]:
+		filename = self._get_filename(key)
+		if filename is None or not filename.is_file():
+			return None
+
+		try:
+			data = filename.load_json()
+		except ValueError:
+			# Incomplete or corrupt file; it will be overwritten.
+			return None
+
+		return data["mass_list"], data["intensity_list"]
+
+	def _save(self, key: _CacheKey, spectrum: _CachedSpectrum) -> None:
+		filename = self._get_filename(key)
+		if filename is None:
+			return
+
+		filename.parent.maybe_make(parents=True)
+
+		# Write to a temporary file first so other processes never see a partially written file.
+		tmp_filename = filename.with_name(f"{filename.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+		tmp_filename.dump_json({"mass_list": spectrum[0], "intensity_list": spectrum[1]})
+		os.replace(tmp_filename, filename)
+
+
+#: The cache used by :func:`~.get_adduct_spectra` by default.
+adduct_spectrum_cache = AdductSpectrumCache()
+
+
+@attr.s(frozen=True)
+class AdductTable:
+	"""
+	The adducts of a batch of formulae, as returned by :meth:`AdductSet.table() <.AdductSet.table>`.
+
+	The adducts are stored in flat arrays with one row per formula/adduct pair,
+	ordered by formula and then by adduct. Pairs excluded from the table (e.g. by
+	:meth:`AdductSet.prescreen() <.AdductSet.prescreen>`) have no row.
+	"""
+
+	#: The names of the adducts, as used for the keys of :func:`~.get_adduct_spectra`.
+	names: List[str] = attr.ib()
+
+	#: The index of the formula of each row.
+	formula_indices: numpy.ndarray = attr.ib()
+
+	#: The index of the adduct of each row.
+	adduct_indices: numpy.ndarray = attr.ib()
+
+	#: The monoisotopic mass of each row.
+	exact_masses: numpy.ndarray = attr.ib()
+
+	#: The theoretical mass spectrum of each row.
+	spectra: List[MassSpectrum] = attr.ib()
+
+	def __len__(self) -> int:
+		"""
+		Returns the number of rows in the table.
+		"""
+
+		return len(self.spectra)
+
+	def spectra_for(self, formula_index: int) -> Dict[str, MassSpectrum]:
+		"""
+		Returns a dictionary mapping adducts to mass spectra for a single formula.
+
+		The dictionary is in the same form as returned by :func:`~.get_adduct_spectra`.
+
+		:param formula_index:
+		"""
+
+		start, stop = numpy.searchsorted(self.formula_indices, [formula_index, formula_index + 1])
+		return {self.names[self.adduct_indices[row]]: self.spectra[row] for row in range(start, stop)}
+
+
+class AdductSet:
+	"""
+	A collection of adducts which are validated once and can then be applied to many formulae.
+
+	:param adducts:
+	"""
+
+	def __init__(self, adducts: Iterable[Adduct]):
+		#: The adducts in the set.
+		self.adducts: List[Adduct] = []
+
+		self._names: List[str] = []
+		self._keys: List[_AdductKey] = []
+		self._deltas: List[Dict[str, int]] = []
+		mass_deltas = []
+
+		for adduct in adducts:
+			if not isinstance(adduct, Adduct):
+				raise TypeError(f"Expected an Adduct, not {type(adduct)}")
+
+			# Attributes could have been modified since the adduct was created.
+			adduct_formula = _formula_converter(adduct.formula)
+			operation = _operation_validator(adduct, attr.fields(Adduct).operation, adduct.operation)
+			sign = 1 if operation == "add" else -1
+
+			self.adducts.append(adduct)
+			self._names.append(adduct % 'M')
+			self._keys.append((adduct.name, adduct_formula.hill_formula, adduct_formula.charge, operation))
+			self._deltas.append({element: sign * count for element, count in adduct_formula.items()})
+			mass_deltas.append(sign * adduct_formula.exact_mass)
+
+		self._mass_deltas = numpy.array(mass_deltas, dtype=numpy.float64)
+
+	def __len__(self) -> int:
+		return len(self.adducts)
+
+	def __iter__(self) -> Iterator[Adduct]:
+		yield from self.adducts
+
+	def __repr__(self) -> str:
+		return f"{self.__class__.__name__}({self.adducts!r})"
+
+	@property
+	def keys(self) -> List[Tuple[str, str, int, str]]:
+		"""
+		The name, formula, charge and operation of each adduct, for identifying the adducts in cache keys.
+		"""
+
+		return list(self._keys)
+
+	def _apply(self, formula: Formula, adduct_index: int) -> Formula:
+		"""
+		Returns the formula of an adduct of ``formula``.
+
+		This is equivalent to calling the :class:`~.Adduct`, but the elements of ``formula``
+		are not parsed again for every adduct.
+
+		:param formula:
+		:param adduct_index:
+		"""
+
+		result = Formula(charge=formula.charge)
+		dict.update(result, formula)
+		for element, count in self._deltas[adduct_index].items():
+			result[element] += count
+
+		return result
+
+	def apply(self, formulae: Iterable[Formula]) -> List[Formula]:
+		"""
+		Create every adduct of each formula.
+
+		:param formulae:
+
+		:returns: The formulae of the adducts, ordered by formula and then by adduct.
+		"""
+
+		return [self._apply(formula, idx) for formula in formulae for idx in range(len(self.adducts))]
+
+	def exact_masses(self, formulae: Iterable[Formula]) -> numpy.ndarray:
+		"""
+		Returns the monoisotopic masses of every adduct of each formula.
+
+		:param formulae:
+
+		:returns: A 2D array with one row per formula and one column per adduct.
+		"""
+
+		formula_masses = numpy.array([formula.exact_mass for formula in formulae], dtype=numpy.float64)
+		return formula_masses[:, numpy.newaxis] + self._mass_deltas
+
+	def prescreen(
+			self,
+			formulae: Iterable[Formula],
+			mass_index: MassIndex,
+			left_bound: float = 0.1,
+			right_bound: float = 0.1,
+			rt_windows: Optional[Sequence[Optional[RTWindows]]] = None,
+			) -> numpy.ndarray:
+		"""
+		Determine which adducts of each formula could be present in an intensity matrix.
+
+		An adduct passes if there is any signal in the intensity matrix within the bounds of its monoisotopic mass.
+		Adducts whose monoisotopic masses lie outside the mass range of the intensity matrix are rejected outright.
+		Isotope distributions are not calculated.
+
+		:param formulae:
+		:param mass_index: The index of the intensity matrix.
+		:param left_bound:
+		:param right_bound:
+		:param rt_windows: The retention time window to look for the adducts of each formula in,
+			in the same order as ``formulae``. See :data:`~.RTWindows`.
+			An entry of :py:obj:`None` looks in every scan.
+
+		:returns: A boolean array with one row per formula and one column per adduct.
+		"""
+
+		exact_masses = self.exact_masses(formulae)
+
+		mass_windows: Optional[List[Optional[RTWindow]]] = None
+		if rt_windows is not None:
+			if len(rt_windows) != len(exact_masses):
+				raise ValueError(f"Expected {len(exact_masses)} retention time windows, got {len(rt_windows)}")
+
+			mass_windows = []
+			for rt_window in rt_windows:
+				if isinstance(rt_window, Mapping):
+					mass_windows.extend(rt_window.get(name) for name in self._names)
+				else:
+					mass_windows.extend([rt_window] * len(self._names))
+
+		with stage("prescreen") as counts:
+			passed = mass_index.has_signal(
+					exact_masses.ravel(),
+					left_bound=left_bound,
+					right_bound=right_bound,
+					rt_windows=mass_windows,
+					)
+			counts["adducts"] = len(passed)
+			counts["passed"] = int(passed.sum())
+
+		return passed.reshape(exact_masses.shape)
+
+	def table(
+			self,
+			formulae: Sequence[Formula],
+			min_abundance: Union[float, AbundanceCutoff] = 0.001,
+			cache: Optional["AdductSpectrumCache"] = None,
+			include: Optional[numpy.ndarray] = None,
+			) -> AdductTable:
+		"""
+		Calculate the exact masses and theoretical mass spectra of every adduct of each formula.
+
+		:param formulae:
+		:param min_abundance: Ignore isotopologues whose (absolute) abundance is below this threshold.
+			Alternatively, an :class:`~.AbundanceCutoff` giving a relative abundance threshold
+			or the number of isotopologues to include.
+		:param cache: The cache to look up and store spectra in.
+			If :py:obj:`None` the module-level :data:`~.adduct_spectrum_cache` is used.
+		:param include: An optional boolean array with one row per formula and one column per adduct,
+			such as from :meth:`~.AdductSet.prescreen`, giving the pairs to include in the table.
+			Spectra are only calculated for the included pairs.
+		"""
+
+		if cache is None:
+			cache = adduct_spectrum_cache
+
+		if not isinstance(min_abundance, AbundanceCutoff):
+			min_abundance = AbundanceCutoff(min_abundance)
+
+		exact_masses = self.exact_masses(formulae)
+
+		if include is None:
+			include = numpy.ones(exact_masses.shape, dtype=bool)
+		elif include.shape != exact_masses.shape:
+			raise ValueError(f"'include' must have shape {exact_masses.shape}, not {include.shape}")
+
+		formula_indices, adduct_indices = numpy.nonzero(include)
+		formula_keys: Dict[int, Tuple[str, int]] = {}
+		spectra = []
+
+		with stage("spectra_generation") as counts:
+			for formula_idx, adduct_idx in zip(formula_indices.tolist(), adduct_indices.tolist()):
+				formula = formulae[formula_idx]
+				if formula_idx not in formula_keys:
+					formula_keys[formula_idx] = (formula.hill_formula, formula.charge)
+
+				key = (*formula_keys[formula_idx], *self._keys[adduct_idx], min_abundance.mode, min_abundance.value)
+				spectra.append(cache._get_spectrum(key, partial(self._apply, formula, adduct_idx), min_abundance))
+
+			counts["spectra"] = len(spectra)
+
+		return AdductTable(
+				names=list(self._names),
+				formula_indices=formula_indices,
+				adduct_indices=adduct_indices,
+				exact_masses=exact_masses[include],
+				spectra=spectra,
+				)
+
+
 def get_adduct_spectra(
 		formula: Formula,
 		adducts: Iterable[Adduct],
+		min_abundance: Union[float, AbundanceCutoff] = 0.001,
+		cache: Optional[AdductSpectrumCache] = None,
 		) -> Dict[str, MassSpectrum]:
 	"""
 	Returns a dictionary mapping adducts to mass spectra, for the given adducts of ``formula``.
 
 	:param formula:
 	:param adducts:
+	:param min_abundance: Ignore isotopologues whose (absolute) abundance is below this threshold.
+		Alternatively, an :class:`~.AbundanceCutoff` giving a relative abundance threshold
+		or the number of isotopologues to include.
+	:param cache: The cache to look up and store spectra in.
+		If :py:obj:`None` the module-level :data:`~.adduct_spectrum_cache` is used.
+
+	.. tip:: Pass an :class:`~.AdductSet` when calling this function many times with the same adducts.
 	"""
 
-	# TODO: Add parameter to this and all calling functions to control cutoff intensity.
+	logger.debug("Generating adduct spectra for %s", formula)
 
-	spectra = {}
-	print(formula)
+	if isinstance(adducts, AdductSet):
+		return adducts.table([formula], min_abundance=min_abundance, cache=cache).spectra_for(0)
 
-	for adduct in adducts:
-		formula_as_adduct = adduct(formula)
-		# print(f"{adduct % 'M'}:", formula_as_adduct)
-		# print("Average Mass:", formula_as_adduct.mass)
-		# print("Exact Mass:", formula_as_adduct.exact_mass)
+	if cache is None:
+		cache = adduct_spectrum_cache
 
-		# print()
+	spectra = {}
 
-		# print(f"Isotope distribution of {adduct % 'Diphenylamine'}:")
-		# print(formula_as_adduct.isotope_distribution())
-		dpa_h_mass_spec = iso_dist_2_mass_spec(formula_as_adduct.isotope_distribution(), 0.001)
+	with stage("spectra_generation") as counts:
+		for adduct in adducts:
+			spectra[adduct % 'M'] = cache.get_spectrum(formula, adduct, min_abundance)
 
-		spectra[adduct % 'M'] = dpa_h_mass_spec
+		counts["spectra"] = len(spectra)
 
 	return spectra
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#
+#  instrumentation.py
+"""
+Timing and counting of the stages of peak finding.
+
+.. code-block:: python
+
+	>>> timings = StageTimings()
+	>>> with instrument(timings):
+	...     e_im = make_im_for_adducts(im, analyte, adducts)
+	...     peaks = list(peak_finder(e_im))
+	>>> sorted(timings.totals)
+	['area_integration', 'eic_extraction', 'maxima_detection', 'noise_analysis', 'spectra_generation']
+"""
+#
+#  Copyright © 2020-2023 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, DefaultDict, Dict, Iterator, Tuple
+
+__all__ = ["InstrumentationCallback", "StageTimings", "instrument", "stage"]
+
+#: Signature of functions called at the end of each stage, with the stage name, its duration (in seconds),
+#: and a dictionary of counts recorded during the stage.
+InstrumentationCallback = Callable[[str, float, Dict[str, int]], None]
+
+_callbacks: ContextVar[Tuple[InstrumentationCallback, ...]] = ContextVar("_callbacks", default=())
+
+
+@contextmanager
+def instrument(callback: InstrumentationCallback) -> Iterator[InstrumentationCallback]:
+	"""
+	Context manager to call ``callback`` at the end of each stage run within the context.
+
+	:param callback:
+	"""
+
+	token = _callbacks.set(_callbacks.get() + (callback, ))
+	try:
+		yield callback
+	finally:
+		_callbacks.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[Dict[str, int]]:
+	"""
+	Context manager to time a stage and report it to the active callbacks.
+
+	Counts may be recorded in the dictionary returned by the context manager.
+	If there are no active callbacks the stage is not timed.
+
+	:param name: The name of the stage, such as ``'eic_extraction'``.
+	"""
+
+	counts: Dict[str, int] = {}
+	callbacks = _callbacks.get()
+
+	if not callbacks:
+		yield counts
+		return
+
+	start = time.perf_counter()
+	try:
+		yield counts
+	finally:
+		duration = time.perf_counter() - start
+		for callback in callbacks:
+			callback(name, duration, counts)
+
+
+class StageTimings:
+	"""
+	An :data:`~.InstrumentationCallback` which accumulates the time spent in, and counts recorded by, each stage.
+	"""
+
+	#: The total time, in seconds, spent in each stage.
+	totals: DefaultDict[str, float]
+
+	#: The number of times each stage was run.
+	calls: DefaultDict[str, int]
+
+	#: The sum of the counts recorded by each stage.
+	counts: DefaultDict[str, DefaultDict[str, int]]
+
+	def __init__(self):
+		self.totals = defaultdict(float)
+		self.calls = defaultdict(int)
+		self.counts = defaultdict(lambda: defaultdict(int))
+
+		# Stages may run in several threads at once, such as in a Pipeline.
+		self._lock = threading.Lock()
+
+	def __call__(self, name: str, duration: float, counts: Dict[str, int]) -> None:
+		"""
+		Record a run of the stage ``name``.
+
+		:param name:
+		:param duration: The duration of the stage, in seconds.
+		:param counts: The counts recorded by the stage.
+		"""
+
+		with self._lock:
+			self.totals[name] += duration
+			self.calls[name] += 1
+
+			for key, value in counts.items():
+				self.counts[name][key] += value
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+#
+#  mass_index.py
+"""
+Index of the masses in an intensity matrix, for repeated extraction of ion chromatograms.
+"""
+#
+#  Copyright © 2020-2023 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+from typing import Iterable, Mapping, Optional, Sequence, Tuple, Union
+
+# 3rd party
+import numpy
+from pyms.eic import ExtractedIntensityMatrix
+from pyms.IntensityMatrix import BaseIntensityMatrix
+
+__all__ = ["get_scan_range", "get_scan_span", "MassIndex", "RTWindow", "RTWindows"]
+
+#: A range of retention times, as ``(start, end)``, in the same units as the intensity matrix's time list.
+RTWindow = Tuple[float, float]
+
+#: Retention time windows for the adducts of an analyte.
+#:
+#: Either a single ``(start, end)`` window for every adduct, or a mapping of adduct names
+#: (e.g. ``'[M+H]+'``) to windows. Adducts missing from the mapping are extracted from every scan.
+RTWindows = Union[RTWindow, Mapping[str, RTWindow]]
+
+
+def get_scan_range(time_list: Sequence[float], rt_window: Optional[RTWindow]) -> Tuple[int, int]:
+	"""
+	Returns the indices of the first scan in the retention time window, and of the scan after the last.
+
+	Both ends of the window are inclusive.
+
+	:param time_list: The retention times of the scans, in ascending order.
+	:param rt_window: If :py:obj:`None` the range covers every scan.
+	"""
+
+	if rt_window is None:
+		return 0, len(time_list)
+
+	start, end = rt_window
+	if start > end:
+		raise ValueError(f"The start of the retention time window ({start}) is after the end ({end}).")
+
+	times = numpy.asarray(time_list, dtype=numpy.float64)
+	return int(numpy.searchsorted(times, start, side="left")), int(numpy.searchsorted(times, end, side="right"))
+
+
+def get_scan_span(time_list: Sequence[float], rt_windows: Iterable[Optional[RTWindow]]) -> Tuple[int, int]:
+	"""
+	Returns the range of scans which covers every one of the retention time windows.
+
+	:param time_list: The retention times of the scans, in ascending order.
+	:param rt_windows: A window of :py:obj:`None` covers every scan.
+
+	:returns: The indices of the first scan in any window, and of the scan after the last.
+		The range is empty (``(0, 0)``) if none of the windows contain any scans.
+	"""
+
+	scan_ranges = [get_scan_range(time_list, rt_window) for rt_window in rt_windows]
+	scan_ranges = [(start, stop) for start, stop in scan_ranges if start < stop]
+	if not scan_ranges:
+		return 0, 0
+
+	return min(start for start, _ in scan_ranges), max(stop for _, stop in scan_ranges)
+
+
+class MassIndex:
+	"""
+	Index of the masses in an intensity matrix.
+
+	The index is built once, after which the columns for a set of masses are found by binary search.
+	Extracting masses therefore takes time proportional to the number of columns extracted,
+	rather than to the size of the mass axis.
+
+	The index must be rebuilt if the masses in the intensity matrix change (e.g. with
+	:meth:`~pyms.IntensityMatrix.BaseIntensityMatrix.crop_mass`).
+
+	:param im: The intensity matrix to index.
+	"""
+
+	#: The intensity matrix the index was built for.
+	im: BaseIntensityMatrix
+
+	def __init__(self, im: BaseIntensityMatrix):
+		self.im = im
+
+		masses = numpy.asarray(im._mass_list, dtype=numpy.float64)
+		self._order = numpy.argsort(masses, kind="stable")
+		self._sorted_masses = masses[self._order]
+
+	def get_indices(
+			self,
+			masses: Iterable[float],
+			left_bound: float = 0.5,
+			right_bound: float = 0.5,
+			) -> numpy.ndarray:
+		"""
+		Returns the indices of the columns in the intensity matrix within the bounds of any of the given masses.
+
+		:param masses:
+		:param left_bound:
+		:param right_bound:
+
+		:returns: The column indices, in ascending order.
+		"""
+
+		target_masses = numpy.fromiter(masses, dtype=numpy.float64)
+		if not len(target_masses):
+			return numpy.empty(0, dtype=numpy.intp)
+
+		lower = numpy.searchsorted(self._sorted_masses, target_masses - left_bound, side="left")
+		upper = numpy.searchsorted(self._sorted_masses, target_masses + right_bound, side="right")
+
+		columns = numpy.concatenate([self._order[start:stop] for start, stop in zip(lower, upper)])
+		return numpy.unique(columns)
+
+	def has_signal(
+			self,
+			masses: Iterable[float],
+			left_bound: float = 0.5,
+			right_bound: float = 0.5,
+			min_intensity: float = 0,
+			rt_windows: Optional[Sequence[Optional[RTWindow]]] = None,
+			) -> numpy.ndarray:
+		"""
+		Returns whether there is any signal in the intensity matrix within the bounds of each of the given masses.
+
+		Masses outside of the mass range of the intensity matrix have no signal, and are rejected without
+		looking at the intensities. For the remaining masses only the matching columns are examined.
+
+		:param masses:
+		:param left_bound:
+		:param right_bound:
+		:param min_intensity: The intensity which must be exceeded in at least one scan.
+		:param rt_windows: The retention time window to look for each mass in, in the same order as ``masses``.
+			A window of :py:obj:`None` looks in every scan.
+
+		:returns: A boolean array with one element per mass.
+		"""
+
+		target_masses = numpy.fromiter(masses, dtype=numpy.float64)
+		signal = numpy.zeros(len(target_masses), dtype=bool)
+
+		if rt_windows is not None and len(rt_windows) != len(target_masses):
+			raise ValueError(f"Expected {len(target_masses)} retention time windows, got {len(rt_windows)}")
+
+		if not len(target_masses) or not len(self._sorted_masses):
+			return signal
+
+		in_range = (target_masses + right_bound >= self._sorted_masses[0])
+		in_range &= (target_masses - left_bound <= self._sorted_masses[-1])
+
+		lower = numpy.searchsorted(self._sorted_masses, target_masses - left_bound, side="left")
+		upper = numpy.searchsorted(self._sorted_masses, target_masses + right_bound, side="right")
+
+		intensity_array = numpy.asarray(self.im._intensity_array)
+		for idx in numpy.flatnonzero(in_range & (upper > lower)).tolist():
+			columns = self._order[lower[idx]:upper[idx]]
+			start, stop = get_scan_range(self.im.time_list, None if rt_windows is None else rt_windows[idx])
+			signal[idx] = bool((intensity_array[start:stop, columns] > min_intensity).any())
+
+		return signal
+
+	def extract(
+			self,
+			masses: Iterable[float],
+			left_bound: float = 0.5,
+			right_bound: float = 0.5,
+			rt_window: Optional[RTWindow] = None,
+			) -> ExtractedIntensityMatrix:
+		"""
+		Construct an :class:`~pyms.eic.ExtractedIntensityMatrix` for the given masses.
+
+		The result is the same as from :func:`pyms.eic.build_extracted_intensity_matrix`.
+		A mass of ``169`` with bounds of ``0.3`` and ``0.7`` would include every mass
+		between ``168.7`` and ``169.7`` (inclusive on both sides).
+
+		:param masses:
+		:param left_bound:
+		:param right_bound:
+		:param rt_window: If given, the result only contains the scans within this retention time window.
+
+		:raises ValueError: If none of the masses are within the mass range of the intensity matrix,
+			or if there are no scans in the window.
+		"""
+
+		return self.extract_windows([(masses, rt_window)], left_bound=left_bound, right_bound=right_bound)
+
+	def extract_windows(
+			self,
+			mass_windows: Iterable[Tuple[Iterable[float], Optional[RTWindow]]],
+			left_bound: float = 0.5,
+			right_bound: float = 0.5,
+			) -> ExtractedIntensityMatrix:
+		"""
+		Construct an :class:`~pyms.eic.ExtractedIntensityMatrix` for groups of masses in retention time windows.
+
+		The result contains the scans from the start of the earliest window to the end of the latest
+		(see :func:`~.get_scan_span`), so scan indices are relative to the first of those scans.
+		Each group's masses are only read from the scans within its own window, and are zero elsewhere.
+
+		:param mass_windows: Pairs of masses and the retention time window to extract them in.
+			A window of :py:obj:`None` extracts the masses from every scan.
+		:param left_bound:
+		:param right_bound:
+
+		:raises ValueError: If none of the masses are within the mass range of the intensity matrix,
+			or if there are no scans in any of the windows.
+		"""
+
+		groups = [
+				(self.get_indices(masses, left_bound=left_bound, right_bound=right_bound), rt_window)
+				for masses, rt_window in mass_windows
+				]
+		columns = numpy.unique(numpy.concatenate([group_columns for group_columns, _ in groups]))
+		if not len(columns):
+			raise ValueError("None of the masses are within the mass range of the intensity matrix.")
+
+		span_start, span_stop = get_scan_span(self.im.time_list, [rt_window for _, rt_window in groups])
+		if span_start == span_stop:
+			raise ValueError("None of the scans are within the retention time windows.")
+
+		intensity_array = numpy.asarray(self.im._intensity_array)
+
+		if all(rt_window is None for _, rt_window in groups):
+			extracted = intensity_array[:, columns]
+		else:
+			extracted = numpy.zeros((span_stop - span_start, len(columns)), dtype=intensity_array.dtype)
+			for group_columns, rt_window in groups:
+				start, stop = get_scan_range(self.im.time_list, rt_window)
+				positions = numpy.searchsorted(columns, group_columns)
+				extracted[start - span_start:stop - span_start, positions] = intensity_array[start:stop][:, group_columns]
+
+		return ExtractedIntensityMatrix(
+				time_list=self.im.time_list[span_start:span_stop],
+				mass_list=[self.im._mass_list[idx] for idx in columns],
+				intensity_array=extracted,
+				)
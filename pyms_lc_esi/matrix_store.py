@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+#
+#  matrix_store.py
+"""
+On-disk storage of intensity matrices which can be memory-mapped.
+
+An intensity matrix is stored as a directory containing three NumPy ``.npy`` files:
+the retention times, the mass axis, and the intensities.
+The intensities are stored in column-major (Fortran) order,
+so the intensities for each mass are contiguous on disk.
+
+When loaded with ``mmap=True`` only the columns actually used
+(for example by :meth:`.MassIndex.extract` in :func:`~.make_im_for_adducts`) are read from disk,
+and several processes loading the same matrix share a single copy in the operating system's page cache.
+"""
+#
+#  Copyright © 2020-2023 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import os
+
+# 3rd party
+import numpy
+from domdf_python_tools.paths import PathPlus
+from domdf_python_tools.typing import PathLike
+from pyms.IntensityMatrix import BaseIntensityMatrix, IntensityMatrix
+
+__all__ = ["is_intensity_matrix_store", "load_intensity_matrix", "save_array", "save_intensity_matrix"]
+
+_TIME_FILENAME = "time_list.npy"
+_MASS_FILENAME = "mass_list.npy"
+_INTENSITY_FILENAME = "intensity_array.npy"
+
+
+def save_array(filename: PathPlus, array: numpy.ndarray) -> None:
+	"""
+	Save the array to a ``.npy`` file.
+
+	The array is written to a temporary file first, so a partially written file is never loaded.
+
+	:param filename:
+	:param array:
+	"""
+
+	tmp_filename = filename.with_name(f"{filename.name}.{os.getpid()}.tmp")
+
+	with tmp_filename.open("wb") as fp:
+		numpy.save(fp, array)
+
+	os.replace(tmp_filename, filename)
+
+
+def save_intensity_matrix(im: BaseIntensityMatrix, directory: PathLike) -> None:
+	"""
+	Save the intensity matrix to the given directory.
+
+	:param im:
+	:param directory: The directory to save the matrix in. Created if it does not exist.
+	"""
+
+	directory = PathPlus(directory)
+	directory.maybe_make(parents=True)
+
+	# The intensities are written last, as their presence marks the store as complete.
+	save_array(directory / _TIME_FILENAME, numpy.asarray(im._time_list, dtype=numpy.float64))
+	save_array(directory / _MASS_FILENAME, numpy.asarray(im._mass_list, dtype=numpy.float64))
+	save_array(directory / _INTENSITY_FILENAME, numpy.asfortranarray(im._intensity_array))
+
+
+def is_intensity_matrix_store(directory: PathLike) -> bool:
+	"""
+	Returns whether ``directory`` contains an intensity matrix saved with :func:`~.save_intensity_matrix`.
+
+	:param directory:
+	"""
+
+	directory = PathPlus(directory)
+	return all((directory / filename).is_file() for filename in (_TIME_FILENAME, _MASS_FILENAME, _INTENSITY_FILENAME))
+
+
+def load_intensity_matrix(directory: PathLike, mmap: bool = True) -> IntensityMatrix:
+	"""
+	Load an intensity matrix saved with :func:`~.save_intensity_matrix`.
+
+	:param directory:
+	:param mmap: Whether to memory-map the intensities (read-only) rather than reading them into memory.
+	"""
+
+	directory = PathPlus(directory)
+
+	if not is_intensity_matrix_store(directory):
+		raise FileNotFoundError(f"No intensity matrix found in {directory.as_posix()!r}")
+
+	time_list = numpy.load(directory / _TIME_FILENAME)
+	mass_list = numpy.load(directory / _MASS_FILENAME)
+	intensity_array = numpy.load(directory / _INTENSITY_FILENAME, mmap_mode='r' if mmap else None)
+
+	return IntensityMatrix(time_list.tolist(), mass_list.tolist(), intensity_array)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+#
+#  noise.py
+"""
+Deterministic estimation of the noise level of ion chromatograms.
+"""
+#
+#  Copyright © 2020-2023 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+from typing import Optional, Union
+
+# 3rd party
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+from pyms.IonChromatogram import IonChromatogram
+
+__all__ = ["rolling_mad_noise"]
+
+# Scale factor making the median absolute deviation an estimate of the standard deviation,
+# as in pyms.Utils.Math.MAD
+_MAD_SCALE = 0.6745
+
+# The number of windows whose MAD is calculated at once, to limit memory use.
+_CHUNK_SIZE = 1024
+
+
+def rolling_mad_noise(
+		ic: Union[IonChromatogram, numpy.ndarray],
+		window: int = 256,
+		step: Optional[int] = None,
+		) -> float:
+	"""
+	Estimate the noise level of an ion chromatogram from the median absolute deviation (MAD) of rolling windows.
+
+	This is a deterministic alternative to :func:`pyms.Noise.Analysis.window_analyzer`.
+	Rather than calculating the MAD of randomly placed windows, it calculates the MAD of windows
+	placed every ``step`` scans along the chromatogram. As with :func:`~pyms.Noise.Analysis.window_analyzer`,
+	the noise estimate is given by the minimum MAD.
+
+	:param ic: The ion chromatogram, or an array of its intensities.
+	:param window: The width of each window, in scans.
+	:param step: The number of scans between the starts of consecutive windows.
+		Defaults to a quarter of ``window``.
+
+	:return: The noise estimate.
+	"""
+
+	if isinstance(ic, IonChromatogram):
+		intensities = numpy.asarray(ic.intensity_array, dtype=numpy.float64)
+	else:
+		intensities = numpy.asarray(ic, dtype=numpy.float64)
+
+	if not len(intensities):
+		raise ValueError("Cannot estimate the noise of an empty chromatogram.")
+
+	if step is None:
+		step = max(1, window // 4)
+
+	window = max(1, min(window, len(intensities)))
+	windows = sliding_window_view(intensities, window)[::step]
+
+	noise_level = float(intensities.max() - intensities.min())
+
+	for start in range(0, len(windows), _CHUNK_SIZE):
+		chunk = windows[start:start + _CHUNK_SIZE]
+		medians = numpy.median(chunk, axis=1)
+		mads = numpy.median(numpy.abs(chunk - medians[:, numpy.newaxis]), axis=1) / _MAD_SCALE
+		noise_level = min(noise_level, float(mads.min()))
+
+	return noise_level
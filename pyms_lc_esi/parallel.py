@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+#
+#  parallel.py
+"""
+Screen many samples in parallel.
+"""
+#
+#  Copyright © 2020-2023 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import os
+import traceback
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Literal, Optional, Sequence, Tuple, Union
+
+# 3rd party
+import attr
+from chemistry_tools.formulae import Formula
+from pyms.IntensityMatrix import IntensityMatrix
+from pyms.Peak import Peak
+
+# this package
+from pyms_lc_esi.adducts import Adduct
+from pyms_lc_esi.mass_index import RTWindows
+from pyms_lc_esi.peak_filter import PeakFilter
+from pyms_lc_esi.peak_finder import NoiseStrategy, find_peak_records_for_analytes, find_peaks_for_analytes
+from pyms_lc_esi.peak_record import PeakRecord
+from pyms_lc_esi.spectra import AbundanceCutoff
+
+__all__ = ["ScreeningResult", "screen_samples"]
+
+
+@attr.s
+class ScreeningResult:
+	"""
+	The result of screening a sample for one or more analytes.
+	"""
+
+	#: The sample which was screened, as passed to :func:`~.screen_samples`.
+	sample: Any = attr.ib()
+
+	#: The analytes the sample was screened for.
+	analytes: List[Formula] = attr.ib()
+
+	#: The peaks found for each analyte, in the same order as :attr:`~.ScreeningResult.analytes`.
+	#: These are :class:`~.PeakRecord` objects if ``compact`` was :py:obj:`True`.
+	#: :py:obj:`None` if the job failed.
+	peaks: Optional[List[List[Union[Peak, PeakRecord]]]] = attr.ib(default=None)
+
+	#: The formatted traceback of the exception raised by the job, if it failed.
+	error: Optional[str] = attr.ib(default=None)
+
+	@property
+	def success(self) -> bool:
+		"""
+		Whether the sample was screened successfully.
+		"""
+
+		return self.error is None
+
+
+# Formula objects cannot be unpickled (as they are subclasses of defaultdict with a different signature),
+# so formulae and adducts are sent to the worker processes as their compositions.
+_FormulaState = Tuple[Dict[str, int], int]
+_AdductState = Tuple[str, _FormulaState, Literal["add", "sub"]]
+
+
+def _formula_to_state(formula: Formula) -> _FormulaState:
+	return dict(formula), formula.charge
+
+
+def _formula_from_state(state: _FormulaState) -> Formula:
+	composition, charge = state
+	return Formula(composition, charge=charge)
+
+
+def _adduct_to_state(adduct: Adduct) -> _AdductState:
+	return adduct.name, _formula_to_state(adduct.formula), adduct.operation
+
+
+def _adduct_from_state(state: _AdductState) -> Adduct:
+	name, formula_state, operation = state
+	return Adduct(name, _formula_from_state(formula_state), operation)
+
+
+def _screen_sample(
+		loader: Callable[[Any], IntensityMatrix],
+		sample: Any,
+		analyte_states: List[_FormulaState],
+		adduct_states: List[_AdductState],
+		points: int,
+		left_bound: float,
+		right_bound: float,
+		min_abundance: Union[float, AbundanceCutoff],
+		compact: bool,
+		noise: NoiseStrategy,
+		peak_filter: Optional[PeakFilter],
+		scans: int,
+		prescreen: bool,
+		max_width: Optional[int],
+		rt_windows: Optional[Sequence[Optional[RTWindows]]],
+		) -> Tuple[Optional[List[List[Union[Peak, PeakRecord]]]], Optional[str]]:
+	"""
+	Load and screen a single sample, capturing any exception raised.
+
+	:param loader:
+	:param sample:
+	:param analyte_states:
+	:param adduct_states:
+	:param points:
+	:param left_bound:
+	:param right_bound:
+	:param min_abundance:
+	:param compact:
+	:param noise:
+	:param peak_filter:
+	:param scans:
+	:param prescreen:
+	:param max_width:
+	:param rt_windows:
+
+	:returns: The peaks for each analyte, and the formatted traceback if an exception was raised.
+	"""
+
+	try:
+		im = loader(sample)
+
+		# In compact mode the peaks are found as records, so no mass spectra are constructed.
+		find = find_peak_records_for_analytes if compact else find_peaks_for_analytes
+		found_peaks = find(
+				im,
+				map(_formula_from_state, analyte_states),
+				map(_adduct_from_state, adduct_states),
+				points=points,
+				left_bound=left_bound,
+				right_bound=right_bound,
+				min_abundance=min_abundance,
+				noise=noise,
+				peak_filter=peak_filter,
+				scans=scans,
+				prescreen=prescreen,
+				max_width=max_width,
+				rt_windows=rt_windows,
+				)
+		peaks: List[List[Union[Peak, PeakRecord]]] = [list(analyte_peaks) for analyte_peaks in found_peaks]
+
+	except Exception:
+		return None, traceback.format_exc()
+
+	return peaks, None
+
+
+def _screen_sample_isolated(args: Tuple) -> Tuple[Optional[List[List[Union[Peak, PeakRecord]]]], Optional[str]]:
+	"""
+	Screen a single sample in its own worker process.
+
+	:param args: The arguments for :func:`~._screen_sample`.
+
+	:raises concurrent.futures.process.BrokenProcessPool: If the job crashes the worker process.
+	"""
+
+	with ProcessPoolExecutor(max_workers=1) as executor:
+		return executor.submit(_screen_sample, *args).result()
+
+
+def screen_samples(
+		samples: Iterable[Any],
+		loader: Callable[[Any], IntensityMatrix],
+		analytes: Sequence[Formula],
+		adducts: Iterable[Adduct],
+		points: int = 3,
+		left_bound: float = 0.1,
+		right_bound: float = 0.1,
+		min_abundance: Union[float, AbundanceCutoff] = 0.001,
+		per_analyte: bool = False,
+		compact: bool = False,
+		noise: NoiseStrategy = "window",
+		peak_filter: Optional[PeakFilter] = None,
+		scans: int = 1,
+		prescreen: bool = False,
+		max_width: Optional[int] = None,
+		rt_windows: Optional[Sequence[Optional[RTWindows]]] = None,
+		max_workers: Optional[int] = None,
+		max_pending: Optional[int] = None,
+		) -> Iterator[ScreeningResult]:
+	"""
+	Screen many samples for the given adducts of the analytes, using a pool of worker processes.
+
+	Each job loads a sample with ``loader`` and finds peaks with :func:`~.find_peaks_for_analytes`.
+	An exception raised by a job (for example, from a corrupt data file) is recorded in the
+	:attr:`~.ScreeningResult.error` attribute of its result rather than stopping the remaining jobs.
+	If a job crashes its worker process, the pool is replaced and the jobs which were running
+	alongside it are rerun, so only the job which crashed is reported as failing.
+
+	:param samples: The samples to screen, such as the filenames of the raw data.
+	:param loader: A function which returns the :class:`~pyms.IntensityMatrix.IntensityMatrix` for a sample.
+		This must be picklable, such as a module-level function.
+	:param analytes:
+	:param adducts:
+	:param points:
+	:param left_bound:
+	:param right_bound:
+	:param min_abundance: Ignore isotopologues whose (absolute) abundance is below this threshold.
+		Alternatively, an :class:`~.AbundanceCutoff` giving a relative abundance threshold
+		or the number of isotopologues to include.
+	:param per_analyte: If :py:obj:`True` each (sample × analyte) combination is screened as a separate job.
+		Otherwise each sample is screened for all analytes in a single job.
+	:param compact: If :py:obj:`True` the peaks are returned as :class:`~.PeakRecord` objects,
+		which are much cheaper to send between processes than :class:`pyms.Peak.Peak` objects.
+	:param noise: How to determine the noise level. See :data:`~.NoiseStrategy`.
+		Functions must be picklable.
+	:param peak_filter: The criteria which peaks must meet. Defaults to :class:`~.PeakFilter` with its default values.
+	:param scans: Maxima fewer than this many scans apart are combined into a single peak.
+	:param prescreen: If :py:obj:`True`, adducts with no signal at their monoisotopic mass are skipped.
+		See :func:`~.find_peaks_for_analytes`.
+	:param max_width: The maximum number of scans on each side of the apex to include in each peak.
+	:param rt_windows: The retention time window to search for each analyte in, in the same order as ``analytes``.
+		See :func:`~.find_peaks_for_analytes`.
+	:param max_workers: The maximum number of worker processes. Defaults to the number of CPUs.
+	:param max_pending: The maximum number of jobs submitted to the pool but whose results have not yet been yielded.
+		This bounds the number of samples and results held in memory at once.
+		Defaults to twice the number of worker processes.
+
+	:returns: An iterator over the results of each job, in the same order as ``samples``
+		(and then ``analytes``, if ``per_analyte`` is :py:obj:`True`).
+	"""
+
+	analytes = list(analytes)
+	adduct_states = [_adduct_to_state(adduct) for adduct in adducts]
+
+	if rt_windows is not None and len(rt_windows) != len(analytes):
+		raise ValueError(f"Expected {len(analytes)} retention time windows, got {len(rt_windows)}")
+
+	jobs: Iterable[Tuple[Any, List[Formula], Optional[Sequence[Optional[RTWindows]]]]]
+	if per_analyte:
+		jobs = (
+				(sample, [analyte], None if rt_windows is None else [rt_windows[analyte_idx]])
+				for sample in samples
+				for analyte_idx, analyte in enumerate(analytes)
+				)
+	else:
+		jobs = ((sample, analytes, rt_windows) for sample in samples)
+
+	if max_workers is None:
+		max_workers = os.cpu_count() or 1
+	if max_pending is None:
+		max_pending = 2 * max_workers
+
+	executor = ProcessPoolExecutor(max_workers=max_workers)
+	pending: Deque[Tuple[Any, List[Formula], Tuple, Future]] = deque()
+
+	def submit(args: Tuple) -> Future:
+		nonlocal executor
+
+		try:
+			return executor.submit(_screen_sample, *args)
+		except BrokenProcessPool:
+			# A worker process died. The jobs it took down with it are rerun by next_result().
+			executor.shutdown(wait=False)
+			executor = ProcessPoolExecutor(max_workers=max_workers)
+			return executor.submit(_screen_sample, *args)
+
+	def next_result() -> ScreeningResult:
+		sample, job_analytes, args, future = pending.popleft()
+		try:
+			try:
+				peaks, error = future.result()
+			except BrokenProcessPool:
+				# When a worker process dies every job in the pool fails, not just the one which caused it.
+				# Rerun the job on its own so only the job which crashed is reported as failing.
+				peaks, error = _screen_sample_isolated(args)
+		except Exception:
+			# e.g. the sample could not be pickled, or the job crashed its worker process.
+			return ScreeningResult(sample, job_analytes, error=traceback.format_exc())
+
+		return ScreeningResult(sample, job_analytes, peaks=peaks, error=error)
+
+	try:
+		for sample, job_analytes, job_rt_windows in jobs:
+			args = (
+					loader,
+					sample,
+					[_formula_to_state(analyte) for analyte in job_analytes],
+					adduct_states,
+					points,
+					left_bound,
+					right_bound,
+					min_abundance,
+					compact,
+					noise,
+					peak_filter,
+					scans,
+					prescreen,
+					max_width,
+					job_rt_windows,
+					)
+			pending.append((sample, job_analytes, args, submit(args)))
+
+			if len(pending) >= max_pending:
+				yield next_result()
+
+		while pending:
+			yield next_result()
+
+	finally:
+		executor.shutdown()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+#  peak_filter.py
+"""
+Array-based filtering of candidate peaks.
+"""
+#
+#  Copyright © 2020-2023 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# stdlib
+from typing import Union
+
+# 3rd party
+import attr
+import numpy
+
+__all__ = ["NoiseMultiple", "PeakFilter", "Threshold"]
+
+
+@attr.s(frozen=True)
+class NoiseMultiple:
+	"""
+	A threshold derived from the noise level of the chromatogram.
+	"""
+
+	#: The noise level is multiplied by this factor to give the threshold.
+	factor: float = attr.ib(converter=float)
+
+	def resolve(self, noise_level: float) -> float:
+		"""
+		Returns the threshold for the given noise level.
+
+		:param noise_level:
+		"""
+
+		return self.factor * noise_level
+
+
+#: Either a fixed threshold or a :class:`~.NoiseMultiple`.
+Threshold = Union[float, NoiseMultiple]
+
+
+def _resolve(threshold: Threshold, noise_level: float) -> float:
+	if isinstance(threshold, NoiseMultiple):
+		return threshold.resolve(noise_level)
+	else:
+		return float(threshold)
+
+
+@attr.s(frozen=True)
+class PeakFilter:
+	"""
+	Criteria which candidate peaks must meet to be reported.
+
+	The criteria are applied to arrays of candidate peaks at once, so large numbers of candidates
+	can be discarded before any :class:`pyms.Peak.Peak` objects are constructed.
+
+	The default criteria are those historically used by :func:`~.peak_finder`.
+	"""
+
+	#: The minimum number of masses with intensities at or above :attr:`~.ion_cutoff` at the apex.
+	min_ions: int = attr.ib(default=2)
+
+	#: The intensity at or above which a mass counts towards :attr:`~.min_ions`.
+	ion_cutoff: Threshold = attr.ib(default=NoiseMultiple(1))
+
+	#: The total intensity of the apex must be at or above this threshold.
+	min_apex_intensity: Threshold = attr.ib(default=0)
+
+	#: The area of the peak must be greater than this threshold.
+	min_area: Threshold = attr.ib(default=1000)
+
+	#: The distance between the bounds of the peak, in scans, must be greater than this.
+	min_width: int = attr.ib(default=3)
+
+	def apex_mask(self, apex_intensities: numpy.ndarray, noise_level: float) -> numpy.ndarray:
+		"""
+		Returns a boolean mask of the candidate peaks which pass the criteria for the apex.
+
+		:param apex_intensities: A 2D array of the intensity of each mass (columns) at the apex of each candidate (rows).
+		:param noise_level:
+		"""
+
+		apex_intensities = numpy.asarray(apex_intensities, dtype=numpy.float64)
+		n_ions = numpy.count_nonzero(apex_intensities >= _resolve(self.ion_cutoff, noise_level), axis=1)
+		mask = n_ions >= self.min_ions
+
+		min_apex_intensity = _resolve(self.min_apex_intensity, noise_level)
+		if min_apex_intensity:
+			mask &= apex_intensities.sum(axis=1) >= min_apex_intensity
+
+		return mask
+
+	def area_mask(self, areas: numpy.ndarray, widths: numpy.ndarray, noise_level: float) -> numpy.ndarray:
+		"""
+		Returns a boolean mask of the candidate peaks which pass the criteria for the area and width.
+
+		:param areas:
+		:param widths: The distance between the bounds of each peak, in scans.
+		:param noise_level:
+		"""
+
+		areas = numpy.asarray(areas, dtype=numpy.float64)
+		widths = numpy.asarray(widths)
+		return (widths > self.min_width) & (areas > _resolve(self.min_area, noise_level))
@@ -27,103 +27,358 @@ Find peaks in LC-ESI-MS data.
 #
 
 # stdlib
+import logging
 from itertools import chain
-from typing import Iterable, Iterator, List, Tuple
+from typing import Callable, Iterable, Iterator, List, Literal, Mapping, Optional, Sequence, Tuple, Union
 
 # 3rd party
+import numpy
 from chemistry_tools.formulae import Formula
 from domdf_python_tools.words import word_join
-from pyms.BillerBiemann import get_maxima_indices, num_ions_threshold
-from pyms.eic import ExtractedIntensityMatrix, build_extracted_intensity_matrix
+from numpy.lib.stride_tricks import sliding_window_view
+from pyms.eic import ExtractedIntensityMatrix
 from pyms.IntensityMatrix import IntensityMatrix
+from pyms.IonChromatogram import IonChromatogram
 from pyms.Noise.Analysis import window_analyzer
 from pyms.Peak import Peak
+from pyms.Spectrum import MassSpectrum
 
 # this package
-from pyms_lc_esi.adducts import Adduct, get_adduct_spectra
+from pyms_lc_esi.adducts import Adduct, AdductSet, get_adduct_spectra
+from pyms_lc_esi.instrumentation import stage
+from pyms_lc_esi.mass_index import MassIndex, RTWindow, RTWindows, get_scan_range, get_scan_span
+from pyms_lc_esi.noise import rolling_mad_noise
+from pyms_lc_esi.peak_filter import PeakFilter
+from pyms_lc_esi.peak_record import PEAK_RECORD_DTYPE, PeakRecord, peak_records_from_array
+from pyms_lc_esi.spectra import AbundanceCutoff
+
+__all__ = [
+		"BOUND_AREA_TOLERANCE",
+		"candidates_from_maxima",
+		"find_peak_records",
+		"find_peak_records_for_analytes",
+		"find_peaks_for_analytes",
+		"flank_area",
+		"make_im_for_adducts",
+		"make_ims_for_analytes",
+		"NoiseStrategy",
+		"peak_finder",
+		"peaks_from_maxima",
+		"sum_area",
+		"sum_areas",
+		]
+
+logger = logging.getLogger(__name__)
+
+
+def _intensity_buffer(
+		e_im: ExtractedIntensityMatrix,
+		start: int = 0,
+		stop: Optional[int] = None,
+		) -> numpy.ndarray:
+	"""
+	Returns the intensities of the extracted intensity matrix as a single C-contiguous array.
+
+	The array is only copied if it is not already a C-contiguous array of floats.
+
+	:param e_im:
+	:param start: The index of the first scan to include.
+	:param stop: The index of the scan after the last to include. Defaults to the last scan.
+	"""
+
+	return numpy.ascontiguousarray(e_im._intensity_array[start:stop], dtype=numpy.float64)
+
+
+def _tic_array(e_im: ExtractedIntensityMatrix) -> numpy.ndarray:
+	"""
+	Returns the total intensity of each scan in the extracted intensity matrix.
+
+	:param e_im:
+	"""
+
+	return _tic_from_buffer(_intensity_buffer(e_im))
+
+
+def _tic_from_buffer(intensity_array: numpy.ndarray) -> numpy.ndarray:
+	"""
+	Returns the total intensity of each scan (row) in the array of intensities.
+
+	:param intensity_array:
+	"""
+
+	# Accumulate one mass at a time (rather than with ``intensity_array.sum(axis=1)``)
+	# so the totals are identical to summing each scan with :func:`sum`.
+	tic = numpy.zeros(len(intensity_array), dtype=numpy.float64)
+	for column in intensity_array.T:
+		tic += column
 
-__all__ = ["make_im_for_adducts", "peak_finder", "peaks_from_maxima", "sum_area"]
+	return tic
+
+
+def _maxima_indices(intensities: numpy.ndarray, points: int = 3) -> numpy.ndarray:
+	"""
+	Returns the scan indices for the apexes of the peaks in ``intensities``.
+
+	This is a vectorized equivalent of :func:`pyms.BillerBiemann.get_maxima_indices`.
+
+	:param intensities:
+	:param points: Number of scans over which to consider a maxima to be a peak.
+	"""
+
+	half = int(points / 2)
+	points = 2 * half + 1  # ensure odd number of points
+
+	if len(intensities) < points:
+		return numpy.empty(0, dtype=numpy.intp)
+
+	# window_max[i] is the largest intensity in intensities[i:i + half]
+	window_max = sliding_window_view(intensities, half).max(axis=1)
+
+	centres = numpy.arange(half, len(intensities) - half)
+	mid = intensities[centres]
+	max_left = window_max[centres - half]
+	max_right = window_max[centres + 1]
+
+	is_maximum = (mid > max_left) & (mid > max_right)
+	is_plateau_start = (mid > max_left) & (mid == max_right)  # start of plateau following rise
+	is_plateau_end = (mid == max_left) & (mid > max_right)  # start of fall from plateau
+
+	# A plateau is a peak if its end follows its start with no maximum (or another plateau end) in between.
+	events = numpy.flatnonzero(is_maximum | is_plateau_start | is_plateau_end)
+	follows_plateau_start = numpy.zeros(len(events), dtype=bool)
+	follows_plateau_start[1:] = is_plateau_start[events[:-1]]
+	closes_plateau = is_plateau_end[events] & follows_plateau_start
+
+	event_centres = centres[events]
+	plateau_centres = numpy.zeros(len(events), dtype=numpy.intp)
+	plateau_centres[1:] = (event_centres[:-1] + event_centres[1:]) // 2  # mid point
+
+	apexes = numpy.where(is_maximum[events], event_centres, plateau_centres)
+	return apexes[is_maximum[events] | closes_plateau]
+
+
+def _merge_close_apexes(apex_indices: numpy.ndarray, tic: numpy.ndarray, scans: int = 1) -> numpy.ndarray:
+	"""
+	Combine apexes which are fewer than ``scans`` scans apart, keeping the most intense apex of each group.
+
+	Each apex is merged into the most intense apex of the current group (the earliest wins a tie)
+	if it is fewer than ``scans`` scans from it, and otherwise starts a new group.
+
+	:param apex_indices: The scan indices of the apexes, in ascending order.
+	:param tic: The total intensity of each scan.
+	:param scans: The number of scans within which to combine apexes. ``1`` does not combine any apexes.
+	"""
+
+	if scans <= 1 or len(apex_indices) < 2:
+		return apex_indices
+
+	indices = apex_indices.tolist()
+	intensities = tic[apex_indices].tolist()
+
+	kept: List[int] = []
+	best, best_intensity = indices[0], intensities[0]
+
+	for apex_index, intensity in zip(indices[1:], intensities[1:]):
+		if apex_index - best >= scans:
+			kept.append(best)
+			best, best_intensity = apex_index, intensity
+		elif intensity > best_intensity:
+			best, best_intensity = apex_index, intensity
+
+	kept.append(best)
+
+	return numpy.array(kept, dtype=apex_indices.dtype)
+
+
+#: The fraction of the area accumulated so far which each scan in the flank of a peak must exceed.
+#:
+#: As the intensities in a flank never increase, a flank can span at most ``1 / BOUND_AREA_TOLERANCE`` scans.
+BOUND_AREA_TOLERANCE = 0.0005 / 2  # half of 0.05 %
+
+
+def flank_area(flank: numpy.ndarray, apex_intensity: float) -> Tuple[float, int]:
+	"""
+	Returns the area of one flank of a peak (including the apex) and the number of scans it spans.
+
+	See :func:`~.sum_area` for how the extent of the flank is determined.
+
+	:param flank: The intensities of the scans on one side of the apex, ordered outwards from the apex.
+	:param apex_intensity:
+	"""
+
+	# Running area before each scan is added, and after the last.
+	intensities = numpy.concatenate(([apex_intensity], flank))
+	running_area = numpy.cumsum(intensities)
+	previous_intensity = intensities[:-1]
+
+	accepted = (flank <= previous_intensity) & (flank > (running_area[:-1] * BOUND_AREA_TOLERANCE))
+	n_scans = len(flank) if accepted.all() else int(accepted.argmin())
+
+	return float(running_area[n_scans]), n_scans
+
+
+def sum_areas(
+		apex_indices: Iterable[int],
+		e_im: ExtractedIntensityMatrix,
+		max_width: Optional[int] = None,
+		) -> List[Tuple[float, int, int]]:
+	"""
+	Returns the areas and absolute bounds (as scans) for the peaks with apexes at ``apex_indices``.
+
+	This is equivalent to calling :func:`~.sum_area` for each apex.
+
+	:param apex_indices: The scan indices of the apexes of the peaks.
+	:param e_im:
+	:param max_width: See :func:`~.sum_area`.
+	"""
+
+	return _sum_areas(apex_indices, _tic_array(e_im), max_width=max_width)
+
+
+def _sum_areas(
+		apex_indices: Iterable[int],
+		tic: numpy.ndarray,
+		max_width: Optional[int] = None,
+		) -> List[Tuple[float, int, int]]:
+	"""
+	Returns the areas and absolute bounds (as scans) for the peaks with apexes at ``apex_indices``.
+
+	:param apex_indices:
+	:param tic: The total intensity of each scan.
+	:param max_width:
+	"""
+
+	n_scans = len(tic)
+
+	if max_width is None:
+		# A flank cannot extend past a scan which is more intense than its neighbour nearer the apex,
+		# so only the scans up to the next such scan need to be considered for each apex.
+		rises = numpy.flatnonzero(tic[1:] > tic[:-1]) + 1
+		falls = numpy.flatnonzero(tic[:-1] > tic[1:])
+	elif max_width < 0:
+		raise ValueError("'max_width' cannot be negative")
+
+	areas = []
+
+	for apex_index in apex_indices:
+		apex_intensity = tic[apex_index]
+
+		if max_width is None:
+			rise_pos = numpy.searchsorted(rises, apex_index, side="right")
+			rhs_stop = rises[rise_pos] + 1 if rise_pos < len(rises) else n_scans
+
+			fall_pos = numpy.searchsorted(falls, apex_index, side="left")
+			lhs_start = falls[fall_pos - 1] if fall_pos else 0
+		else:
+			# Only the window of scans within the maximum width is considered,
+			# so the cost depends on the width of the peak rather than the length of the run.
+			rhs_stop = apex_index + 1 + max_width
+			lhs_start = max(apex_index - max_width, 0)
+
+		rhs_area, rhs_scans = flank_area(tic[apex_index + 1:rhs_stop], apex_intensity)
+		lhs_area, lhs_scans = flank_area(tic[lhs_start:apex_index][::-1], apex_intensity)
+
+		area = lhs_area + rhs_area - apex_intensity  # apex intensity was counted for each half
+		areas.append((area, apex_index - lhs_scans, apex_index + rhs_scans))
+
+	return areas
 
 
 def sum_area(
 		apex_index: int,
 		e_im: ExtractedIntensityMatrix,
+		max_width: Optional[int] = None,
 		) -> Tuple[float, int, int]:
 	"""
 	Returns the area and absolute bounds (as scans) for the peak with the apex at ``apex_index``.
 
-	.. TODO:: explain how bounds are determined
+	Starting at the apex, scans are added to the peak on each side for as long as
+	the total intensity of each scan is no greater than the scan before it
+	and is greater than 0.025% of the area of that half of the peak so far.
 
 	:param apex_index: The scan index of the apex of the peak.
 	:param e_im:
+	:param max_width: The maximum number of scans on each side of the apex to include in the peak.
+		If :py:obj:`None` the width of the peak is not limited.
 	"""
 
-	# print(peak, peak.rt / 60)
-
-	# print(f"Apexes at {apex_index}")
-	# print("Intensity at apex:")
+	return sum_areas([apex_index], e_im, max_width=max_width)[0]
 
-	apex_intensity = sum(e_im.intensity_array[apex_index])
-	rhs_area = lhs_area = last_intensity = apex_intensity
-	left_bound = right_bound = apex_index
-	bound_area_tolerance = 0.0005 / 2  # half of 0.05 %
 
-	for idx_offset, scan in enumerate(e_im.intensity_array[apex_index + 1:]):
-		scan_intensity = sum(scan)
+def _candidate_array(e_im: ExtractedIntensityMatrix, apex_indices: numpy.ndarray) -> numpy.ndarray:
+	"""
+	Returns a structured array of candidate peaks with apexes at the given scans, and no area.
 
-		if scan_intensity <= last_intensity and scan_intensity > (rhs_area * bound_area_tolerance):
-			last_intensity = scan_intensity
-			rhs_area += scan_intensity
-			right_bound = idx_offset + apex_index + 1
-		else:
-			break
+	:param e_im:
+	:param apex_indices:
+	"""
 
-	last_intensity = apex_intensity
+	candidates = numpy.empty(len(apex_indices), dtype=PEAK_RECORD_DTYPE)
+	candidates["apex_index"] = apex_indices
+	candidates["rt"] = numpy.asarray(e_im.time_list, dtype=numpy.float64)[apex_indices]
+	candidates["area"] = numpy.nan
+	candidates["left_bound"] = apex_indices
+	candidates["right_bound"] = apex_indices
+	return candidates
 
-	for idx_offset, scan in enumerate(reversed(e_im.intensity_array[:apex_index])):
-		scan_intensity = sum(scan)
 
-		if scan_intensity <= last_intensity and scan_intensity > (lhs_area * bound_area_tolerance):
-			last_intensity = scan_intensity
-			lhs_area += scan_intensity
-			left_bound = (apex_index - idx_offset) - 1
-		else:
-			break
+def candidates_from_maxima(e_im: ExtractedIntensityMatrix, points: int = 3, scans: int = 1) -> numpy.ndarray:
+	"""
+	Returns the candidate peaks at maxima in the extracted intensity matrix.
 
-	area = lhs_area + rhs_area - apex_intensity  # apex intensity was counted for each half
+	The candidates are returned as a structured array with the dtype :data:`~.PEAK_RECORD_DTYPE`,
+	so no mass spectra are constructed.
 
-	# print("Peak area:")
-	# print(area)
+	:param e_im:
+	:param points:
+	:param scans: Maxima fewer than this many scans apart are combined into a single peak
+		at the most intense maximum. By default maxima are not combined.
+	"""
 
-	# print(f"right bound: {right_bound}", eic.get_time_at_index(right_bound) / 60)
-	# print(f"left bound: {left_bound}", eic.get_time_at_index(left_bound) / 60)
-	return area, left_bound, right_bound
+	tic = _tic_array(e_im)
+	apex_indices = _merge_close_apexes(_maxima_indices(tic, points=points), tic, scans=scans)
+	return _candidate_array(e_im, apex_indices)
 
 
-def peaks_from_maxima(e_im: ExtractedIntensityMatrix, points: int = 3) -> List[Peak]:
+def peaks_from_maxima(e_im: ExtractedIntensityMatrix, points: int = 3, scans: int = 1) -> List[Peak]:
 	"""
 	Returns a list of peaks from maxima in the extracted intensity matrix.
 
 	:param e_im:
 	:param points:
+	:param scans: See :func:`~.candidates_from_maxima`.
 	"""
 
-	# TODO: combine close peaks, via scans param.
-	intensity_list = []
-	peak_list = []
+	candidates = candidates_from_maxima(e_im, points=points, scans=scans)
+	return [record.to_peak(e_im) for record in peak_records_from_array(candidates)]
+
+
+def _adduct_mass_windows(
+		spectra: Mapping[str, MassSpectrum],
+		rt_window: Optional[RTWindows],
+		) -> List[Tuple[List[float], Optional[RTWindow]]]:
+	"""
+	Returns the masses of the adducts grouped by the retention time window they are to be extracted in.
+
+	The groups are passed to :meth:`.MassIndex.extract_windows`.
+
+	:param spectra: Mapping of adduct names to mass spectra.
+	:param rt_window:
+	"""
 
-	for row in e_im._intensity_array:
-		intensity_list.append(sum(row))
+	if not isinstance(rt_window, Mapping):
+		return [(sorted(set(chain.from_iterable(spectrum.mass_list for spectrum in spectra.values()))), rt_window)]
 
-	for apex_idx in get_maxima_indices(intensity_list, points=points):
-		rt = e_im.get_time_at_index(apex_idx)
-		ms = e_im.get_ms_at_index(apex_idx)
-		peak = Peak(rt, ms)
-		peak.bounds = (0, apex_idx, 0)
+	return [(spectrum.mass_list, rt_window.get(name)) for name, spectrum in spectra.items()]
 
-		peak_list.append(peak)
 
-	return peak_list
+def _get_mass_index(im: IntensityMatrix, mass_index: Optional[MassIndex]) -> MassIndex:
+	if mass_index is None:
+		return MassIndex(im)
+	elif mass_index.im is not im:
+		raise ValueError("'mass_index' was not built for 'im'")
+	else:
+		return mass_index
 
 
 def make_im_for_adducts(
@@ -132,66 +387,441 @@ def make_im_for_adducts(
 		adducts: Iterable[Adduct],
 		left_bound: float = 0.1,
 		right_bound: float = 0.1,
-		) -> ExtractedIntensityMatrix:
+		min_abundance: Union[float, AbundanceCutoff] = 0.001,
+		mass_index: Optional[MassIndex] = None,
+		prescreen: bool = False,
+		rt_window: Optional[RTWindows] = None,
+		) -> Optional[ExtractedIntensityMatrix]:
 	"""
-	Conxtructs a :class:`pyms.eic.ExtractedIntensityMatrix` for the given adducts of the analyte.
+	Constructs a :class:`pyms.eic.ExtractedIntensityMatrix` for the given adducts of the analyte.
 
 	:param im:
 	:param analyte:
 	:param adducts:
 	:param left_bound:
 	:param right_bound:
+	:param min_abundance: Ignore isotopologues whose abundance is below this threshold,
+		or an :class:`~.AbundanceCutoff`.
+	:param mass_index: A :class:`~.MassIndex` for ``im``. If :py:obj:`None` a new index is built.
+	:param prescreen: If :py:obj:`True`, adducts with no signal in ``im`` are discarded first.
+		See :meth:`.AdductSet.prescreen`.
+	:param rt_window: Only extract the masses from the scans in this retention time window.
+		See :meth:`.MassIndex.extract_windows`.
+
+	:returns: The extracted intensity matrix, or :py:obj:`None` if there is nothing to extract.
 	"""
 
+	mass_index = _get_mass_index(im, mass_index)
+
+	if prescreen:
+		adduct_set = adducts if isinstance(adducts, AdductSet) else AdductSet(adducts)
+		passed = adduct_set.prescreen(
+				[analyte],
+				mass_index,
+				left_bound=left_bound,
+				right_bound=right_bound,
+				rt_windows=[rt_window],
+				)[0]
+		if not passed.any():
+			logger.debug("None of the adducts of %s have any signal in the intensity matrix.", analyte)
+			return None
+		adducts = AdductSet([adduct for adduct, keep in zip(adduct_set, passed) if keep])
+
 	# Compile a list of masses for the adducts
-	spectra = get_adduct_spectra(analyte, adducts)
+	spectra = get_adduct_spectra(analyte, adducts, min_abundance=min_abundance)
 
-	print(spectra)
+	logger.debug("Adduct spectra: %s", spectra)
 	all_masses = sorted(set(chain.from_iterable(spectrum.mass_list for spectrum in spectra.values())))
 
-	print(f"Constructing ExtractedIntensityMatrix for m/z {word_join(map(str, all_masses))}")
+	if logger.isEnabledFor(logging.DEBUG):
+		logger.debug(f"Constructing ExtractedIntensityMatrix for m/z {word_join(map(str, all_masses))}")
+
+	if not len(mass_index.get_indices(all_masses, left_bound=left_bound, right_bound=right_bound)):
+		logger.debug("None of the masses of %s are within the mass range of the intensity matrix.", analyte)
+		return None
+
+	mass_windows = _adduct_mass_windows(spectra, rt_window)
+	start, stop = get_scan_span(im.time_list, [window for _, window in mass_windows])
+	if start == stop:
+		logger.debug("None of the scans are within the retention time windows for %s.", analyte)
+		return None
 
 	# Construct the extracted intensity matrix for the adducts
-	return build_extracted_intensity_matrix(im, masses=all_masses, left_bound=left_bound, right_bound=right_bound)
+	with stage("eic_extraction") as counts:
+		e_im = mass_index.extract_windows(
+				mass_windows,
+				left_bound=left_bound,
+				right_bound=right_bound,
+				)
+		counts["masses"] = len(all_masses)
+		counts["channels"] = len(e_im.mass_list)
+
+	return e_im
 
 
-def peak_finder(e_im: ExtractedIntensityMatrix, points: int = 3) -> Iterator[Peak]:
+def make_ims_for_analytes(
+		im: IntensityMatrix,
+		analytes: Iterable[Formula],
+		adducts: Iterable[Adduct],
+		left_bound: float = 0.1,
+		right_bound: float = 0.1,
+		min_abundance: Union[float, AbundanceCutoff] = 0.001,
+		mass_index: Optional[MassIndex] = None,
+		prescreen: bool = False,
+		rt_windows: Optional[Sequence[Optional[RTWindows]]] = None,
+		) -> List[Optional[ExtractedIntensityMatrix]]:
+	"""
+	Constructs a :class:`pyms.eic.ExtractedIntensityMatrix` for the given adducts of each analyte.
+
+	The result for each analyte is the same as from :func:`~.make_im_for_adducts`,
+	which documents the remaining parameters.
+
+	:param im:
+	:param analytes:
+	:param adducts:
+	:param rt_windows: The retention time window for each analyte, in the same order as ``analytes``.
+
+	:returns: A list of extracted intensity matrices (or :py:obj:`None`), in the same order as ``analytes``.
+	"""
+
+	adduct_set = adducts if isinstance(adducts, AdductSet) else AdductSet(adducts)
+	analytes = list(analytes)
+	mass_index = _get_mass_index(im, mass_index)
+
+	if rt_windows is not None and len(rt_windows) != len(analytes):
+		raise ValueError(f"Expected {len(analytes)} retention time windows, got {len(rt_windows)}")
+
+	if prescreen:
+		include = adduct_set.prescreen(
+				analytes,
+				mass_index,
+				left_bound=left_bound,
+				right_bound=right_bound,
+				rt_windows=rt_windows,
+				)
+	else:
+		include = None
+
+	adduct_table = adduct_set.table(analytes, min_abundance=min_abundance, include=include)
+
+	# Compile a list of masses for the adducts of each analyte
+	analyte_spectra = [adduct_table.spectra_for(analyte_idx) for analyte_idx in range(len(analytes))]
+	analyte_masses = [
+			sorted(set(chain.from_iterable(spectrum.mass_list for spectrum in spectra.values())))
+			for spectra in analyte_spectra
+			]
+
+	all_masses = sorted(set(chain.from_iterable(analyte_masses)))
+	e_ims: List[Optional[ExtractedIntensityMatrix]] = []
+
+	if not all_masses:
+		# Every adduct was screened out
+		return [None] * len(analytes)
+
+	if logger.isEnabledFor(logging.DEBUG):
+		logger.debug(f"Constructing ExtractedIntensityMatrix for m/z {word_join(map(str, all_masses))}")
+
+	if rt_windows is not None:
+		with stage("eic_extraction") as counts:
+			# Each analyte's masses are only read from the scans in its own windows.
+			channels = 0
+			for spectra, masses, rt_window in zip(analyte_spectra, analyte_masses, rt_windows):
+				if not len(mass_index.get_indices(masses, left_bound=left_bound, right_bound=right_bound)):
+					e_ims.append(None)
+					continue
+
+				mass_windows = _adduct_mass_windows(spectra, rt_window)
+				start, stop = get_scan_span(im.time_list, [window for _, window in mass_windows])
+				if start == stop:
+					e_ims.append(None)
+					continue
+
+				e_im = mass_index.extract_windows(
+						mass_windows,
+						left_bound=left_bound,
+						right_bound=right_bound,
+						)
+				channels += len(e_im.mass_list)
+				e_ims.append(e_im)
+
+			counts["masses"] = len(all_masses)
+			counts["channels"] = channels
+
+		return e_ims
+
+	if not len(mass_index.get_indices(all_masses, left_bound=left_bound, right_bound=right_bound)):
+		# None of the masses are within the mass range of the intensity matrix
+		return [None] * len(analytes)
+
+	with stage("eic_extraction") as counts:
+		# Construct a single extracted intensity matrix for all analytes
+		merged_e_im = mass_index.extract(all_masses, left_bound=left_bound, right_bound=right_bound)
+		merged_mass_list = numpy.asarray(merged_e_im.mass_list)
+
+		# Split out the columns which fall within the bounds of each analyte's masses
+		for masses in analyte_masses:
+			if not masses:
+				e_ims.append(None)
+				continue
+
+			target_masses = numpy.asarray(masses)
+			in_bounds = (merged_mass_list[:, numpy.newaxis] >= (target_masses - left_bound))
+			in_bounds &= (merged_mass_list[:, numpy.newaxis] <= (target_masses + right_bound))
+			columns = numpy.flatnonzero(in_bounds.any(axis=1))
+			if not len(columns):
+				e_ims.append(None)
+				continue
+
+			e_ims.append(
+					ExtractedIntensityMatrix(
+							time_list=merged_e_im.time_list,
+							mass_list=merged_mass_list[columns].tolist(),
+							intensity_array=merged_e_im._intensity_array[:, columns],
+							)
+					)
+
+		counts["masses"] = len(all_masses)
+		counts["channels"] = len(merged_mass_list)
+
+	return e_ims
+
+
+#: Ways of determining the noise level in :func:`~.peak_finder`.
+#:
+#: * ``'window'`` -- :func:`pyms.Noise.Analysis.window_analyzer`, which uses randomly placed windows.
+#: * ``'rolling_mad'`` -- :func:`~.rolling_mad_noise`, which is deterministic and faster.
+#: * A function taking the :class:`~pyms.IonChromatogram.IonChromatogram` and returning the noise level.
+#: * A fixed noise level.
+NoiseStrategy = Union[Literal["window", "rolling_mad"], Callable[[IonChromatogram], float], float]
+
+
+def _get_noise_level(eic: IonChromatogram, noise: NoiseStrategy) -> float:
+	if noise == "window":
+		# The windows are 256 scans wide by default, which cannot be placed in a shorter chromatogram
+		# (e.g. one restricted to a retention time window).
+		return window_analyzer(eic, window=min(256, len(eic.intensity_array)))
+	elif noise == "rolling_mad":
+		return rolling_mad_noise(eic)
+	elif callable(noise):
+		return noise(eic)
+	elif isinstance(noise, (int, float)):
+		return float(noise)
+	else:
+		raise ValueError(f"Unsupported noise strategy {noise!r}")
+
+
+def find_peak_records(
+		e_im: ExtractedIntensityMatrix,
+		points: int = 3,
+		noise: NoiseStrategy = "window",
+		peak_filter: Optional[PeakFilter] = None,
+		scans: int = 1,
+		max_width: Optional[int] = None,
+		rt_window: Optional[RTWindow] = None,
+		) -> numpy.ndarray:
 	"""
 	Find and filter peaks in the extracted intensity matrix, and calculate peak areas.
 
-	:param e_im:
-	:param points:
+	The peaks are returned as a structured array with the dtype :data:`~.PEAK_RECORD_DTYPE`,
+	so no mass spectra are constructed. The parameters are the same as for :func:`~.peak_finder`.
 	"""
 
+	if peak_filter is None:
+		peak_filter = PeakFilter()
+
+	start, stop = get_scan_range(e_im.time_list, rt_window)
+	if start == stop:
+		# There are no scans in the window.
+		return numpy.empty(0, dtype=PEAK_RECORD_DTYPE)
+
+	# All work is done on a single contiguous buffer of the intensities within the window.
+	intensity_array = _intensity_buffer(e_im, start, stop)
+	tic = _tic_from_buffer(intensity_array)
+
 	# Find peaks
-	# peaks = BillerBiemann(e_im, points=8, scans=3)
-	peaks = peaks_from_maxima(e_im, points=points)
+	with stage("maxima_detection") as counts:
+		apex_indices = _maxima_indices(tic, points=points)
+		counts["maxima"] = len(apex_indices)
+		apex_indices = _merge_close_apexes(apex_indices, tic, scans=scans)
+		counts["merged"] = counts["maxima"] - len(apex_indices)
 
-	eic = e_im.eic
+		# Candidates are kept as records of their position until they have passed every filter.
+		candidates = _candidate_array(e_im, apex_indices + start)
 
 	# Filter small peaks from peak list
-	noise_level = window_analyzer(eic)
-	print(f"Filtering peaks with fewer than {2}/{len(e_im.mass_list)} masses.")
-	print("noise_level:", noise_level)
-	filtered_peak_list = num_ions_threshold(peaks, n=2, cutoff=noise_level)
-	# filtered_peak_list = num_ions_threshold(peaks, n=1, cutoff=noise_level)
-	# filtered_peak_list = num_ions_threshold(peaks, n=3, cutoff=5000)
-	# filtered_peak_list = peaks
+	with stage("noise_analysis"):
+		eic: IonChromatogram
+		if rt_window is None:
+			eic = e_im.eic
+		else:
+			eic = IonChromatogram(tic, e_im.time_list[start:stop])
+		noise_level = _get_noise_level(eic, noise)
+
+	logger.debug("Filtering peaks with fewer than %d/%d masses.", peak_filter.min_ions, len(e_im.mass_list))
+	logger.debug("noise_level: %s", noise_level)
+
+	apex_intensities = intensity_array[candidates["apex_index"] - start]
+	candidates = candidates[peak_filter.apex_mask(apex_intensities, noise_level)][::-1]
+
+	# Estimate peak areas
+	with stage("area_integration") as counts:
+		peak_areas = _sum_areas((candidates["apex_index"] - start).tolist(), tic, max_width=max_width)
+		counts["peaks"] = len(peak_areas)
+
+	if peak_areas:
+		areas, left_bounds, right_bounds = zip(*peak_areas)
+		candidates["area"] = areas
+		candidates["left_bound"] = numpy.asarray(left_bounds) + start
+		candidates["right_bound"] = numpy.asarray(right_bounds) + start
+
+	widths = candidates["right_bound"] - candidates["left_bound"]
+	return candidates[peak_filter.area_mask(candidates["area"], widths, noise_level)]
+
+
+def peak_finder(
+		e_im: ExtractedIntensityMatrix,
+		points: int = 3,
+		noise: NoiseStrategy = "window",
+		peak_filter: Optional[PeakFilter] = None,
+		scans: int = 1,
+		max_width: Optional[int] = None,
+		rt_window: Optional[RTWindow] = None,
+		) -> Iterator[Peak]:
+	"""
+	Find and filter peaks in the extracted intensity matrix, and calculate peak areas.
+
+	:param e_im:
+	:param points:
+	:param noise: How to determine the noise level. See :data:`~.NoiseStrategy`.
+	:param peak_filter: The criteria which peaks must meet. Defaults to :class:`~.PeakFilter`.
+	:param scans: See :func:`~.candidates_from_maxima`.
+	:param max_width: See :func:`~.sum_area`.
+	:param rt_window: Only consider the scans in this retention time window, given as ``(start, end)``.
+		Scan indices in the returned peaks are still relative to the whole of ``e_im``.
+	"""
 
-	for peak in filtered_peak_list[::-1]:
-		apex_index = eic.get_index_at_time(peak.rt)
+	records = find_peak_records(
+			e_im,
+			points=points,
+			noise=noise,
+			peak_filter=peak_filter,
+			scans=scans,
+			max_width=max_width,
+			rt_window=rt_window,
+			)
 
-		# Estimate peak area
-		peak.area, left_bound, right_bound = sum_area(apex_index, e_im)
-		assert peak.area is not None
+	# Only now are the mass spectra constructed.
+	for record in peak_records_from_array(records):
+		yield record.to_peak(e_im)
 
-		# Assign bounds to peak as offsets.
-		peak.bounds = (apex_index - left_bound, apex_index, right_bound - apex_index)
 
-		if (right_bound - left_bound) > 3 and peak.area > 1000:
-			# TODO: make 1000 dependent on data
+def find_peaks_for_analytes(
+		im: IntensityMatrix,
+		analytes: Iterable[Formula],
+		adducts: Iterable[Adduct],
+		points: int = 3,
+		left_bound: float = 0.1,
+		right_bound: float = 0.1,
+		min_abundance: Union[float, AbundanceCutoff] = 0.001,
+		mass_index: Optional[MassIndex] = None,
+		noise: NoiseStrategy = "window",
+		peak_filter: Optional[PeakFilter] = None,
+		scans: int = 1,
+		prescreen: bool = False,
+		max_width: Optional[int] = None,
+		rt_windows: Optional[Sequence[Optional[RTWindows]]] = None,
+		) -> List[List[Peak]]:
+	"""
+	Find peaks for the given adducts of each analyte in the intensity matrix.
+
+	The masses are extracted with :func:`~.make_ims_for_analytes` and peaks are found with :func:`~.peak_finder`,
+	which document the remaining parameters.
+
+	:param im:
+	:param analytes:
+	:param adducts:
+	:param rt_windows: The retention time window to search for each analyte in, in the same order as ``analytes``.
+		Scan indices in the returned peaks are relative to the start of the window.
+
+	:returns: A list of peaks for each analyte, in the same order as ``analytes``.
+	"""
+
+	e_ims = make_ims_for_analytes(
+			im,
+			analytes,
+			adducts,
+			left_bound=left_bound,
+			right_bound=right_bound,
+			min_abundance=min_abundance,
+			mass_index=mass_index,
+			prescreen=prescreen,
+			rt_windows=rt_windows,
+			)
+
+	return [
+			[] if e_im is None else
+			list(
+					peak_finder(
+							e_im,
+							points=points,
+							noise=noise,
+							peak_filter=peak_filter,
+							scans=scans,
+							max_width=max_width,
+							)
+					)
+			for e_im in e_ims
+			]
+
+
+def find_peak_records_for_analytes(
+		im: IntensityMatrix,
+		analytes: Iterable[Formula],
+		adducts: Iterable[Adduct],
+		points: int = 3,
+		left_bound: float = 0.1,
+		right_bound: float = 0.1,
+		min_abundance: Union[float, AbundanceCutoff] = 0.001,
+		mass_index: Optional[MassIndex] = None,
+		noise: NoiseStrategy = "window",
+		peak_filter: Optional[PeakFilter] = None,
+		scans: int = 1,
+		prescreen: bool = False,
+		max_width: Optional[int] = None,
+		rt_windows: Optional[Sequence[Optional[RTWindows]]] = None,
+		) -> List[List[PeakRecord]]:
+	"""
+	Find peaks for the given adducts of each analyte in the intensity matrix, as :class:`~.PeakRecord` objects.
+
+	The peaks are the same as from :func:`~.find_peaks_for_analytes` (which documents the parameters),
+	but no mass spectra are constructed.
+	"""
 
-			yield peak
+	e_ims = make_ims_for_analytes(
+			im,
+			analytes,
+			adducts,
+			left_bound=left_bound,
+			right_bound=right_bound,
+			min_abundance=min_abundance,
+			mass_index=mass_index,
+			prescreen=prescreen,
+			rt_windows=rt_windows,
+			)
+
+	return [
+			[] if e_im is None else peak_records_from_array(
+					find_peak_records(
+							e_im,
+							points=points,
+							noise=noise,
+							peak_filter=peak_filter,
+							scans=scans,
+							max_width=max_width,
+							)
+					)
+			for e_im in e_ims
+			]
 
 
 # def fill_peak(eic: ExtractedIonChromatogram, peak: Peak, ax: Optional[Axes] = None) -> PolyCollection:
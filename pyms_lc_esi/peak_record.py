@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#
+#  peak_record.py
+"""
+Compact representation of peaks.
+"""
+#
+#  Copyright © 2020-2023 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+from typing import Any, Iterable, List, Optional, Tuple
+
+# 3rd party
+import numpy
+from pyms.IntensityMatrix import BaseIntensityMatrix
+from pyms.Peak import Peak
+from pyms.Spectrum import MassSpectrum
+
+__all__ = ["PEAK_RECORD_DTYPE", "PeakRecord", "peak_records_from_array", "peak_records_to_array"]
+
+#: The dtype of the structured arrays created by :func:`~.peak_records_to_array`.
+PEAK_RECORD_DTYPE = numpy.dtype([
+		("apex_index", numpy.int64),
+		("rt", numpy.float64),
+		("area", numpy.float64),
+		("left_bound", numpy.int64),
+		("right_bound", numpy.int64),
+		])
+
+
+class PeakRecord:
+	"""
+	A compact alternative to :class:`pyms.Peak.Peak`, which only records the position and area of the peak.
+
+	The mass spectrum is not stored, but can be obtained from the intensity matrix the peak was found in
+	with :meth:`~.PeakRecord.get_mass_spectrum` or :meth:`~.PeakRecord.to_peak`.
+
+	:param apex_index: The scan index of the apex of the peak.
+	:param rt: The retention time of the apex.
+	:param area: The area of the peak.
+	:param left_bound: The scan index of the left bound of the peak.
+	:param right_bound: The scan index of the right bound of the peak.
+	"""
+
+	__slots__ = ("apex_index", "rt", "area", "left_bound", "right_bound")
+
+	#: The scan index of the apex of the peak.
+	apex_index: int
+
+	#: The retention time of the apex.
+	rt: float
+
+	#: The area of the peak, if known.
+	area: Optional[float]
+
+	#: The scan index of the left bound of the peak.
+	left_bound: int
+
+	#: The scan index of the right bound of the peak.
+	right_bound: int
+
+	def __init__(
+			self,
+			apex_index: int,
+			rt: float,
+			area: Optional[float] = None,
+			left_bound: Optional[int] = None,
+			right_bound: Optional[int] = None,
+			):
+		self.apex_index = int(apex_index)
+		self.rt = float(rt)
+		self.area = None if area is None else float(area)
+		self.left_bound = self.apex_index if left_bound is None else int(left_bound)
+		self.right_bound = self.apex_index if right_bound is None else int(right_bound)
+
+	def __repr__(self) -> str:
+		return (
+				f"{self.__class__.__name__}(apex_index={self.apex_index}, rt={self.rt}, area={self.area}, "
+				f"left_bound={self.left_bound}, right_bound={self.right_bound})"
+				)
+
+	def __eq__(self, other: Any) -> bool:
+		if isinstance(other, PeakRecord):
+			return self._as_tuple() == other._as_tuple()
+
+		return NotImplemented
+
+	def _as_tuple(self) -> Tuple[int, float, Optional[float], int, int]:
+		return self.apex_index, self.rt, self.area, self.left_bound, self.right_bound
+
+	def __getstate__(self) -> Tuple[int, float, Optional[float], int, int]:
+		return self._as_tuple()
+
+	def __setstate__(self, state: Tuple[int, float, Optional[float], int, int]) -> None:
+		self.apex_index, self.rt, self.area, self.left_bound, self.right_bound = state
+
+	@property
+	def bounds(self) -> Tuple[int, int, int]:
+		"""
+		The bounds of the peak in the same form as :attr:`pyms.Peak.Peak.bounds`.
+
+		That is, the number of scans to the left of the apex, the apex index,
+		and the number of scans to the right of the apex.
+		"""
+
+		return self.apex_index - self.left_bound, self.apex_index, self.right_bound - self.apex_index
+
+	@classmethod
+	def from_peak(cls, peak: Peak) -> "PeakRecord":
+		"""
+		Construct a :class:`~.PeakRecord` from a :class:`pyms.Peak.Peak` with its bounds set.
+
+		:param peak:
+		"""
+
+		if peak.bounds is None:
+			raise ValueError("The peak has no bounds set!")
+
+		left_offset, apex_index, right_offset = peak.bounds
+		return cls(
+				apex_index,
+				peak.rt,
+				peak.area,
+				left_bound=apex_index - left_offset,
+				right_bound=apex_index + right_offset,
+				)
+
+	def get_mass_spectrum(self, im: BaseIntensityMatrix) -> MassSpectrum:
+		"""
+		Returns the mass spectrum at the apex of the peak.
+
+		:param im: The intensity matrix the peak was found in.
+		"""
+
+		return im.get_ms_at_index(self.apex_index)
+
+	def to_peak(self, im: BaseIntensityMatrix) -> Peak:
+		"""
+		Convert to a :class:`pyms.Peak.Peak`.
+
+		:param im: The intensity matrix the peak was found in.
+		"""
+
+		peak = Peak(self.rt, self.get_mass_spectrum(im))
+		peak.bounds = self.bounds
+
+		if self.area is not None:
+			peak.area = self.area
+
+		return peak
+
+
+def peak_records_to_array(records: Iterable[PeakRecord]) -> numpy.ndarray:
+	"""
+	Convert the peak records to a structured array with the dtype :data:`~.PEAK_RECORD_DTYPE`.
+
+	Records without an area are given an area of NaN.
+
+	:param records:
+	"""
+
+	return numpy.array(
+			[(
+					record.apex_index,
+					record.rt,
+					numpy.nan if record.area is None else record.area,
+					record.left_bound,
+					record.right_bound,
+					) for record in records],
+			dtype=PEAK_RECORD_DTYPE,
+			)
+
+
+def peak_records_from_array(array: numpy.ndarray) -> List[PeakRecord]:
+	"""
+	Convert a structured array created by :func:`~.peak_records_to_array` back into peak records.
+
+	:param array:
+	"""
+
+	return [
+			PeakRecord(
+					apex_index,
+					rt,
+					None if numpy.isnan(area) else area,
+					left_bound,
+					right_bound,
+					) for apex_index, rt, area, left_bound, right_bound in array.tolist()
+			]
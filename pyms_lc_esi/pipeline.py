@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+#
+#  pipeline.py
+"""
+Pipelined screening of samples, overlapping the loading of data with peak finding.
+"""
+#
+#  Copyright © 2020-2023 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# stdlib
+import contextvars
+import queue
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union, cast
+
+# 3rd party
+import attr
+import numpy
+from chemistry_tools.formulae import Formula
+from pyms.eic import ExtractedIntensityMatrix
+from pyms.IntensityMatrix import IntensityMatrix
+from pyms.Peak import Peak
+
+# this package
+from pyms_lc_esi.adducts import Adduct, AdductSet, get_adduct_spectra
+from pyms_lc_esi.parallel import ScreeningResult
+from pyms_lc_esi.peak_filter import PeakFilter
+from pyms_lc_esi.peak_finder import NoiseStrategy, make_ims_for_analytes, peak_finder
+from pyms_lc_esi.spectra import AbundanceCutoff, score_peaks_for_adducts
+
+__all__ = ["Pipeline", "PipelineResult", "StageMetrics"]
+
+# How often (in seconds) blocked threads check whether the pipeline has been stopped.
+_POLL_INTERVAL = 0.1
+
+
+@attr.s
+class PipelineResult(ScreeningResult):
+	"""
+	The result of screening a sample with a :class:`~.Pipeline`.
+	"""
+
+	#: The isotope pattern score of each peak for each adduct (see :func:`~.score_peaks_for_adducts`),
+	#: in the same order as :attr:`~.ScreeningResult.analytes`.
+	#: :py:obj:`None` if scoring was disabled or the job failed.
+	scores: Optional[List[Dict[str, numpy.ndarray]]] = attr.ib(default=None)
+
+
+class StageMetrics:
+	"""
+	Throughput and queue depth for one stage of a :class:`~.Pipeline`.
+
+	:param name: The name of the stage.
+	"""
+
+	#: The number of samples processed by the stage, including those which failed.
+	processed: int
+
+	#: The number of samples for which the stage raised an exception.
+	failed: int
+
+	#: The time, in seconds, spent processing samples.
+	busy_time: float
+
+	#: The time, in seconds, spent waiting for samples from the previous stage.
+	wait_time: float
+
+	#: The largest number of samples seen waiting for the stage.
+	max_queue_depth: int
+
+	def __init__(self, name: str):
+		self.name: str = name
+		self._queue: Optional[queue.Queue] = None
+		self._lock = threading.Lock()
+		self.reset()
+
+	def reset(self) -> None:
+		"""
+		Reset the metrics to zero.
+		"""
+
+		with self._lock:
+			self.processed = self.failed = self.max_queue_depth = 0
+			self.busy_time = self.wait_time = 0.0
+
+	@property
+	def queue_depth(self) -> int:
+		"""
+		The number of samples currently waiting for the stage.
+		"""
+
+		return 0 if self._queue is None else self._queue.qsize()
+
+	@property
+	def throughput(self) -> float:
+		"""
+		The number of samples processed per second of :attr:`~.busy_time`.
+		"""
+
+		with self._lock:
+			return self.processed / self.busy_time if self.busy_time else 0.0
+
+	def _record(self, busy_time: float, wait_time: float, failed: bool) -> None:
+		with self._lock:
+			self.processed += 1
+			self.failed += failed
+			self.busy_time += busy_time
+			self.wait_time += wait_time
+
+	def _observe_queue(self) -> None:
+		with self._lock:
+			self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+	def __repr__(self) -> str:
+		return (
+				f"<{self.__class__.__name__} {self.name!r}: processed={self.processed}, "
+				f"throughput={self.throughput:0.2f}/s, queue_depth={self.queue_depth}>"
+				)
+
+
+class _Job:
+	"""
+	A sample passing through the pipeline.
+	"""
+
+	__slots__ = ("sample", "im", "e_ims", "peaks", "scores", "error")
+
+	def __init__(self, sample: Any):
+		self.sample = sample
+		self.im: Optional[IntensityMatrix] = None
+		self.e_ims: Optional[List[Optional[ExtractedIntensityMatrix]]] = None
+		self.peaks: Optional[List[List[Peak]]] = None
+		self.scores: Optional[List[Dict[str, numpy.ndarray]]] = None
+		self.error: Optional[str] = None
+
+
+# Marks the end of the samples.
+_DONE = object()
+
+
+class Pipeline:
+	"""
+	Screen samples for the given adducts of the analytes, with each stage running in its own thread.
+
+	The stages are:
+
+	* ``'load'`` -- load the sample with ``loader``;
+	* ``'extract'`` -- extract the masses of the adducts (see :func:`~.make_ims_for_analytes`);
+	* ``'find'`` -- find peaks for each analyte (see :func:`~.peak_finder`); and
+	* ``'score'`` -- score the isotope patterns of the peaks (see :func:`~.score_peaks_for_adducts`).
+
+	The stages are connected by bounded queues, so the next sample is read while peaks are found in the
+	current one, without reading samples faster than they can be processed.
+	As the stages run in threads rather than processes, the overlap is greatest when loading is I/O bound.
+	See :func:`~.screen_samples` to instead screen samples in parallel in multiple processes.
+
+	The :attr:`~.metrics` for each stage are updated while the pipeline is running.
+	Stages run within :func:`~.instrument` report to its callbacks as usual.
+
+	:param loader: A function which returns the :class:`~pyms.IntensityMatrix.IntensityMatrix` for a sample.
+	:param analytes:
+	:param adducts:
+	:param points:
+	:param left_bound:
+	:param right_bound:
+	:param min_abundance: Ignore isotopologues whose (absolute) abundance is below this threshold.
+		Alternatively, an :class:`~.AbundanceCutoff` giving a relative abundance threshold
+		or the number of isotopologues to include.
+	:param noise: How to determine the noise level. See :data:`~.NoiseStrategy`.
+	:param peak_filter: The criteria which peaks must meet. Defaults to :class:`~.PeakFilter` with its default values.
+	:param scans: Maxima fewer than this many scans apart are combined into a single peak.
+	:param prescreen: If :py:obj:`True`, adducts with no signal at their monoisotopic mass are skipped.
+		See :func:`~.make_ims_for_analytes`.
+	:param max_width: The maximum number of scans on each side of the apex to include in each peak.
+	:param score: Whether to score the isotope patterns of the peaks.
+	:param mass_tol: The mass tolerance for scoring isotope patterns.
+	:param max_queued: The maximum number of samples waiting before each stage.
+	"""
+
+	#: The metrics for each stage, in order.
+	metrics: Dict[str, StageMetrics]
+
+	def __init__(
+			self,
+			loader: Callable[[Any], IntensityMatrix],
+			analytes: Sequence[Formula],
+			adducts: Iterable[Adduct],
+			points: int = 3,
+			left_bound: float = 0.1,
+			right_bound: float = 0.1,
+			min_abundance: Union[float, AbundanceCutoff] = 0.001,
+			noise: NoiseStrategy = "window",
+			peak_filter: Optional[PeakFilter] = None,
+			scans: int = 1,
+			prescreen: bool = False,
+			max_width: Optional[int] = None,
+			score: bool = True,
+			mass_tol: float = 0.05,
+			max_queued: int = 2,
+			):
+
+		if max_queued < 1:
+			raise ValueError("'max_queued' must be at least 1")
+
+		self.loader = loader
+		self.analytes: List[Formula] = list(analytes)
+		self.adducts: AdductSet = adducts if isinstance(adducts, AdductSet) else AdductSet(adducts)
+		self.points = points
+		self.left_bound = left_bound
+		self.right_bound = right_bound
+		self.min_abundance = min_abundance
+		self.noise = noise
+		self.peak_filter = peak_filter
+		self.scans = scans
+		self.prescreen = prescreen
+		self.max_width = max_width
+		self.score = score
+		self.mass_tol = mass_tol
+		self.max_queued = max_queued
+
+		stages: List[Callable[[_Job], None]] = [self._load, self._extract, self._find]
+		if score:
+			stages.append(self._score)
+
+		self._stages = {func.__name__.lstrip('_'): func for func in stages}
+		self.metrics = {name: StageMetrics(name) for name in self._stages}
+
+	def _load(self, job: _Job) -> None:
+		job.im = self.loader(job.sample)
+
+	def _extract(self, job: _Job) -> None:
+		job.e_ims = make_ims_for_analytes(
+				cast(IntensityMatrix, job.im),
+				self.analytes,
+				self.adducts,
+				left_bound=self.left_bound,
+				right_bound=self.right_bound,
+				min_abundance=self.min_abundance,
+				prescreen=self.prescreen,
+				)
+
+		# Release the intensity matrix as soon as possible.
+		job.im = None
+
+	def _find(self, job: _Job) -> None:
+		job.peaks = []
+
+		for e_im in cast(List[Optional[ExtractedIntensityMatrix]], job.e_ims):
+			if e_im is None:
+				# All adducts of the analyte were screened out.
+				job.peaks.append([])
+			else:
+				peaks = peak_finder(
+						e_im,
+						points=self.points,
+						noise=self.noise,
+						peak_filter=self.peak_filter,
+						scans=self.scans,
+						max_width=self.max_width,
+						)
+				job.peaks.append(list(peaks))
+
+		job.e_ims = None
+
+	def _score(self, job: _Job) -> None:
+		job.scores = []
+		for analyte, peaks in zip(self.analytes, cast(List[List[Peak]], job.peaks)):
+			spectra = get_adduct_spectra(analyte, self.adducts, min_abundance=self.min_abundance)
+			job.scores.append(score_peaks_for_adducts(peaks, spectra, mass_tol=self.mass_tol))
+
+	@staticmethod
+	def _get(source: queue.Queue, stop: threading.Event) -> Any:
+		while not stop.is_set():
+			try:
+				return source.get(timeout=_POLL_INTERVAL)
+			except queue.Empty:
+				continue
+
+		return _DONE
+
+	@staticmethod
+	def _put(destination: queue.Queue, item: Any, stop: threading.Event) -> None:
+		while not stop.is_set():
+			try:
+				destination.put(item, timeout=_POLL_INTERVAL)
+				return
+			except queue.Full:
+				continue
+
+	def _feed(
+			self,
+			samples: Iterable[Any],
+			destination: queue.Queue,
+			stop: threading.Event,
+			errors: List[BaseException],
+			) -> None:
+		try:
+			for sample in samples:
+				if stop.is_set():
+					return
+				self._put(destination, _Job(sample), stop)
+		except BaseException as e:
+			# Re-raised by run() once the samples before it have been yielded.
+			errors.append(e)
+		finally:
+			self._put(destination, _DONE, stop)
+
+	def _run_stage(
+			self,
+			name: str,
+			source: queue.Queue,
+			destination: queue.Queue,
+			stop: threading.Event,
+			errors: List[BaseException],
+			) -> None:
+		func = self._stages[name]
+		metrics = self.metrics[name]
+
+		try:
+			while True:
+				wait_start = time.perf_counter()
+				job = self._get(source, stop)
+				if job is _DONE:
+					return
+
+				metrics._observe_queue()
+				start = time.perf_counter()
+
+				failed = False
+				if job.error is None:
+					try:
+						func(job)
+					except Exception:
+						job.error = traceback.format_exc()
+						job.im = job.e_ims = None
+						failed = True
+
+				metrics._record(time.perf_counter() - start, start - wait_start, failed)
+				self._put(destination, job, stop)
+		except BaseException as e:
+			# Re-raised by run(), which would otherwise wait forever for this stage's results.
+			errors.append(e)
+		finally:
+			self._put(destination, _DONE, stop)
+
+	def run(self, samples: Iterable[Any]) -> Iterator[PipelineResult]:
+		"""
+		Screen the samples.
+
+		An exception raised while processing a sample (for example, from a corrupt data file)
+		is recorded in the :attr:`~.ScreeningResult.error` attribute of its result,
+		and the remaining stages are skipped for that sample.
+		Other exceptions (those which are not subclasses of :class:`Exception`, and exceptions raised by
+		iterating over ``samples``) stop the pipeline, and are re-raised once the preceding results have been yielded.
+
+		:param samples: The samples to screen, such as the filenames of the raw data.
+
+		:returns: An iterator over the results for each sample, in the same order as ``samples``.
+		"""
+
+		stop = threading.Event()
+		errors: List[BaseException] = []
+		queues: List[queue.Queue] = [queue.Queue(maxsize=self.max_queued) for _ in range(len(self._stages) + 1)]
+
+		# Each thread runs in a copy of the current context, so instrument() callbacks are active in the stages.
+		threads = [
+				threading.Thread(
+						target=contextvars.copy_context().run,
+						args=(self._feed, samples, queues[0], stop, errors),
+						name="pipeline-feed",
+						daemon=True,
+						)
+				]
+
+		for idx, (name, metrics) in enumerate(self.metrics.items()):
+			metrics.reset()
+			metrics._queue = queues[idx]
+			threads.append(
+					threading.Thread(
+							target=contextvars.copy_context().run,
+							args=(self._run_stage, name, queues[idx], queues[idx + 1], stop, errors),
+							name=f"pipeline-{name}",
+							daemon=True,
+							)
+					)
+
+		for thread in threads:
+			thread.start()
+
+		try:
+			while True:
+				job = queues[-1].get()
+				if job is _DONE:
+					break
+
+				yield PipelineResult(
+						job.sample,
+						list(self.analytes),
+						peaks=None if job.error else job.peaks,
+						error=job.error,
+						scores=None if job.error else job.scores,
+						)
+
+			if errors:
+				raise errors[0]
+
+		finally:
+			stop.set()
+			for thread in threads:
+				thread.join()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+#
+#  results_store.py
+"""
+Store peak finding results so samples only need re-screening for new or changed targets.
+"""
+#
+#  Copyright © 2020-2023 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# stdlib
+import hashlib
+import sys
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+# 3rd party
+import attr
+import numpy
+from chemistry_tools.formulae import Formula
+from domdf_python_tools.paths import PathPlus
+from domdf_python_tools.typing import PathLike
+from pyms.IntensityMatrix import BaseIntensityMatrix, IntensityMatrix
+
+# this package
+import pyms_lc_esi
+from pyms_lc_esi.adducts import Adduct, AdductSet
+from pyms_lc_esi.mass_index import RTWindows
+from pyms_lc_esi.matrix_store import save_array
+from pyms_lc_esi.peak_filter import PeakFilter
+from pyms_lc_esi.peak_finder import NoiseStrategy, find_peaks_for_analytes
+from pyms_lc_esi.peak_record import PeakRecord, peak_records_from_array, peak_records_to_array
+from pyms_lc_esi.spectra import AbundanceCutoff
+
+__all__ = [
+		"ResultsStore",
+		"ScreeningParameters",
+		"fingerprint_file",
+		"fingerprint_intensity_matrix",
+		"rescreen",
+		]
+
+
+def fingerprint_intensity_matrix(im: BaseIntensityMatrix) -> str:
+	"""
+	Returns a fingerprint of the contents of the intensity matrix, for use with :class:`~.ResultsStore`.
+
+	:param im:
+	"""
+
+	digest = hashlib.blake2b(digest_size=20)
+	digest.update(numpy.asarray(im._time_list, dtype=numpy.float64).tobytes())
+	digest.update(numpy.asarray(im._mass_list, dtype=numpy.float64).tobytes())
+	digest.update(numpy.ascontiguousarray(im._intensity_array, dtype=numpy.float64).tobytes())
+	return digest.hexdigest()
+
+
+def fingerprint_file(filename: PathLike, chunk_size: int = 2**20) -> str:
+	"""
+	Returns a fingerprint of the contents of a raw data file, for use with :class:`~.ResultsStore`.
+
+	Unlike :func:`~.fingerprint_intensity_matrix` this does not require the sample to be loaded.
+
+	:param filename:
+	:param chunk_size: The number of bytes to read at a time.
+	"""
+
+	digest = hashlib.blake2b(digest_size=20)
+
+	with PathPlus(filename).open("rb") as fp:
+		for chunk in iter(lambda: fp.read(chunk_size), b''):
+			digest.update(chunk)
+
+	return digest.hexdigest()
+
+
+def _noise_key(noise: NoiseStrategy) -> str:
+	if not callable(noise):
+		return repr(noise)
+
+	# Functions are identified by name, so only those which can be imported by that name
+	# (not lambdas, closures or partials) identify the same noise estimate between runs.
+	# Changes to the function itself cannot be detected.
+	module = getattr(noise, "__module__", None)
+	qualname = getattr(noise, "__qualname__", None)
+
+	obj = sys.modules.get(module) if module and qualname else None
+	for attribute in (qualname or '').split('.'):
+		obj = getattr(obj, attribute, None)
+
+	if obj is not noise:
+		raise ValueError(f"Noise functions must be importable by name, not {noise!r}")
+
+	return f"{module}.{qualname}"
+
+
+def _noise_validator(instance: "ScreeningParameters", attribute: attr.Attribute, value: NoiseStrategy) -> None:
+	_noise_key(value)
+
+
+def _rt_window_key(rt_window: Optional[RTWindows]) -> Optional[Tuple]:
+	if rt_window is None:
+		return None
+	elif isinstance(rt_window, Mapping):
+		return tuple(sorted((name, float(start), float(end)) for name, (start, end) in rt_window.items()))
+	else:
+		start, end = rt_window
+		return float(start), float(end)
+
+
+def _abundance_cutoff_converter(value: Union[float, AbundanceCutoff]) -> AbundanceCutoff:
+	return value if isinstance(value, AbundanceCutoff) else AbundanceCutoff(value)
+
+
+def _peak_filter_converter(value: Optional[PeakFilter]) -> PeakFilter:
+	return PeakFilter() if value is None else value
+
+
+@attr.s(frozen=True)
+class ScreeningParameters:
+	"""
+	The parameters which determine the peaks found for an analyte.
+
+	The parameters are passed on to :func:`~.find_peaks_for_analytes`.
+	"""
+
+	points: int = attr.ib(default=3)
+	left_bound: float = attr.ib(default=0.1)
+	right_bound: float = attr.ib(default=0.1)
+	min_abundance: AbundanceCutoff = attr.ib(
+			default=AbundanceCutoff(0.001),
+			converter=_abundance_cutoff_converter,
+			)
+	noise: NoiseStrategy = attr.ib(default="window", validator=_noise_validator)
+	peak_filter: PeakFilter = attr.ib(
+			default=PeakFilter(),
+			converter=_peak_filter_converter,
+			)
+	scans: int = attr.ib(default=1)
+	prescreen: bool = attr.ib(default=False)
+	max_width: Optional[int] = attr.ib(default=None)
+
+	#: The retention time window to search for every analyte in. See :data:`~.RTWindows`.
+	rt_window: Optional[RTWindows] = attr.ib(default=None)
+
+	def key(self) -> Tuple:
+		"""
+		Returns a tuple identifying the parameters, which changes whenever any parameter changes.
+		"""
+
+		return (
+				pyms_lc_esi.__version__,
+				self.points,
+				self.left_bound,
+				self.right_bound,
+				self.min_abundance.mode,
+				self.min_abundance.value,
+				_noise_key(self.noise),
+				repr(attr.astuple(self.peak_filter)),
+				self.scans,
+				self.prescreen,
+				self.max_width,
+				_rt_window_key(self.rt_window),
+				)
+
+	def as_kwargs(self, n_analytes: int) -> Dict[str, Any]:
+		"""
+		Returns the parameters as keyword arguments for :func:`~.find_peaks_for_analytes`.
+
+		:param n_analytes: The number of analytes to repeat :attr:`~.rt_window` for.
+		"""
+
+		kwargs = attr.asdict(self, recurse=False)
+		rt_window = kwargs.pop("rt_window")
+		kwargs["rt_windows"] = None if rt_window is None else [rt_window] * n_analytes
+		return kwargs
+
+
+class ResultsStore:
+	"""
+	On-disk store of the peaks found for each analyte in each sample.
+
+	Results are keyed by the sample's fingerprint, the analyte, the set of adducts and the
+	:class:`~.ScreeningParameters`, so results for different adducts or parameters never collide.
+	Changing any parameter therefore means the stored results are no longer found and are recalculated.
+
+	The peaks are stored as arrays of :class:`~.PeakRecord` objects.
+
+	:param directory: The directory to store results in. Created if it does not exist.
+	"""
+
+	#: The number of results found in the store.
+	hits: int
+
+	#: The number of results which were not found in the store.
+	misses: int
+
+	def __init__(self, directory: PathLike):
+		self.directory: PathPlus = PathPlus(directory)
+		self.hits = self.misses = 0
+
+	def _get_filename(
+			self,
+			fingerprint: str,
+			analyte: Formula,
+			adducts: AdductSet,
+			parameters: ScreeningParameters,
+			) -> PathPlus:
+		key = (
+				analyte.hill_formula,
+				analyte.charge,
+				tuple(adducts.keys),
+				parameters.key(),
+				)
+		digest = hashlib.sha256(repr(key).encode("UTF-8")).hexdigest()
+		return self.directory / fingerprint / f"{digest}.npy"
+
+	def get(
+			self,
+			fingerprint: str,
+			analyte: Formula,
+			adducts: AdductSet,
+			parameters: ScreeningParameters,
+			) -> Optional[List[PeakRecord]]:
+		"""
+		Returns the stored peaks for the analyte in the sample, or :py:obj:`None` if there are none.
+
+		:param fingerprint: The fingerprint of the sample.
+		:param analyte:
+		:param adducts:
+		:param parameters:
+		"""
+
+		filename = self._get_filename(fingerprint, analyte, adducts, parameters)
+		if not filename.is_file():
+			self.misses += 1
+			return None
+
+		try:
+			array = numpy.load(filename)
+		except (OSError, ValueError):
+			# Incomplete or corrupt file; it will be overwritten.
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		return peak_records_from_array(array)
+
+	def put(
+			self,
+			fingerprint: str,
+			analyte: Formula,
+			adducts: AdductSet,
+			parameters: ScreeningParameters,
+			peaks: Iterable[PeakRecord],
+			) -> None:
+		"""
+		Store the peaks for the analyte in the sample.
+
+		:param fingerprint: The fingerprint of the sample.
+		:param analyte:
+		:param adducts:
+		:param parameters:
+		:param peaks:
+		"""
+
+		filename = self._get_filename(fingerprint, analyte, adducts, parameters)
+		filename.parent.maybe_make(parents=True)
+		save_array(filename, peak_records_to_array(peaks))
+
+	def clear(self, fingerprint: Optional[str] = None) -> None:
+		"""
+		Remove stored results.
+
+		:param fingerprint: Only remove results for the sample with this fingerprint.
+			If :py:obj:`None` results for all samples are removed.
+		"""
+
+		if fingerprint is not None:
+			directories = [self.directory / fingerprint]
+		elif self.directory.is_dir():
+			directories = list(self.directory.iterdir())
+		else:
+			directories = []
+
+		for directory in directories:
+			if directory.is_dir():
+				for filename in directory.glob("*.npy"):
+					filename.unlink()
+				directory.rmdir()
+
+
+def rescreen(
+		store: ResultsStore,
+		fingerprint: str,
+		loader: Union[IntensityMatrix, Callable[[], IntensityMatrix]],
+		analytes: Sequence[Formula],
+		adducts: Iterable[Adduct],
+		parameters: Optional[ScreeningParameters] = None,
+		) -> List[List[PeakRecord]]:
+	"""
+	Find peaks for the given adducts of each analyte in a sample, reusing stored results where possible.
+
+	Only the analytes without stored results for this sample, adducts and parameters are screened
+	(with :func:`~.find_peaks_for_analytes`), and their results are added to the store.
+	If every analyte has stored results the sample is not loaded at all.
+
+	:param store:
+	:param fingerprint: The fingerprint of the sample, from :func:`~.fingerprint_file`
+		or :func:`~.fingerprint_intensity_matrix`.
+	:param loader: The intensity matrix for the sample, or a function which loads it.
+	:param analytes:
+	:param adducts:
+	:param parameters: Defaults to :class:`~.ScreeningParameters` with its default values.
+
+	:returns: A list of peaks for each analyte, in the same order as ``analytes``.
+		Use :meth:`PeakRecord.to_peak() <.PeakRecord.to_peak>` to obtain :class:`pyms.Peak.Peak` objects.
+	"""
+
+	if parameters is None:
+		parameters = ScreeningParameters()
+
+	adduct_set = adducts if isinstance(adducts, AdductSet) else AdductSet(adducts)
+
+	results: List[Optional[List[PeakRecord]]] = [
+			store.get(fingerprint, analyte, adduct_set, parameters) for analyte in analytes
+			]
+	missing = [idx for idx, peaks in enumerate(results) if peaks is None]
+
+	if missing:
+		im = loader if isinstance(loader, BaseIntensityMatrix) else loader()
+		found_peaks = find_peaks_for_analytes(
+				im,
+				[analytes[idx] for idx in missing],
+				adduct_set,
+				**parameters.as_kwargs(len(missing)),
+				)
+
+		for idx, analyte_peaks in zip(missing, found_peaks):
+			records = [PeakRecord.from_peak(peak) for peak in analyte_peaks]
+			store.put(fingerprint, analytes[idx], adduct_set, parameters, records)
+			results[idx] = records
+
+	return [peaks or [] for peaks in results]
@@ -27,48 +27,107 @@ Mass spectrum handling.
 #
 
 # stdlib
-# from typing import List, NamedTuple, Tuple
+from typing import Dict, Iterable, List, Literal, Mapping, Sequence, Tuple, Union
+# from typing import NamedTuple
 
 # 3rd party
-# import numpy
+import attr
+import numpy
 # import pandas
 from chemistry_tools.formulae import IsotopeDistribution
 # from mathematical.data_frames import set_display_options
 # from matplotlib.axes import Axes
 # from matplotlib.container import BarContainer
-# from pyms import Peak
-# from pyms.IntensityMatrix import BaseIntensityMatrix
+from pyms.IntensityMatrix import BaseIntensityMatrix
+from pyms.Peak import Peak
 # from pyms.Spectrum import CompositeMassSpectrum, MassSpectrum, normalize_mass_spec
-from pyms.Spectrum import MassSpectrum
-
-__all__ = ["iso_dist_2_mass_spec"]
+from pyms.Spectrum import CompositeMassSpectrum, MassSpectrum
+
+# this package
+from pyms_lc_esi.peak_record import PeakRecord
+
+__all__ = [
+		"AbundanceCutoff",
+		"composite_spectra",
+		"composite_spectrum_from_peak",
+		"find_best_peak",
+		"iso_dist_2_mass_spec",
+		"isotope_pattern_scores",
+		"score_peaks",
+		"score_peaks_for_adducts",
+		]
 
 # set_display_options()
 
 
+@attr.s(frozen=True)
+class AbundanceCutoff:
+	"""
+	Determines which isotopologues are included in the Mass Spectrum representation of an isotope distribution.
+
+	Limiting the number of isotopologues limits the number of masses extracted
+	from the intensity matrix for each adduct.
+	"""
+
+	#: The threshold value, or the number of isotopologues to include for ``'top_n'``.
+	value: float = attr.ib(converter=float)
+
+	mode: Literal["absolute", "relative", "top_n"] = attr.ib(
+			default="absolute",
+			validator=attr.validators.in_({"absolute", "relative", "top_n"}),
+			)
+	"""
+	Either:
+
+	* ``'absolute'`` -- ignore isotopologues whose absolute abundance is not above :attr:`~.value`;
+	* ``'relative'`` -- ignore isotopologues whose abundance relative to the most abundant isotopologue
+	  is not above :attr:`~.value`; or
+	* ``'top_n'`` -- include only the :attr:`~.value` most abundant isotopologues.
+	"""
+
+
 def iso_dist_2_mass_spec(
 		iso_dist: IsotopeDistribution,
-		min_abundance: float = 0,
+		min_abundance: Union[float, AbundanceCutoff] = 0,
 		) -> MassSpectrum:
 	"""
 	Returns the Mass Spectrum representation of the given isotope distribution.
 
 	:param iso_dist:
 	:param min_abundance: Ignore isotopologues whose (absolute) abundance is below this threshold.
+		Alternatively, an :class:`~.AbundanceCutoff` giving a relative abundance threshold
+		or the number of isotopologues to include.
 		By default isotopologues with zero abundance are excluded.
 	:no-default min_abundance:
 	"""
 
-	iso_df = iso_dist.as_dataframe(format_percentage=False)
-	iso_df = iso_df.astype({"Mass": float, "Abundance": float, "Relative Abundance": float})
-	iso_df = iso_df[iso_df["Abundance"] > min_abundance]
-	iso_df.sort_values(by=["Mass"], axis=0, ascending=True, inplace=True)
-	iso_df.reset_index(inplace=True, drop=True)
+	if not isinstance(min_abundance, AbundanceCutoff):
+		min_abundance = AbundanceCutoff(min_abundance)
+
+	compositions = list(iso_dist.values())
+
+	# Rounded to the same precision as IsotopeDistribution.as_array()
+	abundances = numpy.array([comp.isotopic_composition_abundance for comp in compositions], dtype=numpy.float64)
+	relative_abundances = numpy.round(abundances / iso_dist.max_abundance, 6)
+	abundances = numpy.round(abundances, 6)
 
-	# print(iso_df)
+	if min_abundance.mode == "relative":
+		selected = numpy.flatnonzero(relative_abundances > min_abundance.value)
+	elif min_abundance.mode == "top_n":
+		selected = numpy.argsort(-abundances, kind="stable")[:int(min_abundance.value)]
+		selected = selected[abundances[selected] > 0]
+	else:
+		selected = numpy.flatnonzero(abundances > min_abundance.value)
 
-	# return MassSpectrum(iso_df["Mass"], iso_df["Abundance"])
-	return MassSpectrum(iso_df["Mass"], iso_df["Relative Abundance"])
+	# Only calculate masses for the isotopologues which are kept
+	masses = numpy.array([float(f"{compositions[idx].mass:0.4f}") for idx in selected], dtype=numpy.float64)
+
+	order = numpy.argsort(masses, kind="stable")
+	masses = masses[order]
+	selected = selected[order]
+
+	# return MassSpectrum(masses, abundances[selected])
+	return MassSpectrum(masses, relative_abundances[selected])
 
 
 # class LabelledMassSpectrum(NamedTuple):
@@ -140,149 +199,220 @@ def iso_dist_2_mass_spec(
 # #
 # # 	ax.set_xlim(min_mass-1, max_mass+1)
 
-# def compare_iso_dist(predicted: MassSpectrum, experimental: MassSpectrum) -> pandas.DataFrame:
-# 	predicted = normalize_mass_spec(predicted, max_intensity=100.0)
-# 	experimental = normalize_mass_spec(experimental, max_intensity=100.0)
+def _match_masses(
+		reference_masses: numpy.ndarray,
+		masses: numpy.ndarray,
+		mass_tol: float,
+		) -> Tuple[numpy.ndarray, numpy.ndarray]:
+	"""
+	Returns the start and stop indices of the range of ``masses`` within ``mass_tol`` of each reference mass.
 
-# 	df = pandas.DataFrame(
-# 			data={
-# 					"Predicted Masses": predicted.mass_list,
-# 					"Predicted Intensities": predicted.mass_spec,
-# 					}
-# 			)
-# 	df["Experimental Masses"] = numpy.nan
-# 	df["Experimental Intensities"] = numpy.nan
-
-# 	# Remove masses with zero normalized intensity
-# 	df = df[df["Predicted Intensities"] > 0.0]
-# 	df.sort_values(by=["Predicted Masses"], axis=0, ascending=True, inplace=True)
-# 	df.reset_index(inplace=True, drop=True)
-
-# 	extra_peaks = {}
-
-# 	for mass, intensity in zip(experimental.mass_list, experimental.mass_spec):
-# 		idx = (numpy.abs(df["Predicted Masses"] - mass)).argmin()
-# 		if numpy.isclose(df["Predicted Masses"][idx], mass, atol=0.05):
-# 			if numpy.isnan(df.at[idx, "Experimental Masses"]):
-# 				# No existing value
-# 				df.at[idx, "Experimental Masses"] = mass
-# 				df.at[idx, "Experimental Intensities"] = intensity
-# 			else:
-# 				# Don't clobber existing value
-# 				if df.at[idx, "Experimental Intensities"] > intensity:
-# 					extra_peaks[mass] = intensity
-# 				else:
-# 					extra_peaks[df.at[idx, "Experimental Masses"]] = df.at[idx, "Experimental Intensities"]
-# 					df.at[idx, "Experimental Masses"] = mass
-# 					df.at[idx, "Experimental Intensities"] = intensity
-# 		else:
-# 			extra_peaks[mass] = intensity
-
-# 	df.sort_values(by=["Predicted Masses"], axis=0, ascending=True, inplace=True)
-# 	df.reset_index(inplace=True, drop=True)
-
-# 	df["Mass Δ"] = df.apply(func=df_delta, args=["Predicted Masses", "Experimental Masses"], axis=1)
-# 	df["Rel. Mass Δ"] = df.apply(func=df_delta_relative, args=["Predicted Masses", "Experimental Masses"], axis=1)
-# 	df["Intensity Δ"] = df.apply(func=df_delta, args=["Predicted Intensities", "Experimental Intensities"], axis=1)
-# 	df["Rel. Intensity Δ"] = df.apply(
-# 			func=df_delta_relative, args=["Predicted Intensities", "Experimental Intensities"], axis=1
-# 			)
+	:param reference_masses:
+	:param masses: The experimental masses, in ascending order.
+	:param mass_tol:
+	"""
+
+	starts = numpy.searchsorted(masses, reference_masses - mass_tol, side="left")
+	stops = numpy.searchsorted(masses, reference_masses + mass_tol, side="right")
+	return starts, stops
+
+
+def isotope_pattern_scores(
+		reference: MassSpectrum,
+		masses: Sequence[float],
+		intensities: numpy.ndarray,
+		mass_tol: float = 0.05,
+		) -> numpy.ndarray:
+	"""
+	Score how well each experimental spectrum matches the isotope pattern in ``reference``.
+
+	Each mass in ``reference`` is matched to the most intense experimental mass within ``mass_tol`` of it.
+	The score is the cosine similarity between the reference intensities and the matched experimental intensities,
+	from ``0`` (no match) to ``1`` (identical relative intensities).
+
+	:param reference: The predicted spectrum, e.g. from :func:`~.get_adduct_spectra`.
+	:param masses: The masses of the experimental spectra, in ascending order.
+	:param intensities: A 2D array of the intensity of each mass (columns) in each experimental spectrum (rows).
+	:param mass_tol: The maximum difference between a reference mass and a matching experimental mass.
 
-# 	df.sort_values(by=["Predicted Intensities"], axis=0, ascending=False, inplace=True)
-# 	df.reset_index(inplace=True, drop=True)
+	:returns: The score of each experimental spectrum.
+	"""
+
+	mass_array = numpy.asarray(masses, dtype=numpy.float64)
+	intensities = numpy.asarray(intensities, dtype=numpy.float64).reshape(-1, len(mass_array))
+	reference_masses = numpy.asarray(reference.mass_list, dtype=numpy.float64)
+	reference_intensities = numpy.asarray(reference.intensity_list, dtype=numpy.float64)
 
-# 	# print(df)
-# 	# print("Average Mass Difference:", numpy.nanmean(df["Mass Δ"]))
-# 	# print("Average Intensity Difference:", numpy.nanmean(df["Intensity Δ"]))
-# 	# pprint(extra_peaks)
+	starts, stops = _match_masses(reference_masses, mass_array, mass_tol)
+	has_match = stops > starts
 
-# 	return df
+	# Append a column of zeros so every start and stop is a valid index for ``reduceat``.
+	padded = numpy.zeros((len(intensities), len(mass_array) + 1), dtype=numpy.float64)
+	padded[:, :-1] = intensities
+	bounds = numpy.column_stack((numpy.where(has_match, starts, len(mass_array)), stops)).ravel()
+	matched = numpy.maximum.reduceat(padded, bounds, axis=1)[:, ::2]
+	matched[:, ~has_match] = 0
 
-# def df_delta(row: pandas.Series, left_column: str, right_column: str) -> float:
-# 	"""
-# 	Calculate the difference between values in the two columns for each row of a
-# 	:class:`data frame <pandas.DataFrame>`.
+	norms = numpy.linalg.norm(matched, axis=1) * numpy.linalg.norm(reference_intensities)
+	dot = matched @ reference_intensities
 
-# 	Do not call this function directly; use it with
-# 	:meth:`df.apply() <pandas.DataFrame.apply>` instead:
+	scores = numpy.zeros(len(intensities), dtype=numpy.float64)
+	numpy.divide(dot, norms, out=scores, where=norms > 0)
+	return scores
 
-# 	.. code-block:: python
 
-# 		data_frame["Mean"] = data_frame.apply(
-# 				func=df_delta,
-# 				args=["Bob", "Alice"],
-# 				axis=1,
-# 				)
+def _stack_peak_spectra(peaks: Sequence[Peak]) -> Tuple[List[float], numpy.ndarray]:
+	"""
+	Returns the mass list shared by the peaks' mass spectra, and an array of their intensities.
 
-# 	:param row: Row of the data frame.
-# 	:param left_column:
-# 	:param right_column:
+	:param peaks:
+	"""
 
-# 	:return: The difference between ``left_column`` and ``right_column``.
-# 	"""  # noqa D400
+	if not peaks:
+		return [], numpy.zeros((0, 0), dtype=numpy.float64)
 
-# 	return row[left_column] - row[right_column]
+	masses = peaks[0].mass_spectrum.mass_list
+	for peak in peaks:
+		if peak.mass_spectrum.mass_list != masses:
+			raise ValueError("The mass spectra of all peaks must have the same mass list.")
 
-# def df_delta_relative(row: pandas.Series, left_column: str, right_column: str) -> float:
-# 	"""
-# 	Calculate the relative difference between values in the two columns for each row of a
-# 	:class:`data frame <pandas.DataFrame>`.
+	intensities = numpy.array([peak.mass_spectrum.intensity_list for peak in peaks], dtype=numpy.float64)
+	return masses, intensities
 
-# 	Do not call this function directly; use it with
-# 	:meth:`df.apply() <pandas.DataFrame.apply>` instead:
 
-# 	.. code-block:: python
+def score_peaks(
+		peaks: Sequence[Peak],
+		reference: MassSpectrum,
+		mass_tol: float = 0.05,
+		) -> numpy.ndarray:
+	"""
+	Score how well the mass spectrum of each peak matches the isotope pattern in ``reference``.
 
-# 		data_frame["Mean"] = data_frame.apply(
-# 				func=df_delta_relative,
-# 				args=["Bob", "Alice"],
-# 				axis=1,
-# 				)
+	See :func:`~.isotope_pattern_scores` for details of the score.
 
-# 	:param row: Row of the data frame.
-# 	:param left_column:
-# 	:param right_column:
+	:param peaks: Peaks whose mass spectra have the same mass list, such as those from :func:`~.peak_finder`.
+	:param reference: The predicted spectrum, e.g. from :func:`~.get_adduct_spectra`.
+	:param mass_tol: The maximum difference between a reference mass and a matching experimental mass.
 
-# 	:return: The relative difference between ``left_column`` and ``right_column``.
-# 	"""  # noqa D400
+	:returns: The score of each peak.
+	"""
 
-# 	right = row[right_column]
-# 	if right:
-# 		return (row[left_column] - right) / right
-# 	else:
-# 		return float("inf")
+	masses, intensities = _stack_peak_spectra(peaks)
+	if not peaks:
+		return numpy.zeros(0, dtype=numpy.float64)
 
-# def find_best_peak(peak_list: List[Peak.Peak],
-# 					reference: MassSpectrum) -> List[Tuple[Peak.Peak, pandas.DataFrame]]:
-# 	results = [(peak, compare_iso_dist(reference, peak.mass_spectrum)) for peak in peak_list]
+	return isotope_pattern_scores(reference, masses, intensities, mass_tol=mass_tol)
 
-# 	def sort_func(item: Tuple[Peak.Peak, pandas.DataFrame]):
-# 		df = item[1]
-# 		return 100.0 / df.at[0, "Rel. Mass Δ"
-# 								]  # ,  100 / df.at[1, "Rel. Intensity Δ"]  # , 100.0 / df.at[1, "Rel. Mass Δ"]
 
-# 	results.sort(key=sort_func)
+def score_peaks_for_adducts(
+		peaks: Sequence[Peak],
+		spectra: Mapping[str, MassSpectrum],
+		mass_tol: float = 0.05,
+		) -> Dict[str, numpy.ndarray]:
+	"""
+	Score how well the mass spectrum of each peak matches the isotope pattern of each adduct.
 
-# 	# TODO: break ties. However, sorting a list of DataFrames is not stable,
-# 	# so probably need a custom sort function that uses
-# 	# https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.DataFrame.equals.html
+	See :func:`~.isotope_pattern_scores` for details of the score.
 
-# 	return results
+	:param peaks: Peaks whose mass spectra have the same mass list, such as those from :func:`~.peak_finder`.
+	:param spectra: A mapping of adducts to predicted spectra, as returned by :func:`~.get_adduct_spectra`.
+	:param mass_tol: The maximum difference between a reference mass and a matching experimental mass.
 
-# def composite_spectrum_from_peak(peak: Peak.Peak, im: BaseIntensityMatrix) -> "CompositeMassSpectrum":
-# 	bounds = peak.bounds
-# 	if not bounds or not bounds[0] or not bounds[1]:
-# 		raise ValueError("The peak has no bounds set!")
+	:returns: A mapping of adducts to the score of each peak.
+	"""
 
-# 	left_bound, apex, right_bound = peak.bounds
-# 	left_bound = apex - left_bound
-# 	right_bound = apex + right_bound
+	masses, intensities = _stack_peak_spectra(peaks)
 
-# 	print(peak.bounds)
-# 	spectra: List[MassSpectrum] = []
-# 	for idx in range(left_bound, right_bound + 1):
-# 		print(idx, im.get_ms_at_index(idx))
-# 		spectra.append(im.get_ms_at_index(idx))
+	scores = {}
+	for adduct, reference in spectra.items():
+		if peaks:
+			scores[adduct] = isotope_pattern_scores(reference, masses, intensities, mass_tol=mass_tol)
+		else:
+			scores[adduct] = numpy.zeros(0, dtype=numpy.float64)
+
+	return scores
+
+
+def find_best_peak(
+		peak_list: Sequence[Peak],
+		reference: MassSpectrum,
+		mass_tol: float = 0.05,
+		) -> List[Tuple[Peak, float]]:
+	"""
+	Rank the peaks by how well their mass spectra match the isotope pattern in ``reference``.
+
+	:param peak_list: Peaks whose mass spectra have the same mass list, such as those from :func:`~.peak_finder`.
+	:param reference: The predicted spectrum, e.g. from :func:`~.get_adduct_spectra`.
+	:param mass_tol: The maximum difference between a reference mass and a matching experimental mass.
+
+	:returns: ``(peak, score)`` pairs, best match first. Peaks with equal scores keep their original order.
+	"""
+
+	scores = score_peaks(peak_list, reference, mass_tol=mass_tol)
+	order = numpy.argsort(-scores, kind="stable")
+
+	return [(peak_list[idx], float(scores[idx])) for idx in order.tolist()]
+
+
+def _absolute_bounds(peak: Union[Peak, PeakRecord]) -> Tuple[int, int]:
+	"""
+	Returns the indices of the first and last scans of the peak.
+
+	:param peak:
+	"""
+
+	bounds = peak.bounds
+	if not bounds:
+		raise ValueError("The peak has no bounds set!")
+
+	left_bound, apex, right_bound = bounds
+	return apex - left_bound, apex + right_bound
+
+
+def composite_spectra(
+		peaks: Iterable[Union[Peak, PeakRecord]],
+		im: BaseIntensityMatrix,
+		) -> List[CompositeMassSpectrum]:
+	"""
+	Returns the composite mass spectrum of each peak, combining every scan between the peak's bounds.
+
+	The spectra are summed directly from slices of the intensity matrix,
+	without constructing a :class:`~pyms.Spectrum.MassSpectrum` for each scan.
+
+	:param peaks: Peaks with bounds, such as those from :func:`~.peak_finder`.
+	:param im: The intensity matrix the peaks were found in,
+		or any intensity matrix with the same scans (such as the full matrix rather than an extracted one).
+	"""
+
+	intensity_array = numpy.asarray(im._intensity_array)
+	mass_list = list(im.mass_list)
+	n_scans = len(intensity_array)
+
+	spectra = []
+
+	for peak in peaks:
+		left_bound, right_bound = _absolute_bounds(peak)
+		if left_bound < 0 or right_bound >= n_scans:
+			raise ValueError(f"The bounds of the peak ({left_bound}, {right_bound}) are outside the intensity matrix.")
+
+		# For a C-contiguous array, summing along the first axis adds the scans in order
+		# (as CompositeMassSpectrum.from_spectra does), so the totals are identical.
+		scans = numpy.ascontiguousarray(intensity_array[left_bound:right_bound + 1], dtype=numpy.float64)
+		intensities = scans.sum(axis=0)
+		spectrum = CompositeMassSpectrum(mass_list, intensities.tolist())
+		spectrum.size = right_bound - left_bound + 1
+		spectra.append(spectrum)
+
+	return spectra
+
+
+def composite_spectrum_from_peak(peak: Union[Peak, PeakRecord], im: BaseIntensityMatrix) -> CompositeMassSpectrum:
+	"""
+	Returns the composite mass spectrum of the peak, combining every scan between the peak's bounds.
+
+	:param peak: A peak with bounds, such as one from :func:`~.peak_finder`.
+	:param im: The intensity matrix the peak was found in,
+		or any intensity matrix with the same scans (such as the full matrix rather than an extracted one).
+	"""
 
-# 	# print(reduce(operator.add, spectra))
-# 	return CompositeMassSpectrum.from_spectra(spectra)
+	return composite_spectra([peak], im)[0]
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+#
+#  streaming.py
+"""
+Find peaks in LC-ESI-MS data one scan at a time.
+"""
+#
+#  Copyright © 2020-2023 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+from bisect import bisect_left, bisect_right
+from itertools import chain
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+# 3rd party
+import numpy
+from chemistry_tools.formulae import Formula
+from pyms.Peak import Peak
+from pyms.Spectrum import MassSpectrum, Scan
+
+# this package
+from pyms_lc_esi.adducts import Adduct, get_adduct_spectra
+from pyms_lc_esi.peak_filter import PeakFilter
+from pyms_lc_esi.peak_finder import BOUND_AREA_TOLERANCE, flank_area
+from pyms_lc_esi.spectra import AbundanceCutoff
+
+__all__ = ["StreamingPeakFinder", "stream_peak_finder"]
+
+# The most scans which could be part of one flank of a peak (see flank_area), with a margin for rounding.
+_MAX_FLANK_SCANS = int(1 / BOUND_AREA_TOLERANCE) + 1
+
+
+class StreamingPeakFinder:
+	"""
+	Find peaks for a set of masses in scans which are supplied one at a time.
+
+	The peaks found are the same as from :func:`~.peak_finder` for an
+	:class:`~pyms.eic.ExtractedIntensityMatrix` of the same masses, except that the noise level must be given.
+	The total intensity of each scan is accumulated one mass at a time, in order of increasing mass,
+	as in :func:`~.peak_finder`, so the peak areas are identical provided the masses in each scan are sorted.
+
+	Only the scans which could still form part of a peak are held in memory. A flank of a peak cannot extend
+	past a scan with no intensity, nor span more than ``1 / BOUND_AREA_TOLERANCE`` scans,
+	so the memory used does not grow with the length of the run.
+
+	:param masses: The masses to extract from each scan.
+	:param noise_level: Peaks with fewer than two masses at or above this intensity at the apex are discarded.
+	:param points: The number of scans over which to consider a maximum to be a peak.
+	:param left_bound: The lower bound of the window around each mass.
+	:param right_bound: The upper bound of the window around each mass.
+	:param peak_filter: The criteria which peaks must meet. Defaults to :class:`~.PeakFilter` with its default values.
+	"""
+
+	def __init__(
+			self,
+			masses: Iterable[float],
+			noise_level: float,
+			points: int = 3,
+			left_bound: float = 0.1,
+			right_bound: float = 0.1,
+			peak_filter: Optional[PeakFilter] = None,
+			):
+
+		target_masses = numpy.asarray(sorted(masses), dtype=numpy.float64)
+		self._window_lower = target_masses - left_bound
+		self._window_upper = target_masses + right_bound
+
+		self.noise_level: float = noise_level
+		self.peak_filter: PeakFilter = PeakFilter() if peak_filter is None else peak_filter
+
+		# Window size for maxima detection, as in pyms.BillerBiemann.get_maxima_indices
+		self._half = int(points / 2)
+		self._points = 2 * self._half + 1
+
+		#: The number of scans processed so far.
+		self.n_scans: int = 0
+
+		# The absolute index of the first scan in the buffer.
+		self._offset = 0
+		self._times: List[float] = []
+		self._tics: List[float] = []
+		self._spectra: List[Tuple[numpy.ndarray, numpy.ndarray]] = []
+
+		# Absolute indices of scans more intense than the following scan (falls),
+		# scans more intense than the preceding scan (rises), and scans with no intensity (zeros).
+		# A flank of a peak cannot extend past any of these.
+		self._falls: List[int] = []
+		self._rises: List[int] = []
+		self._zeros: List[int] = []
+
+		# Start of a plateau which may turn out to be a peak.
+		self._edge = -1
+
+		# Apexes whose right flank has not yet finished.
+		self._pending: List[int] = []
+
+	def _extract(self, scan: Scan) -> Tuple[numpy.ndarray, numpy.ndarray]:
+		"""
+		Returns the masses and intensities in the scan which fall within the window around any target mass.
+
+		:param scan:
+		"""
+
+		masses = numpy.asarray(scan.mass_list, dtype=numpy.float64)
+		intensities = numpy.asarray(scan.intensity_list, dtype=numpy.float64)
+
+		# Mark the start and end of each window, and select the masses inside at least one.
+		boundaries = numpy.zeros(len(masses) + 1, dtype=numpy.int64)
+		numpy.add.at(boundaries, numpy.searchsorted(masses, self._window_lower, side="left"), 1)
+		numpy.add.at(boundaries, numpy.searchsorted(masses, self._window_upper, side="right"), -1)
+		selected = numpy.cumsum(boundaries[:-1]) > 0
+
+		return masses[selected], intensities[selected]
+
+	def _tic_slice(self, start: int, stop: int) -> numpy.ndarray:
+		return numpy.asarray(self._tics[start - self._offset:stop - self._offset], dtype=numpy.float64)
+
+	def push(self, rt: float, scan: Scan) -> List[Peak]:
+		"""
+		Add the next scan, and return any peaks which were completed by it.
+
+		:param rt: The retention time of the scan.
+		:param scan:
+		"""
+
+		index = self.n_scans
+		self.n_scans += 1
+
+		spectrum = self._extract(scan)
+
+		# Accumulate in order (rather than with ``spectrum[1].sum()``) to match the totals in peak_finder.
+		tic = float(numpy.cumsum(spectrum[1])[-1]) if len(spectrum[1]) else 0.0
+
+		if tic <= 0:
+			self._zeros.append(index)
+
+		if self._tics:
+			previous_tic = self._tics[-1]
+			if tic > previous_tic:
+				self._rises.append(index)
+			elif tic < previous_tic:
+				self._falls.append(index - 1)
+
+		self._times.append(rt)
+		self._tics.append(tic)
+		self._spectra.append(spectrum)
+
+		if index >= self._points - 1:
+			self._check_for_maximum(index - self._half)
+
+		peaks = self._close_peaks(finished=False)
+		self._trim()
+
+		return peaks
+
+	def finish(self) -> List[Peak]:
+		"""
+		Signal that there are no more scans, and return the peaks which were still open.
+		"""
+
+		return self._close_peaks(finished=True)
+
+	def _check_for_maximum(self, centre: int) -> None:
+		# Mirrors the logic of pyms.BillerBiemann.get_maxima_indices
+		mid = self._tics[centre - self._offset]
+		max_left = self._tic_slice(centre - self._half, centre).max()
+		max_right = self._tic_slice(centre + 1, centre + self._half + 1).max()
+
+		if mid > max_left and mid > max_right:
+			# the max value is in the middle
+			self._pending.append(centre)
+			self._edge = -1
+
+		elif mid > max_left and mid == max_right:
+			# start of plateau following rise (left of peak?)
+			self._edge = centre
+
+		elif mid == max_left and mid > max_right:
+			# start of fall from plateau
+			if self._edge > -1:
+				self._pending.append(int((self._edge + centre) / 2))
+			self._edge = -1
+
+	def _lhs_start(self, apex_index: int) -> int:
+		"""
+		Returns the earliest scan which could be part of the left flank of the peak with the given apex.
+
+		:param apex_index:
+		"""
+
+		lhs_start = max(self._offset, apex_index - _MAX_FLANK_SCANS)
+
+		fall_pos = bisect_left(self._falls, apex_index)
+		if fall_pos:
+			lhs_start = max(lhs_start, self._falls[fall_pos - 1])
+
+		zero_pos = bisect_left(self._zeros, apex_index)
+		if zero_pos:
+			lhs_start = max(lhs_start, self._zeros[zero_pos - 1])
+
+		return lhs_start
+
+	def _rhs_stop(self, apex_index: int) -> Optional[int]:
+		"""
+		Returns the scan after the last which could be part of the right flank of the peak with the given apex.
+
+		:py:obj:`None` is returned if the flank could extend beyond the scans received so far.
+
+		:param apex_index:
+		"""
+
+		stops = []
+
+		rise_pos = bisect_right(self._rises, apex_index)
+		if rise_pos < len(self._rises):
+			stops.append(self._rises[rise_pos] + 1)
+
+		zero_pos = bisect_right(self._zeros, apex_index)
+		if zero_pos < len(self._zeros):
+			stops.append(self._zeros[zero_pos] + 1)
+
+		if self.n_scans > apex_index + _MAX_FLANK_SCANS:
+			stops.append(apex_index + 1 + _MAX_FLANK_SCANS)
+
+		return min(stops) if stops else None
+
+	def _close_peaks(self, finished: bool) -> List[Peak]:
+		peaks = []
+
+		while self._pending:
+			apex_index = self._pending[0]
+
+			rhs_stop = self._rhs_stop(apex_index)
+			if rhs_stop is None:
+				if not finished:
+					# The right flank may still be growing.
+					break
+				rhs_stop = self.n_scans
+
+			del self._pending[0]
+
+			apex_intensity = self._tics[apex_index - self._offset]
+			rhs_area, rhs_scans = flank_area(self._tic_slice(apex_index + 1, rhs_stop), apex_intensity)
+			lhs_area, lhs_scans = flank_area(
+					self._tic_slice(self._lhs_start(apex_index), apex_index)[::-1],
+					apex_intensity,
+					)
+			area = lhs_area + rhs_area - apex_intensity  # apex intensity was counted for each half
+
+			masses, intensities = self._spectra[apex_index - self._offset]
+			passes_apex = self.peak_filter.apex_mask(intensities[numpy.newaxis], self.noise_level)[0]
+			passes_area = self.peak_filter.area_mask(
+					numpy.array([area]),
+					numpy.array([lhs_scans + rhs_scans]),
+					self.noise_level,
+					)[0]
+
+			if passes_apex and passes_area:
+				peak = Peak(self._times[apex_index - self._offset], MassSpectrum(masses, intensities))
+				peak.area = area
+				peak.bounds = (lhs_scans, apex_index, rhs_scans)
+				peaks.append(peak)
+
+		return peaks
+
+	def _trim(self) -> None:
+		"""
+		Discard scans which can no longer be part of a peak, or of the window for finding maxima.
+		"""
+
+		# The earliest scan which is, or could become, an unclosed apex.
+		earliest_apex = self.n_scans - self._half
+		if self._pending:
+			earliest_apex = min(earliest_apex, self._pending[0])
+		if self._edge > -1:
+			earliest_apex = min(earliest_apex, self._edge)
+
+		keep_from = min(self._lhs_start(earliest_apex), self.n_scans - self._points + 1)
+		n_discard = keep_from - self._offset
+
+		if n_discard > 0:
+			del self._times[:n_discard]
+			del self._tics[:n_discard]
+			del self._spectra[:n_discard]
+			del self._falls[:bisect_left(self._falls, keep_from)]
+			del self._rises[:bisect_left(self._rises, keep_from)]
+			del self._zeros[:bisect_left(self._zeros, keep_from)]
+			self._offset = keep_from
+
+
+def stream_peak_finder(
+		scans: Iterable[Tuple[float, Scan]],
+		analyte: Formula,
+		adducts: Iterable[Adduct],
+		noise_level: float,
+		points: int = 3,
+		left_bound: float = 0.1,
+		right_bound: float = 0.1,
+		min_abundance: Union[float, AbundanceCutoff] = 0.001,
+		peak_filter: Optional[PeakFilter] = None,
+		) -> Iterator[Peak]:
+	"""
+	Find peaks for the given adducts of the analyte in a stream of scans, and calculate peak areas.
+
+	This is the streaming equivalent of :func:`~.make_im_for_adducts` followed by :func:`~.peak_finder`,
+	for data too large to hold in memory as an :class:`~pyms.IntensityMatrix.IntensityMatrix`.
+	Each peak is yielded as soon as its right flank ends.
+
+	:param scans: An iterable of ``(retention time, scan)`` pairs, in order of retention time.
+	:param analyte:
+	:param adducts:
+	:param noise_level: Peaks with fewer than two masses at or above this intensity at the apex are discarded.
+	:param points: The number of scans over which to consider a maximum to be a peak.
+	:param left_bound:
+	:param right_bound:
+	:param min_abundance: Ignore isotopologues whose (absolute) abundance is below this threshold.
+		Alternatively, an :class:`~.AbundanceCutoff` giving a relative abundance threshold
+		or the number of isotopologues to include.
+	:param peak_filter: The criteria which peaks must meet. Defaults to :class:`~.PeakFilter` with its default values.
+	"""
+
+	spectra = get_adduct_spectra(analyte, adducts, min_abundance=min_abundance)
+	masses: Sequence[float] = sorted(set(chain.from_iterable(spectrum.mass_list for spectrum in spectra.values())))
+
+	finder = StreamingPeakFinder(
+			masses,
+			noise_level=noise_level,
+			points=points,
+			left_bound=left_bound,
+			right_bound=right_bound,
+			peak_filter=peak_filter,
+			)
+
+	for rt, scan in scans:
+		yield from finder.push(rt, scan)
+
+	yield from finder.finish()
@@ -0,0 +1,188 @@
+# stdlib
+from concurrent.futures import ThreadPoolExecutor
+
+# 3rd party
+import numpy
+import pytest
+from chemistry_tools.formulae import Formula
+
+# this package
+from pyms_lc_esi.adducts import Adduct, AdductSet, AdductSpectrumCache, get_adduct_spectra, plus_h, plus_sodium
+from pyms_lc_esi.spectra import AbundanceCutoff, iso_dist_2_mass_spec
+
+FORMULAE = [Formula.from_string(f) for f in ("C6H6N2O", "C7H7NO2", "C12H11N")]
+
+
+def uncached(formula, adduct, min_abundance=0.001):
+	if not isinstance(min_abundance, AbundanceCutoff):
+		min_abundance = AbundanceCutoff(min_abundance)
+
+	spectrum = iso_dist_2_mass_spec(adduct(formula).isotope_distribution(), min_abundance)
+	return spectrum.mass_list, spectrum.intensity_list
+
+
+@pytest.mark.parametrize("min_abundance", [0.001, AbundanceCutoff(0.05, "relative"), AbundanceCutoff(2, "top_n")])
+def test_matches_uncached(min_abundance):
+	cache = AdductSpectrumCache()
+
+	for _ in range(2):
+		for formula in FORMULAE:
+			spectrum = cache.get_spectrum(formula, plus_h, min_abundance)
+			assert (spectrum.mass_list, spectrum.intensity_list) == uncached(formula, plus_h, min_abundance)
+
+	assert (cache.misses, cache.hits, cache.disk_hits) == (3, 3, 0)
+
+
+def test_float_and_cutoff_share_entries():
+	cache = AdductSpectrumCache()
+	cache.get_spectrum(FORMULAE[0], plus_h, 0.001)
+	cache.get_spectrum(FORMULAE[0], plus_h, AbundanceCutoff(0.001))
+
+	assert len(cache) == 1
+	assert (cache.misses, cache.hits) == (1, 1)
+
+
+def test_keyed_by_adduct_and_cutoff():
+	cache = AdductSpectrumCache()
+	cache.get_spectrum(FORMULAE[0], plus_h, 0.001)
+	cache.get_spectrum(FORMULAE[0], plus_sodium, 0.001)
+	cache.get_spectrum(FORMULAE[0], plus_h, 0.01)
+
+	assert len(cache) == 3
+	assert (cache.misses, cache.hits) == (3, 0)
+
+
+def test_lru_eviction():
+	cache = AdductSpectrumCache(maxsize=2)
+	a, b, c = FORMULAE
+
+	cache.get_spectrum(a, plus_h, 0.001)
+	cache.get_spectrum(b, plus_h, 0.001)
+	cache.get_spectrum(a, plus_h, 0.001)  # a is now the most recently used
+	cache.get_spectrum(c, plus_h, 0.001)  # evicts b
+
+	assert len(cache) == 2
+	assert (cache.misses, cache.hits) == (3, 1)
+
+	cache.get_spectrum(a, plus_h, 0.001)
+	assert (cache.misses, cache.hits) == (3, 2)
+
+	cache.get_spectrum(b, plus_h, 0.001)
+	assert (cache.misses, cache.hits) == (4, 2)
+
+
+def test_maxsize_zero():
+	cache = AdductSpectrumCache(maxsize=0)
+	cache.get_spectrum(FORMULAE[0], plus_h, 0.001)
+	cache.get_spectrum(FORMULAE[0], plus_h, 0.001)
+
+	assert len(cache) == 0
+	assert (cache.misses, cache.hits) == (2, 0)
+
+
+def test_returns_new_objects():
+	cache = AdductSpectrumCache()
+	first = cache.get_spectrum(FORMULAE[0], plus_h, 0.001)
+	first.mass_list.append(1000.0)
+
+	second = cache.get_spectrum(FORMULAE[0], plus_h, 0.001)
+	assert second is not first
+	assert (second.mass_list, second.intensity_list) == uncached(FORMULAE[0], plus_h)
+
+
+def test_disk_cache(tmp_path):
+	cache = AdductSpectrumCache(cache_dir=tmp_path)
+	expected = cache.get_spectrum(FORMULAE[0], plus_h, 0.001)
+	assert len(list(tmp_path.iterdir())) == 1
+
+	other = AdductSpectrumCache(cache_dir=tmp_path)
+	spectrum = other.get_spectrum(FORMULAE[0], plus_h, 0.001)
+	other.get_spectrum(FORMULAE[0], plus_h, 0.001)
+
+	assert (spectrum.mass_list, spectrum.intensity_list) == (expected.mass_list, expected.intensity_list)
+	assert (other.misses, other.disk_hits, other.hits) == (0, 1, 1)
+
+
+def test_corrupt_disk_cache(tmp_path):
+	AdductSpectrumCache(cache_dir=tmp_path).get_spectrum(FORMULAE[0], plus_h, 0.001)
+	for filename in tmp_path.iterdir():
+		filename.write_text('{"mass_list": [1')
+
+	cache = AdductSpectrumCache(cache_dir=tmp_path)
+	spectrum = cache.get_spectrum(FORMULAE[0], plus_h, 0.001)
+
+	assert (spectrum.mass_list, spectrum.intensity_list) == uncached(FORMULAE[0], plus_h)
+	assert (cache.misses, cache.disk_hits) == (1, 0)
+
+
+def test_clear():
+	cache = AdductSpectrumCache()
+	cache.get_spectrum(FORMULAE[0], plus_h, 0.001)
+	cache.get_spectrum(FORMULAE[0], plus_h, 0.001)
+	cache.clear()
+
+	assert len(cache) == 0
+	assert (cache.misses, cache.hits, cache.disk_hits) == (0, 0, 0)
+
+
+def test_counters_threaded():
+	cache = AdductSpectrumCache(maxsize=2)
+	jobs = FORMULAE * 20
+
+	with ThreadPoolExecutor(8) as executor:
+		spectra = list(executor.map(lambda formula: cache.get_spectrum(formula, plus_h, 0.001), jobs))
+
+	for formula, spectrum in zip(jobs, spectra):
+		assert (spectrum.mass_list, spectrum.intensity_list) == uncached(formula, plus_h)
+
+	assert cache.hits + cache.misses == len(jobs)
+	assert len(cache) == 2
+
+
+def test_get_adduct_spectra():
+	cache = AdductSpectrumCache()
+	spectra = get_adduct_spectra(FORMULAE[0], [plus_h, plus_sodium], cache=cache)
+
+	assert list(spectra) == [plus_h % 'M', plus_sodium % 'M']
+	for adduct, spectrum in zip([plus_h, plus_sodium], spectra.values()):
+		assert (spectrum.mass_list, spectrum.intensity_list) == uncached(FORMULAE[0], adduct)
+
+	assert cache.misses == 2
+
+
+def test_adduct_set():
+	adducts = [plus_h, plus_sodium, Adduct("[%s - H]⁻", 'H', "sub")]
+	adduct_set = AdductSet(adducts)
+
+	assert adduct_set.apply(FORMULAE) == [adduct(formula) for formula in FORMULAE for adduct in adducts]
+
+	expected_masses = [[adduct(formula).exact_mass for adduct in adducts] for formula in FORMULAE]
+	numpy.testing.assert_allclose(adduct_set.exact_masses(FORMULAE), expected_masses)
+
+	table = adduct_set.table(FORMULAE, cache=AdductSpectrumCache())
+	assert len(table) == len(FORMULAE) * len(adducts)
+
+	for idx, formula in enumerate(FORMULAE):
+		spectra = table.spectra_for(idx)
+		expected = get_adduct_spectra(formula, adducts, cache=AdductSpectrumCache())
+
+		assert list(spectra) == list(expected)
+		for name, spectrum in spectra.items():
+			assert (spectrum.mass_list, spectrum.intensity_list) == (
+					expected[name].mass_list,
+					expected[name].intensity_list,
+					)
+
+
+def test_adduct_set_include():
+	adduct_set = AdductSet([plus_h, plus_sodium])
+	include = numpy.array([[True, False], [False, False], [True, True]])
+
+	table = adduct_set.table(FORMULAE, cache=AdductSpectrumCache(), include=include)
+
+	assert list(table.spectra_for(0)) == [plus_h % 'M']
+	assert table.spectra_for(1) == {}
+	assert list(table.spectra_for(2)) == [plus_h % 'M', plus_sodium % 'M']
+
+	with pytest.raises(ValueError, match=r"'include' must have shape \(3, 2\), not \(2, 2\)"):
+		adduct_set.table(FORMULAE, include=include[:2])
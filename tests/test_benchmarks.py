@@ -0,0 +1,79 @@
+# stdlib
+import importlib.util
+import json
+
+# 3rd party
+import numpy
+import pytest
+from domdf_python_tools.paths import PathPlus
+
+# this package
+from pyms_lc_esi.peak_finder import make_im_for_adducts, peak_finder
+
+_spec = importlib.util.spec_from_file_location(
+		"run_benchmarks",
+		PathPlus(__file__).parent.parent / "benchmarks" / "run_benchmarks.py",
+		)
+assert _spec is not None and _spec.loader is not None
+run_benchmarks = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(run_benchmarks)
+
+
+def test_make_intensity_matrix():
+	im = run_benchmarks.make_intensity_matrix(n_scans=200, n_masses=150, seed=3)
+
+	assert im.intensity_array.shape == (200, 150)
+	assert im.mass_list[:3] == [100.0, 100.1, 100.2]
+	assert im.time_list[:3] == [0.0, 0.5, 1.0]
+	assert (im.intensity_array >= 0).all()
+
+	# Deterministic for a given seed
+	again = run_benchmarks.make_intensity_matrix(n_scans=200, n_masses=150, seed=3)
+	numpy.testing.assert_array_equal(im.intensity_array, again.intensity_array)
+
+	other = run_benchmarks.make_intensity_matrix(n_scans=200, n_masses=150, seed=4)
+	assert not numpy.array_equal(im.intensity_array, other.intensity_array)
+
+
+def test_make_intensity_matrix_has_analyte_peaks():
+	im = run_benchmarks.make_intensity_matrix(n_scans=500, n_masses=1500, peak_density=0.02)
+	e_im = make_im_for_adducts(im, run_benchmarks.ANALYTE, run_benchmarks.ADDUCTS)
+
+	peaks = list(peak_finder(e_im))
+	assert peaks
+	assert max(peak.area for peak in peaks) > 1e4
+
+
+def test_benchmark():
+	calls = []
+	result = run_benchmarks.benchmark(lambda: calls.append(bytearray(100_000)), repeats=3)
+
+	# Timed three times, then once more to measure memory
+	assert len(calls) == 4
+	assert result["repeats"] == 3
+	assert 0 <= result["min"] <= result["median"]
+	assert result["min"] <= result["mean"]
+	assert result["peak_memory"] >= 100_000
+
+
+@pytest.mark.parametrize("repeats", [1, 2])
+def test_main(tmp_path, repeats):
+	output = tmp_path / "results.json"
+	argv = ["--scans", "200", "--masses", "1500", "--repeats", str(repeats), "-o", str(output)]
+	assert run_benchmarks.main(argv) == 0
+
+	results = json.loads(output.read_text())
+	assert results["parameters"]["n_scans"] == 200
+	assert results["parameters"]["repeats"] == repeats
+	assert set(results["results"]) == {
+			"iso_dist_2_mass_spec",
+			"get_adduct_spectra",
+			"get_adduct_spectra_cached",
+			"make_im_for_adducts",
+			"peaks_from_maxima",
+			"candidates_from_maxima",
+			"sum_area",
+			"peak_finder",
+			"end_to_end",
+			}
+	assert all(result["repeats"] == repeats for result in results["results"].values())
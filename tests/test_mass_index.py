@@ -0,0 +1,157 @@
+# 3rd party
+import numpy
+import pytest
+from pyms.eic import build_extracted_intensity_matrix
+from pyms.IntensityMatrix import IntensityMatrix
+
+# this package
+from pyms_lc_esi.mass_index import MassIndex, get_scan_range, get_scan_span
+
+
+def make_intensity_matrix(shuffle: bool = False) -> IntensityMatrix:
+	rng = numpy.random.default_rng(1)
+
+	mass_list = numpy.round(numpy.arange(100, 160.05, 0.1), 1)
+	if shuffle:
+		mass_list = rng.permutation(mass_list)
+
+	time_list = numpy.arange(200) * 0.5
+	intensity_array = rng.exponential(50, size=(len(time_list), len(mass_list)))
+
+	return IntensityMatrix(time_list.tolist(), mass_list.tolist(), intensity_array)
+
+
+MASSES = [
+		pytest.param([123.0], id="one"),
+		pytest.param([123.0, 124.05, 146.0], id="several"),
+		pytest.param([146.0, 123.0, 123.0], id="unsorted_duplicates"),
+		pytest.param([99.8, 123.0], id="partly_below_range"),
+		pytest.param([100.0, 160.0], id="range_edges"),
+		pytest.param([123.0, 123.2], id="overlapping"),
+		]
+BOUNDS = [(0.5, 0.5), (0.1, 0.1), (0.3, 0.7), (0, 0)]
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+@pytest.mark.parametrize("masses", MASSES)
+@pytest.mark.parametrize("left_bound, right_bound", BOUNDS)
+def test_extract(shuffle, masses, left_bound, right_bound):
+	im = make_intensity_matrix(shuffle)
+
+	expected = build_extracted_intensity_matrix(im, masses, left_bound=left_bound, right_bound=right_bound)
+	e_im = MassIndex(im).extract(masses, left_bound=left_bound, right_bound=right_bound)
+
+	assert e_im.mass_list == expected.mass_list
+	assert e_im.time_list == expected.time_list
+	numpy.testing.assert_array_equal(e_im.intensity_array, expected.intensity_array)
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+@pytest.mark.parametrize("masses", MASSES)
+@pytest.mark.parametrize("left_bound, right_bound", BOUNDS)
+def test_get_indices(shuffle, masses, left_bound, right_bound):
+	im = make_intensity_matrix(shuffle)
+
+	expected = [
+			idx for idx, mass in enumerate(im.mass_list)
+			if any((target - left_bound) <= mass <= (target + right_bound) for target in masses)
+			]
+
+	indices = MassIndex(im).get_indices(masses, left_bound=left_bound, right_bound=right_bound)
+	assert indices.tolist() == expected
+
+
+def test_get_indices_no_masses():
+	assert MassIndex(make_intensity_matrix()).get_indices([]).tolist() == []
+
+
+@pytest.mark.parametrize("min_intensity", [0, 200, 1e9])
+def test_has_signal(min_intensity):
+	im = make_intensity_matrix()
+	masses = [50.0, 99.6, 123.0, 146.0, 160.4, 300.0]
+
+	expected = []
+	for mass in masses:
+		columns = [idx for idx, m in enumerate(im.mass_list) if mass - 0.5 <= m <= mass + 0.5]
+		expected.append(bool(columns) and bool((im.intensity_array[:, columns] > min_intensity).any()))
+
+	assert MassIndex(im).has_signal(masses, min_intensity=min_intensity).tolist() == expected
+
+
+def test_extract_outside_mass_range():
+	with pytest.raises(ValueError, match="None of the masses are within the mass range"):
+		MassIndex(make_intensity_matrix()).extract([170.0, 180.0])
+
+
+@pytest.mark.parametrize(
+		"rt_window, expected",
+		[
+				(None, (0, 200)),
+				((10.0, 20.0), (20, 41)),
+				((10.2, 19.8), (21, 40)),
+				((-5.0, 1000.0), (0, 200)),
+				((200.0, 300.0), (200, 200)),
+				((10.0, 10.0), (20, 21)),
+				]
+		)
+def test_get_scan_range(rt_window, expected):
+	assert get_scan_range(make_intensity_matrix().time_list, rt_window) == expected
+
+
+def test_get_scan_range_reversed():
+	with pytest.raises(ValueError, match="is after the end"):
+		get_scan_range(make_intensity_matrix().time_list, (20.0, 10.0))
+
+
+@pytest.mark.parametrize(
+		"rt_windows, expected",
+		[
+				([None], (0, 200)),
+				([(10.0, 20.0)], (20, 41)),
+				([(10.0, 20.0), (30.0, 40.0)], (20, 81)),
+				([(30.0, 40.0), (10.0, 20.0)], (20, 81)),
+				([(10.0, 20.0), None], (0, 200)),
+				([(10.0, 20.0), (200.0, 300.0)], (20, 41)),
+				([(200.0, 300.0)], (0, 0)),
+				([], (0, 0)),
+				]
+		)
+def test_get_scan_span(rt_windows, expected):
+	assert get_scan_span(make_intensity_matrix().time_list, rt_windows) == expected
+
+
+def test_extract_rt_window():
+	im = make_intensity_matrix()
+	masses = [123.0, 124.05, 146.0]
+
+	expected = build_extracted_intensity_matrix(im, masses)
+	e_im = MassIndex(im).extract(masses, rt_window=(10.0, 20.0))
+
+	# Only the scans within the window are in the result.
+	assert e_im.mass_list == expected.mass_list
+	assert e_im.time_list == expected.time_list[20:41]
+	numpy.testing.assert_array_equal(e_im.intensity_array, expected.intensity_array[20:41])
+
+
+def test_extract_windows():
+	im = make_intensity_matrix()
+	mass_index = MassIndex(im)
+
+	e_im = mass_index.extract_windows([([123.0], (10.0, 20.0)), ([146.0], (30.0, 40.0))])
+	assert e_im.time_list == im.time_list[20:81]
+
+	expected = build_extracted_intensity_matrix(im, [123.0, 146.0]).intensity_array[20:81]
+	columns_123 = [idx for idx, mass in enumerate(e_im.mass_list) if mass < 130]
+	columns_146 = [idx for idx, mass in enumerate(e_im.mass_list) if mass > 130]
+
+	# Each group's masses are zero outside of its own window.
+	intensity_array = e_im.intensity_array
+	numpy.testing.assert_array_equal(intensity_array[:21, columns_123], expected[:21, columns_123])
+	numpy.testing.assert_array_equal(intensity_array[21:, columns_123], 0)
+	numpy.testing.assert_array_equal(intensity_array[:40, columns_146], 0)
+	numpy.testing.assert_array_equal(intensity_array[40:, columns_146], expected[40:, columns_146])
+
+
+def test_extract_rt_window_no_scans():
+	with pytest.raises(ValueError, match="None of the scans are within the retention time windows"):
+		MassIndex(make_intensity_matrix()).extract([123.0], rt_window=(200.0, 300.0))
@@ -0,0 +1,82 @@
+# 3rd party
+import numpy
+import pytest
+from pyms.IntensityMatrix import IntensityMatrix
+
+# this package
+from pyms_lc_esi.adducts import plus_h, plus_sodium
+from pyms_lc_esi.matrix_store import (
+		is_intensity_matrix_store,
+		load_intensity_matrix,
+		save_array,
+		save_intensity_matrix
+		)
+from pyms_lc_esi.peak_finder import make_im_for_adducts, peak_finder
+from pyms_lc_esi.peak_record import PeakRecord
+from test_peak_finder import NICOTINAMIDE, make_intensity_matrix
+
+
+@pytest.fixture(scope="module")
+def im() -> IntensityMatrix:
+	return make_intensity_matrix()
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(tmp_path, im: IntensityMatrix, mmap: bool):
+	save_intensity_matrix(im, tmp_path / "store")
+	assert is_intensity_matrix_store(tmp_path / "store")
+
+	loaded = load_intensity_matrix(tmp_path / "store", mmap=mmap)
+
+	assert loaded.time_list == im.time_list
+	assert loaded.mass_list == im.mass_list
+	assert loaded.intensity_array.dtype == im.intensity_array.dtype
+	numpy.testing.assert_array_equal(loaded.intensity_array, im.intensity_array)
+	assert isinstance(loaded._intensity_array, numpy.memmap) is mmap
+
+	if mmap:
+		with pytest.raises(ValueError, match="read-only"):
+			loaded._intensity_array[0, 0] = 1
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_peaks_from_store(tmp_path, im: IntensityMatrix, mmap: bool):
+	save_intensity_matrix(im, tmp_path)
+	loaded = load_intensity_matrix(tmp_path, mmap=mmap)
+
+	expected = list(peak_finder(make_im_for_adducts(im, NICOTINAMIDE, [plus_h, plus_sodium])))
+	peaks = list(peak_finder(make_im_for_adducts(loaded, NICOTINAMIDE, [plus_h, plus_sodium])))
+
+	assert [PeakRecord.from_peak(peak) for peak in peaks] == [PeakRecord.from_peak(peak) for peak in expected]
+
+
+def test_overwrite(tmp_path, im: IntensityMatrix):
+	save_intensity_matrix(make_intensity_matrix(n_scans=100), tmp_path)
+	save_intensity_matrix(im, tmp_path)
+
+	loaded = load_intensity_matrix(tmp_path)
+	numpy.testing.assert_array_equal(loaded.intensity_array, im.intensity_array)
+	assert sorted(path.name for path in tmp_path.iterdir()) == [
+			"intensity_array.npy",
+			"mass_list.npy",
+			"time_list.npy",
+			]
+
+
+def test_incomplete_store(tmp_path, im: IntensityMatrix):
+	assert not is_intensity_matrix_store(tmp_path)
+
+	save_intensity_matrix(im, tmp_path)
+	(tmp_path / "intensity_array.npy").unlink()
+
+	assert not is_intensity_matrix_store(tmp_path)
+	with pytest.raises(FileNotFoundError, match="No intensity matrix found in"):
+		load_intensity_matrix(tmp_path)
+
+
+def test_save_array(tmp_path):
+	array = numpy.arange(12, dtype=numpy.float64).reshape(3, 4)
+	save_array(tmp_path / "array.npy", array)
+
+	numpy.testing.assert_array_equal(numpy.load(tmp_path / "array.npy"), array)
+	assert [path.name for path in tmp_path.iterdir()] == ["array.npy"]
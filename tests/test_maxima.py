@@ -0,0 +1,143 @@
+# 3rd party
+import numpy
+import pytest
+from pyms.BillerBiemann import get_maxima_indices
+
+# this package
+from pyms_lc_esi.peak_finder import _maxima_indices, _merge_close_apexes, _tic_from_buffer
+
+POINTS = [2, 3, 4, 5, 6, 7, 10]
+
+
+def check_maxima(intensities, points):
+	intensities = numpy.asarray(intensities, dtype=numpy.float64)
+	expected = get_maxima_indices(intensities.tolist(), points)
+	assert _maxima_indices(intensities, points).tolist() == expected
+
+
+@pytest.mark.parametrize("points", POINTS)
+@pytest.mark.parametrize("seed", range(10))
+def test_maxima_random(points, seed):
+	rng = numpy.random.default_rng(seed)
+	check_maxima(rng.exponential(50, size=500), points)
+
+
+@pytest.mark.parametrize("points", POINTS)
+@pytest.mark.parametrize("seed", range(10))
+def test_maxima_plateaus(points, seed):
+	# Few distinct values, so most maxima are plateaus of varying width.
+	rng = numpy.random.default_rng(seed)
+	check_maxima(rng.integers(0, 4, size=500), points)
+	check_maxima(numpy.repeat(rng.integers(0, 6, size=100), rng.integers(1, 6, size=100)), points)
+
+
+@pytest.mark.parametrize("points", POINTS)
+@pytest.mark.parametrize(
+		"intensities",
+		[
+				pytest.param([5, 4, 3, 2, 1, 0, 0], id="maximum_at_start"),
+				pytest.param([0, 0, 1, 2, 3, 4, 5], id="maximum_at_end"),
+				pytest.param([5, 5, 5, 1, 0, 0, 0], id="plateau_at_start"),
+				pytest.param([0, 0, 0, 1, 5, 5, 5], id="plateau_at_end"),
+				pytest.param([0, 1, 3, 3, 3, 3, 1, 0], id="plateau"),
+				pytest.param([0, 3, 3, 1, 3, 3, 0], id="two_plateaus"),
+				pytest.param([0, 3, 3, 4, 3, 3, 0], id="plateau_then_maximum"),
+				pytest.param([0, 3, 3, 3, 2, 2, 3, 3, 0], id="plateau_rise"),
+				pytest.param([1, 2, 3, 4, 5, 4, 3, 2, 1, 2, 3, 4, 5, 6, 5, 4, 3, 2, 1], id="pyms_example"),
+				pytest.param([0] * 50, id="zeros"),
+				pytest.param([7.5] * 50, id="constant"),
+				pytest.param([], id="empty"),
+				pytest.param([1], id="one"),
+				pytest.param([0, 1, 0], id="three"),
+				]
+		)
+def test_maxima_edges(points, intensities):
+	check_maxima(intensities, points)
+
+
+@pytest.mark.parametrize("points", [0, 1])
+def test_maxima_too_few_points(points):
+	intensities = [0.0, 1.0, 0.0]
+
+	with pytest.raises(ValueError):
+		get_maxima_indices(intensities, points)
+
+	with pytest.raises(ValueError):
+		_maxima_indices(numpy.asarray(intensities), points)
+
+
+def check_tic(intensity_array):
+	# The original implementation summed each scan with the builtin sum().
+	expected = numpy.array([sum(row) for row in intensity_array], dtype=numpy.float64)
+	tic = _tic_from_buffer(intensity_array)
+
+	assert tic.dtype == numpy.float64
+	assert tic.tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize("n_masses", [1, 2, 7, 64, 257])
+@pytest.mark.parametrize("seed", range(5))
+def test_tic_random(n_masses, seed):
+	rng = numpy.random.default_rng(seed)
+	check_tic(rng.exponential(50, size=(300, n_masses)))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_tic_wide_range(seed):
+	# Intensities spanning many orders of magnitude, where the order of summation matters.
+	rng = numpy.random.default_rng(seed)
+	check_tic(10**rng.uniform(-3, 12, size=(300, 40)))
+
+
+def test_tic_zeros():
+	check_tic(numpy.zeros((100, 10)))
+
+
+def test_tic_no_scans():
+	check_tic(numpy.zeros((0, 10)))
+
+
+@pytest.mark.parametrize(
+		"apex_indices, intensities, scans, expected",
+		[
+				pytest.param([10, 12, 14, 16, 18], [5, 4, 3, 2, 1], 3, [10, 14, 18], id="falling_chain"),
+				pytest.param([10, 12, 14, 16, 18], [1, 2, 3, 4, 5], 3, [18], id="rising_chain"),
+				pytest.param([10, 12, 14, 16, 18], [1, 5, 1, 1, 1], 3, [12, 16], id="chain"),
+				pytest.param([10, 12, 20], [3, 3, 3], 3, [10, 20], id="tie"),
+				pytest.param([10, 13, 16], [3, 2, 1], 3, [10, 13, 16], id="exactly_scans_apart"),
+				pytest.param([10, 12, 14], [3, 2, 1], 1, [10, 12, 14], id="scans_1"),
+				pytest.param([10], [3], 5, [10], id="one"),
+				pytest.param([], [], 5, [], id="none"),
+				]
+		)
+def test_merge_close_apexes(apex_indices, intensities, scans, expected):
+	tic = numpy.zeros(50)
+	tic[apex_indices] = intensities
+
+	merged = _merge_close_apexes(numpy.array(apex_indices, dtype=numpy.intp), tic, scans)
+	assert merged.tolist() == expected
+
+
+@pytest.mark.parametrize("scans", [2, 3, 5, 10])
+@pytest.mark.parametrize("seed", range(10))
+def test_merge_close_apexes_random(scans, seed):
+	rng = numpy.random.default_rng(seed)
+	tic = rng.exponential(50, size=500)
+	apex_indices = _maxima_indices(tic, points=3)
+
+	merged = _merge_close_apexes(apex_indices, tic, scans).tolist()
+
+	# The apexes which are kept are at least ``scans`` apart ...
+	assert set(merged) <= set(apex_indices.tolist())
+	assert all(b - a >= scans for a, b in zip(merged, merged[1:]))
+
+	# ... each apex which is dropped was close to an apex at least as intense ...
+	for apex_index in set(apex_indices.tolist()) - set(merged):
+		assert any(
+				0 < abs(apex_index - other) < scans and tic[other] >= tic[apex_index]
+				for other in apex_indices.tolist()
+				)
+
+	# ... and chains of close apexes are not collapsed into one.
+	n_chains = numpy.count_nonzero(numpy.diff(apex_indices) >= scans) + 1
+	assert len(merged) >= n_chains
@@ -0,0 +1,61 @@
+# 3rd party
+import numpy
+import pytest
+from pyms.IonChromatogram import IonChromatogram
+from pyms.Utils.Math import MAD
+
+# this package
+from pyms_lc_esi.noise import rolling_mad_noise
+
+
+def brute_force(intensities, window=256, step=None):
+	# The minimum MAD of windows placed every ``step`` scans, calculated with pyms.Utils.Math.MAD
+	intensities = list(intensities)
+	window = max(1, min(window, len(intensities)))
+	if step is None:
+		step = max(1, window // 4)
+
+	noise_level = max(intensities) - min(intensities)
+	for start in range(0, len(intensities) - window + 1, step):
+		noise_level = min(noise_level, MAD(intensities[start:start + window]))
+
+	return noise_level
+
+
+@pytest.mark.parametrize("n_scans", [1, 2, 50, 255, 256, 257, 1000, 3000])
+@pytest.mark.parametrize("window, step", [(256, None), (64, 1), (64, 7), (100, 100), (10, 25)])
+def test_rolling_mad_noise(n_scans, window, step):
+	rng = numpy.random.default_rng(n_scans)
+	intensities = rng.exponential(50, size=n_scans)
+	intensities[n_scans // 2:] += 1000  # a step change, so the windows differ
+
+	assert rolling_mad_noise(intensities, window, step) == pytest.approx(brute_force(intensities, window, step))
+
+
+def test_ion_chromatogram():
+	rng = numpy.random.default_rng(1)
+	intensities = rng.exponential(50, size=1000)
+	ic = IonChromatogram(intensities, list(range(1000)))
+
+	assert rolling_mad_noise(ic) == rolling_mad_noise(intensities)
+	assert rolling_mad_noise(ic) == pytest.approx(brute_force(intensities))
+
+
+def test_constant():
+	assert rolling_mad_noise(numpy.full(500, 7.5)) == 0
+
+
+def test_repeatable():
+	rng = numpy.random.default_rng(1)
+	intensities = rng.exponential(50, size=1000)
+	expected = rolling_mad_noise(intensities)
+
+	# Results do not depend on earlier calls, even if the array is modified in place.
+	assert rolling_mad_noise(intensities) == expected
+	intensities *= 2
+	assert rolling_mad_noise(intensities) == pytest.approx(expected * 2)
+
+
+def test_empty():
+	with pytest.raises(ValueError, match="Cannot estimate the noise of an empty chromatogram."):
+		rolling_mad_noise(numpy.empty(0))
@@ -0,0 +1,145 @@
+# stdlib
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+# 3rd party
+import numpy
+import pytest
+from chemistry_tools.formulae import Formula
+from pyms.IntensityMatrix import IntensityMatrix
+
+# this package
+from pyms_lc_esi.adducts import plus_h, plus_sodium
+from pyms_lc_esi.parallel import (
+		_adduct_to_state,
+		_formula_to_state,
+		_screen_sample,
+		_screen_sample_isolated,
+		screen_samples
+		)
+from pyms_lc_esi.peak_finder import find_peaks_for_analytes
+from pyms_lc_esi.peak_record import PeakRecord
+
+ADDUCTS = [plus_h, plus_sodium]
+ANALYTES = [Formula.from_string("C6H6N2O"), Formula.from_string("C7H7NO2")]
+
+# Samples which crash the worker process, or raise an exception, when loaded.
+CRASH = 1
+CORRUPT = 3
+
+
+def load(sample: int) -> IntensityMatrix:
+	if sample == CRASH:
+		os._exit(1)
+	elif sample == CORRUPT:
+		raise OSError("corrupt file")
+
+	rng = numpy.random.default_rng(sample)
+
+	mass_list = numpy.round(numpy.arange(100, 180.05, 0.1), 1)
+	intensity_array = rng.exponential(50, size=(400, len(mass_list)))
+
+	scans = numpy.arange(400)
+	for centre in rng.uniform(0, 400, size=10):
+		profile = rng.uniform(1e3, 1e5) * numpy.exp(-0.5 * ((scans - centre) / rng.uniform(2, 6))**2)
+		intensity_array[:, rng.choice(len(mass_list), size=40)] += profile[:, numpy.newaxis]
+
+	return IntensityMatrix((scans * 0.5).tolist(), mass_list.tolist(), intensity_array)
+
+
+def expected_peaks(sample: int):
+	return find_peaks_for_analytes(load(sample), ANALYTES, ADDUCTS, noise=100.0)
+
+
+def as_records(peaks):
+	return [[PeakRecord.from_peak(peak) for peak in analyte_peaks] for analyte_peaks in peaks]
+
+
+def screening_args(sample: int, compact: bool = True):
+	return (
+			load,
+			sample,
+			[_formula_to_state(analyte) for analyte in ANALYTES],
+			[_adduct_to_state(adduct) for adduct in ADDUCTS],
+			3,
+			0.1,
+			0.1,
+			0.001,
+			compact,
+			100.0,
+			None,
+			1,
+			False,
+			None,
+			None,
+			)
+
+
+@pytest.mark.parametrize("compact", [True, False])
+def test_screen_sample(compact: bool):
+	peaks, error = _screen_sample(*screening_args(0, compact=compact))
+
+	assert error is None
+	assert peaks is not None
+
+	if compact:
+		assert all(isinstance(peak, PeakRecord) for analyte_peaks in peaks for peak in analyte_peaks)
+		assert peaks == as_records(expected_peaks(0))
+	else:
+		assert as_records(peaks) == as_records(expected_peaks(0))
+
+
+def test_screen_sample_error():
+	peaks, error = _screen_sample(*screening_args(CORRUPT))
+
+	assert peaks is None
+	assert error is not None
+	assert "OSError: corrupt file" in error
+
+
+def test_screen_sample_isolated():
+	assert _screen_sample_isolated(screening_args(0)) == _screen_sample(*screening_args(0))
+
+
+def test_screen_sample_isolated_crash():
+	with pytest.raises(BrokenProcessPool):
+		_screen_sample_isolated(screening_args(CRASH))
+
+
+@pytest.mark.parametrize("per_analyte", [False, True])
+def test_screen_samples(per_analyte: bool):
+	samples = [0, CRASH, 2, CORRUPT, 4, 5]
+	results = list(
+			screen_samples(
+					samples,
+					load,
+					ANALYTES,
+					ADDUCTS,
+					noise=100.0,
+					compact=True,
+					per_analyte=per_analyte,
+					max_workers=2,
+					max_pending=3,
+					)
+			)
+
+	if per_analyte:
+		assert [(result.sample, result.analytes) for result in results
+				] == [(sample, [analyte]) for sample in samples for analyte in ANALYTES]
+	else:
+		assert [(result.sample, result.analytes) for result in results] == [(sample, ANALYTES) for sample in samples]
+
+	for result in results:
+		if result.sample == CRASH:
+			# Only the sample which crashed its worker process fails.
+			assert not result.success
+			assert "BrokenProcessPool" in result.error
+		elif result.sample == CORRUPT:
+			assert not result.success
+			assert "OSError: corrupt file" in result.error
+		else:
+			assert result.success
+			expected = as_records(expected_peaks(result.sample))
+			if per_analyte:
+				expected = [expected[ANALYTES.index(result.analytes[0])]]
+			assert result.peaks == expected
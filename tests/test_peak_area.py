@@ -0,0 +1,157 @@
+# stdlib
+from typing import Optional, Tuple
+
+# 3rd party
+import numpy
+import pytest
+from pyms.eic import ExtractedIntensityMatrix
+
+# this package
+from pyms_lc_esi.peak_finder import sum_area, sum_areas
+
+
+def baseline_sum_area(
+		apex_index: int,
+		e_im: ExtractedIntensityMatrix,
+		max_width: Optional[int] = None,
+		) -> Tuple[float, int, int]:
+	# The original implementation, summing the intensities of each scan in turn.
+	# ``max_width`` limits the number of scans considered on each side of the apex.
+
+	if max_width is None:
+		max_width = len(e_im.intensity_array)
+
+	apex_intensity = sum(e_im.intensity_array[apex_index])
+	rhs_area = lhs_area = last_intensity = apex_intensity
+	left_bound = right_bound = apex_index
+	bound_area_tolerance = 0.0005 / 2  # half of 0.05 %
+
+	for idx_offset, scan in enumerate(e_im.intensity_array[apex_index + 1:][:max_width]):
+		scan_intensity = sum(scan)
+
+		if scan_intensity <= last_intensity and scan_intensity > (rhs_area * bound_area_tolerance):
+			last_intensity = scan_intensity
+			rhs_area += scan_intensity
+			right_bound = idx_offset + apex_index + 1
+		else:
+			break
+
+	last_intensity = apex_intensity
+
+	for idx_offset, scan in enumerate(reversed(e_im.intensity_array[:apex_index])):
+		if idx_offset >= max_width:
+			break
+
+		scan_intensity = sum(scan)
+
+		if scan_intensity <= last_intensity and scan_intensity > (lhs_area * bound_area_tolerance):
+			last_intensity = scan_intensity
+			lhs_area += scan_intensity
+			left_bound = (apex_index - idx_offset) - 1
+		else:
+			break
+
+	area = lhs_area + rhs_area - apex_intensity  # apex intensity was counted for each half
+	return area, left_bound, right_bound
+
+
+def make_e_im(intensity_array: numpy.ndarray) -> ExtractedIntensityMatrix:
+	n_scans, n_masses = intensity_array.shape
+	return ExtractedIntensityMatrix(
+			time_list=(numpy.arange(n_scans) * 0.5).tolist(),
+			mass_list=(100 + numpy.arange(n_masses) * 0.1).tolist(),
+			intensity_array=intensity_array,
+			)
+
+
+def random_e_im(seed: int, n_scans: int = 300, n_masses: int = 12) -> ExtractedIntensityMatrix:
+	rng = numpy.random.default_rng(seed)
+	intensity_array = rng.exponential(50, size=(n_scans, n_masses))
+
+	scans = numpy.arange(n_scans)
+	for centre in [0, n_scans - 1, *rng.uniform(0, n_scans, size=8)]:
+		profile = rng.uniform(1e3, 1e5) * numpy.exp(-0.5 * ((scans - centre) / rng.uniform(1, 10))**2)
+		intensity_array += numpy.outer(profile, rng.uniform(0.2, 1, size=n_masses))
+
+	# Plateaus and scans with no intensity.
+	intensity_array[rng.integers(0, n_scans, size=10)] = 0
+	intensity_array[100:110] = intensity_array[100]
+
+	return make_e_im(intensity_array)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_sum_area(seed: int):
+	e_im = random_e_im(seed)
+
+	for apex_index in range(len(e_im.time_list)):
+		assert sum_area(apex_index, e_im) == baseline_sum_area(apex_index, e_im)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_sum_areas(seed: int):
+	e_im = random_e_im(seed)
+	apex_indices = list(range(len(e_im.time_list)))
+
+	assert sum_areas(apex_indices, e_im) == [baseline_sum_area(idx, e_im) for idx in apex_indices]
+
+
+@pytest.mark.parametrize("apex_index", [0, 1, 198, 199])
+def test_sum_area_edges(apex_index: int):
+	# A single peak spanning the whole matrix, so each flank only stops at the edge.
+	tic = 1e5 - numpy.abs(numpy.arange(200) - apex_index)
+	e_im = make_e_im(numpy.outer(tic, [0.25, 0.75]))
+
+	area, left_bound, right_bound = sum_area(apex_index, e_im)
+	assert (left_bound, right_bound) == (0, 199)
+	assert (area, left_bound, right_bound) == baseline_sum_area(apex_index, e_im)
+
+
+def test_sum_area_tolerance():
+	# A slowly decaying flank ends once a scan is no more than 0.025% of the area so far.
+	tic = 1e5 * 0.999**numpy.arange(5000)
+	e_im = make_e_im(tic[:, numpy.newaxis])
+
+	area, left_bound, right_bound = sum_area(0, e_im)
+	assert left_bound == 0
+	assert 0 < right_bound < 4999
+	assert tic[right_bound + 1] <= 0.00025 * tic[:right_bound + 1].sum()
+	assert (area, left_bound, right_bound) == baseline_sum_area(0, e_im)
+
+
+def test_sum_area_constant():
+	# A flank can never span more than 1 / 0.00025 scans.
+	e_im = make_e_im(numpy.full((10000, 1), 100.0))
+
+	area, left_bound, right_bound = sum_area(5000, e_im)
+	assert 5000 - left_bound <= 4000
+	assert right_bound - 5000 <= 4000
+	assert (area, left_bound, right_bound) == baseline_sum_area(5000, e_im)
+
+
+@pytest.mark.parametrize("max_width", [0, 1, 3, 10, 1000])
+@pytest.mark.parametrize("seed", range(3))
+def test_sum_areas_max_width(seed: int, max_width: int):
+	e_im = random_e_im(seed)
+	apex_indices = list(range(len(e_im.time_list)))
+
+	expected = [baseline_sum_area(idx, e_im, max_width=max_width) for idx in apex_indices]
+	assert sum_areas(apex_indices, e_im, max_width=max_width) == expected
+
+	for _, left_bound, right_bound in expected:
+		assert right_bound - left_bound <= 2 * max_width
+
+
+@pytest.mark.parametrize("apex_index", [0, 5, 194, 199])
+def test_sum_area_max_width_edges(apex_index: int):
+	tic = 1e5 - numpy.abs(numpy.arange(200) - apex_index)
+	e_im = make_e_im(numpy.outer(tic, [0.25, 0.75]))
+
+	area, left_bound, right_bound = sum_area(apex_index, e_im, max_width=10)
+	assert (left_bound, right_bound) == (max(apex_index - 10, 0), min(apex_index + 10, 199))
+	assert (area, left_bound, right_bound) == baseline_sum_area(apex_index, e_im, max_width=10)
+
+
+def test_sum_areas_negative_max_width():
+	with pytest.raises(ValueError, match="'max_width' cannot be negative"):
+		sum_areas([0], random_e_im(0), max_width=-1)
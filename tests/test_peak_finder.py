@@ -0,0 +1,170 @@
+# 3rd party
+import numpy
+import pytest
+from chemistry_tools.formulae import Formula
+from pyms.IntensityMatrix import IntensityMatrix
+
+# this package
+from pyms_lc_esi.adducts import AdductSet, plus_h, plus_sodium
+from pyms_lc_esi.mass_index import MassIndex
+from pyms_lc_esi.peak_finder import find_peaks_for_analytes, make_im_for_adducts, make_ims_for_analytes, peak_finder
+
+ADDUCTS = [plus_h, plus_sodium]
+
+# [M+H]+ at m/z 123.04, within the mass range of the intensity matrix.
+NICOTINAMIDE = Formula.from_string("C6H6N2O")
+
+# [M+H]+ at m/z 170.10, above the mass range of the intensity matrix.
+DIPHENYLAMINE = Formula.from_string("C12H11N")
+
+
+def make_intensity_matrix(min_mass: float = 100, max_mass: float = 160, n_scans: int = 500) -> IntensityMatrix:
+	rng = numpy.random.default_rng(1)
+
+	mass_list = numpy.round(numpy.arange(min_mass, max_mass + 0.05, 0.1), 1)
+	time_list = numpy.arange(n_scans) * 0.5
+	intensity_array = rng.exponential(50, size=(n_scans, len(mass_list)))
+
+	profile = 1e5 * numpy.exp(-0.5 * ((numpy.arange(n_scans) - 250) / 4)**2)
+	columns = numpy.flatnonzero((mass_list >= 122.9) & (mass_list <= 125.2))
+	intensity_array[:, columns] += profile[:, numpy.newaxis]
+
+	return IntensityMatrix(time_list.tolist(), mass_list.tolist(), intensity_array)
+
+
+@pytest.fixture(scope="module")
+def im() -> IntensityMatrix:
+	return make_intensity_matrix()
+
+
+@pytest.mark.parametrize("rt_windows", [None, [(100.0, 150.0), (100.0, 150.0)]])
+def test_make_ims_for_analytes_outside_mass_range(im: IntensityMatrix, rt_windows):
+	e_ims = make_ims_for_analytes(im, [NICOTINAMIDE, DIPHENYLAMINE], ADDUCTS, rt_windows=rt_windows)
+
+	assert e_ims[0] is not None
+	assert e_ims[1] is None
+
+
+def test_make_ims_for_analytes_all_outside_mass_range(im: IntensityMatrix):
+	assert make_ims_for_analytes(im, [DIPHENYLAMINE], ADDUCTS) == [None]
+
+
+def test_find_peaks_for_analytes_outside_mass_range(im: IntensityMatrix):
+	peaks = find_peaks_for_analytes(im, [NICOTINAMIDE, DIPHENYLAMINE], ADDUCTS, noise="rolling_mad")
+
+	assert 250 in [peak.bounds[1] for peak in peaks[0]]
+	assert peaks[1] == []
+
+
+def test_extract_outside_mass_range(im: IntensityMatrix):
+	with pytest.raises(ValueError, match="None of the masses are within the mass range"):
+		MassIndex(im).extract([170.1, 192.1])
+
+
+@pytest.mark.parametrize("noise", ["window", "rolling_mad"])
+def test_peak_finder_short_rt_window(im: IntensityMatrix, noise: str):
+	# The window is much shorter than the 256 scans used by pyms' window_analyzer.
+	e_im = make_ims_for_analytes(im, [NICOTINAMIDE], ADDUCTS)[0]
+	assert e_im is not None
+
+	peaks = list(peak_finder(e_im, noise=noise, rt_window=(115.0, 135.0)))
+
+	assert 250 in [peak.bounds[1] for peak in peaks]
+	for peak in peaks:
+		assert 230 <= peak.bounds[1] - peak.bounds[0] <= peak.bounds[1] + peak.bounds[2] <= 270
+
+
+def test_find_peaks_for_analytes_short_rt_window(im: IntensityMatrix):
+	peaks = find_peaks_for_analytes(im, [NICOTINAMIDE, DIPHENYLAMINE], ADDUCTS, rt_windows=[(115.0, 135.0), None])
+
+	# Scan indices are relative to the start of the window, at 115 seconds.
+	assert 20 in [peak.bounds[1] for peak in peaks[0]]
+	assert 125.0 in [peak.rt for peak in peaks[0]]
+	assert peaks[1] == []
+
+
+@pytest.mark.parametrize("noise", ["window", "rolling_mad"])
+def test_peak_finder_extracted_rt_window(im: IntensityMatrix, noise: str):
+	# The extracted intensity matrix only contains the window,
+	# so the noise level isn't estimated from scans outside it.
+	e_im = make_im_for_adducts(im, NICOTINAMIDE, ADDUCTS, rt_window=(115.0, 135.0))
+	assert e_im is not None
+	assert e_im.time_list == im.time_list[230:271]
+
+	full_e_im = make_im_for_adducts(im, NICOTINAMIDE, ADDUCTS)
+	assert full_e_im is not None
+	expected = list(peak_finder(full_e_im, noise="rolling_mad", rt_window=(115.0, 135.0)))
+
+	peaks = list(peak_finder(e_im, noise=noise))
+	assert 125.0 in [peak.rt for peak in peaks]
+	assert len(peaks) <= 3
+
+	if noise == "rolling_mad":
+		assert [peak.rt for peak in peaks] == [peak.rt for peak in expected]
+		assert [peak.area for peak in peaks] == [peak.area for peak in expected]
+		assert [peak.bounds[1] + 230 for peak in peaks] == [peak.bounds[1] for peak in expected]
+
+
+def test_make_im_for_adducts_no_scans(im: IntensityMatrix):
+	assert make_im_for_adducts(im, NICOTINAMIDE, ADDUCTS, rt_window=(1000.0, 2000.0)) is None
+	assert make_ims_for_analytes(im, [NICOTINAMIDE], ADDUCTS, rt_windows=[(1000.0, 2000.0)]) == [None]
+	assert find_peaks_for_analytes(im, [NICOTINAMIDE], ADDUCTS, rt_windows=[(1000.0, 2000.0)]) == [[]]
+
+
+def make_sparse_intensity_matrix() -> IntensityMatrix:
+	# No baseline noise, so there is only signal around the peak at scan 250 (125 seconds).
+	im = make_intensity_matrix()
+	intensity_array = numpy.where(im.intensity_array > 1000, im.intensity_array, 0)
+	return IntensityMatrix(im.time_list, im.mass_list, intensity_array)
+
+
+@pytest.mark.parametrize(
+		"rt_window, passed",
+		[
+				(None, [True, False]),
+				((115.0, 135.0), [True, False]),
+				((10.0, 50.0), [False, False]),
+				({"[M + H]⁺": (115.0, 135.0)}, [True, False]),
+				({"[M + H]⁺": (10.0, 50.0)}, [False, False]),
+				({"[M + Na]⁺": (10.0, 50.0)}, [True, False]),
+				]
+		)
+def test_prescreen_rt_window(rt_window, passed):
+	im = make_sparse_intensity_matrix()
+	mass_index = MassIndex(im)
+	adduct_set = AdductSet(ADDUCTS)
+
+	result = adduct_set.prescreen([NICOTINAMIDE, NICOTINAMIDE], mass_index, rt_windows=[rt_window, None])
+	assert result.tolist() == [passed, [True, False]]
+
+	e_ims = make_ims_for_analytes(im, [NICOTINAMIDE], ADDUCTS, prescreen=True, rt_windows=[rt_window])
+	e_im = make_im_for_adducts(im, NICOTINAMIDE, ADDUCTS, prescreen=True, rt_window=rt_window)
+
+	if any(passed):
+		assert e_ims[0] is not None and e_im is not None
+		assert e_im.mass_list == e_ims[0].mass_list
+		numpy.testing.assert_array_equal(e_im.intensity_array, e_ims[0].intensity_array)
+	else:
+		assert e_ims == [None]
+		assert e_im is None
+
+
+def test_prescreen_rt_windows_length():
+	mass_index = MassIndex(make_sparse_intensity_matrix())
+
+	with pytest.raises(ValueError, match="Expected 2 retention time windows, got 1"):
+		AdductSet(ADDUCTS).prescreen([NICOTINAMIDE, NICOTINAMIDE], mass_index, rt_windows=[None])
+
+
+@pytest.mark.parametrize("prescreen", [True, False])
+@pytest.mark.parametrize("analyte", [NICOTINAMIDE, DIPHENYLAMINE])
+def test_make_im_for_adducts_matches_batch(im: IntensityMatrix, analyte: Formula, prescreen: bool):
+	e_im = make_im_for_adducts(im, analyte, ADDUCTS, prescreen=prescreen)
+	expected = make_ims_for_analytes(im, [analyte], ADDUCTS, prescreen=prescreen)[0]
+
+	if expected is None:
+		assert e_im is None
+	else:
+		assert e_im is not None
+		assert e_im.mass_list == expected.mass_list
+		numpy.testing.assert_array_equal(e_im.intensity_array, expected.intensity_array)
@@ -0,0 +1,99 @@
+# stdlib
+import pickle
+
+# 3rd party
+import numpy
+import pytest
+from pyms.IntensityMatrix import IntensityMatrix
+from pyms.Peak import Peak
+
+# this package
+from pyms_lc_esi.adducts import plus_h, plus_sodium
+from pyms_lc_esi.peak_finder import make_im_for_adducts, peak_finder
+from pyms_lc_esi.peak_record import (
+		PEAK_RECORD_DTYPE,
+		PeakRecord,
+		peak_records_from_array,
+		peak_records_to_array
+		)
+from test_peak_finder import NICOTINAMIDE, make_intensity_matrix
+
+
+@pytest.fixture(scope="module")
+def im() -> IntensityMatrix:
+	return make_intensity_matrix()
+
+
+@pytest.fixture(scope="module")
+def e_im(im: IntensityMatrix):
+	return make_im_for_adducts(im, NICOTINAMIDE, [plus_h, plus_sodium])
+
+
+@pytest.fixture(scope="module")
+def peaks(e_im):
+	peaks = list(peak_finder(e_im))
+	assert peaks
+	return peaks
+
+
+def test_from_peak(peaks):
+	for peak in peaks:
+		record = PeakRecord.from_peak(peak)
+
+		assert record.bounds == tuple(peak.bounds)
+		assert record.rt == peak.rt
+		assert record.area == peak.area
+		assert record.left_bound == peak.bounds[1] - peak.bounds[0]
+		assert record.right_bound == peak.bounds[1] + peak.bounds[2]
+
+
+def test_to_peak(e_im, peaks):
+	for peak in peaks:
+		round_tripped = PeakRecord.from_peak(peak).to_peak(e_im)
+
+		assert round_tripped.rt == peak.rt
+		assert round_tripped.area == peak.area
+		assert tuple(round_tripped.bounds) == tuple(peak.bounds)
+		assert round_tripped.mass_spectrum.mass_list == peak.mass_spectrum.mass_list
+		assert round_tripped.mass_spectrum.intensity_list == peak.mass_spectrum.intensity_list
+
+
+def test_from_peak_no_bounds(e_im):
+	peak = Peak(12.5, e_im.get_ms_at_index(25))
+
+	with pytest.raises(ValueError, match="The peak has no bounds set!"):
+		PeakRecord.from_peak(peak)
+
+
+def test_defaults():
+	record = PeakRecord(25, 12.5)
+
+	assert record.area is None
+	assert record.bounds == (0, 25, 0)
+	assert record == PeakRecord(25, 12.5, None, 25, 25)
+	assert record != PeakRecord(25, 12.5, 1.0)
+	assert repr(record) == "PeakRecord(apex_index=25, rt=12.5, area=None, left_bound=25, right_bound=25)"
+
+
+@pytest.mark.parametrize("area", [None, 1234.5])
+def test_pickle(area):
+	record = PeakRecord(25, 12.5, area, 20, 31)
+	assert pickle.loads(pickle.dumps(record)) == record
+
+
+def test_array_round_trip(peaks):
+	records = [PeakRecord.from_peak(peak) for peak in peaks] + [PeakRecord(25, 12.5)]
+	array = peak_records_to_array(records)
+
+	assert array.dtype == PEAK_RECORD_DTYPE
+	assert array["apex_index"].tolist() == [record.apex_index for record in records]
+	assert numpy.isnan(array["area"][-1])
+	assert peak_records_from_array(array) == records
+
+
+def test_array_round_trip_empty():
+	array = peak_records_to_array([])
+
+	assert array.dtype == PEAK_RECORD_DTYPE
+	assert array.shape == (0, )
+	assert peak_records_from_array(array) == []
@@ -0,0 +1,181 @@
+# stdlib
+import threading
+import time
+
+# 3rd party
+import pytest
+from pyms.IntensityMatrix import IntensityMatrix
+
+# this package
+from pyms_lc_esi.adducts import get_adduct_spectra
+from pyms_lc_esi.instrumentation import StageTimings, instrument
+from pyms_lc_esi.peak_finder import find_peaks_for_analytes
+from pyms_lc_esi.peak_record import PeakRecord
+from pyms_lc_esi.pipeline import Pipeline
+from pyms_lc_esi.spectra import score_peaks_for_adducts
+from test_peak_finder import ADDUCTS, DIPHENYLAMINE, NICOTINAMIDE, make_intensity_matrix
+
+ANALYTES = [NICOTINAMIDE, DIPHENYLAMINE]
+
+CORRUPT = 3
+
+
+class Interrupt(BaseException):
+	pass
+
+
+@pytest.fixture(scope="module")
+def im() -> IntensityMatrix:
+	return make_intensity_matrix()
+
+
+def make_loader(im: IntensityMatrix):
+
+	def loader(sample: int) -> IntensityMatrix:
+		# Later samples load faster, so a pipeline which didn't preserve order would reorder them.
+		time.sleep(0.01 * (5 - sample % 5))
+		if sample == CORRUPT:
+			raise OSError(f"Sample {sample} is corrupt")
+		return im
+
+	return loader
+
+
+def records(peaks):
+	return [PeakRecord.from_peak(peak) for peak in peaks]
+
+
+def test_results(im: IntensityMatrix):
+	results = list(Pipeline(make_loader(im), ANALYTES, ADDUCTS).run(range(8)))
+
+	expected_peaks = find_peaks_for_analytes(im, ANALYTES, ADDUCTS)
+	expected_scores = [
+			score_peaks_for_adducts(peaks, get_adduct_spectra(analyte, ADDUCTS))
+			for analyte, peaks in zip(ANALYTES, expected_peaks)
+			]
+
+	assert [result.sample for result in results] == list(range(8))
+
+	for result in results:
+		assert result.analytes == ANALYTES
+
+		if result.sample == CORRUPT:
+			assert not result.success
+			assert result.peaks is None and result.scores is None
+			assert "OSError: Sample 3 is corrupt" in result.error
+			continue
+
+		assert result.success
+		assert [records(peaks) for peaks in result.peaks] == [records(peaks) for peaks in expected_peaks]
+
+		for scores, expected in zip(result.scores, expected_scores):
+			assert list(scores) == list(expected)
+			for adduct in expected:
+				assert scores[adduct].tolist() == expected[adduct].tolist()
+
+
+def test_no_scoring(im: IntensityMatrix):
+	pipeline = Pipeline(make_loader(im), ANALYTES, ADDUCTS, score=False)
+	results = list(pipeline.run([0, 1]))
+
+	assert list(pipeline.metrics) == ["load", "extract", "find"]
+	assert [result.scores for result in results] == [None, None]
+	assert all(result.peaks is not None for result in results)
+
+
+def test_metrics(im: IntensityMatrix):
+	pipeline = Pipeline(make_loader(im), ANALYTES, ADDUCTS, max_queued=1)
+	assert list(pipeline.metrics) == ["load", "extract", "find", "score"]
+
+	for _ in range(2):
+		# Metrics are reset each run.
+		list(pipeline.run(range(8)))
+
+		for name, metrics in pipeline.metrics.items():
+			assert metrics.name == name
+			assert metrics.processed == 8
+			assert metrics.failed == (1 if name == "load" else 0)
+			assert metrics.busy_time > 0
+			assert metrics.throughput == pytest.approx(8 / metrics.busy_time)
+			assert 0 <= metrics.max_queue_depth <= 1
+			assert metrics.queue_depth == 0
+
+	pipeline.metrics["load"].reset()
+	assert pipeline.metrics["load"].processed == 0
+	assert pipeline.metrics["load"].throughput == 0
+
+
+def test_stage_timings(im: IntensityMatrix):
+	single = StageTimings()
+	with instrument(single):
+		list(Pipeline(make_loader(im), ANALYTES, ADDUCTS).run([0]))
+
+	timings = StageTimings()
+	with instrument(timings):
+		list(Pipeline(make_loader(im), ANALYTES, ADDUCTS).run(range(8)))
+
+	# Every sample but the corrupt one reaches the extract, find and score stages.
+	assert set(timings.calls) == set(single.calls) >= {"eic_extraction", "maxima_detection", "spectra_generation"}
+	for name in single.calls:
+		assert timings.calls[name] == 7 * single.calls[name]
+		assert timings.counts[name] == {key: 7 * value for key, value in single.counts[name].items()}
+
+
+def test_stage_timings_threads():
+	timings = StageTimings()
+
+	def record():
+		for _ in range(10_000):
+			timings("stage", 1.0, {"count": 1})
+
+	threads = [threading.Thread(target=record) for _ in range(8)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	assert timings.calls["stage"] == 80_000
+	assert timings.totals["stage"] == 80_000
+	assert timings.counts["stage"]["count"] == 80_000
+
+
+def test_samples_error(im: IntensityMatrix):
+
+	def samples():
+		yield 0
+		yield 1
+		raise RuntimeError("No more samples")
+
+	results = Pipeline(make_loader(im), ANALYTES, ADDUCTS).run(samples())
+
+	assert next(results).sample == 0
+	assert next(results).sample == 1
+	with pytest.raises(RuntimeError, match="No more samples"):
+		next(results)
+
+
+@pytest.mark.parametrize("stage", ["load", "find", "score"])
+def test_stage_base_exception(im: IntensityMatrix, stage: str):
+	# An exception which isn't captured per sample stops the pipeline rather than hanging it.
+	pipeline = Pipeline(make_loader(im), ANALYTES, ADDUCTS)
+	func = pipeline._stages[stage]
+
+	def interrupted(job):
+		if job.sample == 2:
+			raise Interrupt
+		func(job)
+
+	pipeline._stages[stage] = interrupted
+
+	results = pipeline.run(range(8))
+	assert [next(results).sample, next(results).sample] == [0, 1]
+
+	with pytest.raises(Interrupt):
+		next(results)
+
+	assert not [thread for thread in threading.enumerate() if thread.name.startswith("pipeline-")]
+
+
+def test_max_queued():
+	with pytest.raises(ValueError, match="'max_queued' must be at least 1"):
+		Pipeline(lambda sample: sample, ANALYTES, ADDUCTS, max_queued=0)
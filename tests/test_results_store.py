@@ -0,0 +1,218 @@
+# stdlib
+import functools
+
+# 3rd party
+import numpy
+import pytest
+from pyms.IntensityMatrix import IntensityMatrix
+
+# this package
+from pyms_lc_esi.adducts import AdductSet, plus_h, plus_sodium
+from pyms_lc_esi.noise import rolling_mad_noise
+from pyms_lc_esi.peak_finder import find_peaks_for_analytes
+from pyms_lc_esi.peak_record import PeakRecord
+from pyms_lc_esi.results_store import (
+		ResultsStore,
+		ScreeningParameters,
+		fingerprint_file,
+		fingerprint_intensity_matrix,
+		rescreen
+		)
+from test_peak_finder import ADDUCTS, DIPHENYLAMINE, NICOTINAMIDE, make_intensity_matrix
+
+ANALYTES = [NICOTINAMIDE, DIPHENYLAMINE]
+
+
+@pytest.fixture(scope="module")
+def im() -> IntensityMatrix:
+	return make_intensity_matrix()
+
+
+def records(peaks):
+	return [PeakRecord.from_peak(peak) for peak in peaks]
+
+
+def test_fingerprint_intensity_matrix(im: IntensityMatrix):
+	fingerprint = fingerprint_intensity_matrix(im)
+
+	assert fingerprint == fingerprint_intensity_matrix(make_intensity_matrix())
+	assert fingerprint != fingerprint_intensity_matrix(make_intensity_matrix(n_scans=499))
+
+	intensity_array = im.intensity_array.copy()
+	intensity_array[100, 10] += 1
+	assert fingerprint != fingerprint_intensity_matrix(IntensityMatrix(im.time_list, im.mass_list, intensity_array))
+
+
+def test_fingerprint_file(tmp_path):
+	(tmp_path / "a.raw").write_bytes(b"abc" * 1000)
+	(tmp_path / "b.raw").write_bytes(b"abc" * 1000)
+	(tmp_path / "c.raw").write_bytes(b"abd" * 1000)
+
+	assert fingerprint_file(tmp_path / "a.raw") == fingerprint_file(tmp_path / "b.raw")
+	assert fingerprint_file(tmp_path / "a.raw") == fingerprint_file(tmp_path / "a.raw", chunk_size=7)
+	assert fingerprint_file(tmp_path / "a.raw") != fingerprint_file(tmp_path / "c.raw")
+
+
+def test_store(tmp_path):
+	store = ResultsStore(tmp_path)
+	adducts = AdductSet(ADDUCTS)
+	parameters = ScreeningParameters()
+	peaks = [PeakRecord(250, 125.0, 1e6, 240, 260), PeakRecord(25, 12.5)]
+
+	assert store.get("sample", NICOTINAMIDE, adducts, parameters) is None
+	store.put("sample", NICOTINAMIDE, adducts, parameters, peaks)
+	assert store.get("sample", NICOTINAMIDE, adducts, parameters) == peaks
+
+	# Results are keyed by sample, analyte, adducts and parameters.
+	assert store.get("other", NICOTINAMIDE, adducts, parameters) is None
+	assert store.get("sample", DIPHENYLAMINE, adducts, parameters) is None
+	assert store.get("sample", NICOTINAMIDE, AdductSet([plus_h]), parameters) is None
+	assert store.get("sample", NICOTINAMIDE, adducts, ScreeningParameters(points=5)) is None
+
+	assert (store.hits, store.misses) == (1, 5)
+
+	store.put("sample", NICOTINAMIDE, adducts, parameters, [])
+	assert store.get("sample", NICOTINAMIDE, adducts, parameters) == []
+
+
+def test_store_corrupt(tmp_path):
+	store = ResultsStore(tmp_path)
+	adducts = AdductSet(ADDUCTS)
+	parameters = ScreeningParameters()
+
+	store.put("sample", NICOTINAMIDE, adducts, parameters, [PeakRecord(25, 12.5)])
+	for filename in (tmp_path / "sample").iterdir():
+		filename.write_bytes(filename.read_bytes()[:20])
+
+	assert store.get("sample", NICOTINAMIDE, adducts, parameters) is None
+	assert store.misses == 1
+
+
+def test_store_clear(tmp_path):
+	store = ResultsStore(tmp_path / "store")
+	store.clear()
+
+	adducts = AdductSet(ADDUCTS)
+	parameters = ScreeningParameters()
+	for sample in ("a", "b", "c"):
+		store.put(sample, NICOTINAMIDE, adducts, parameters, [])
+
+	store.clear("a")
+	assert store.get("a", NICOTINAMIDE, adducts, parameters) is None
+	assert store.get("b", NICOTINAMIDE, adducts, parameters) == []
+
+	store.clear()
+	assert list((tmp_path / "store").iterdir()) == []
+
+
+@pytest.mark.parametrize(
+		"changes",
+		[
+				{"points": 5},
+				{"left_bound": 0.2},
+				{"right_bound": 0.2},
+				{"min_abundance": 0.01},
+				{"noise": "rolling_mad"},
+				{"noise": rolling_mad_noise},
+				{"scans": 3},
+				{"prescreen": True},
+				{"max_width": 100},
+				{"rt_window": (100.0, 150.0)},
+				{"rt_window": {"[M + H]⁺": (100.0, 150.0)}},
+				]
+		)
+def test_parameters_key(changes):
+	assert ScreeningParameters().key() != ScreeningParameters(**changes).key()
+	assert ScreeningParameters(**changes).key() == ScreeningParameters(**changes).key()
+
+
+def test_parameters_key_rt_window():
+	by_adduct = {"[M + H]⁺": (100.0, 150.0), "[M + Na]⁺": (100, 160)}
+	reordered = {"[M + Na]⁺": (100.0, 160.0), "[M + H]⁺": (100, 150)}
+
+	assert ScreeningParameters(rt_window=by_adduct).key() == ScreeningParameters(rt_window=reordered).key()
+	assert ScreeningParameters(rt_window=(100, 150)).key() == ScreeningParameters(rt_window=(100.0, 150.0)).key()
+	assert ScreeningParameters(rt_window=(100, 150)).key() != ScreeningParameters(rt_window=(100, 151)).key()
+
+
+def _closure_noise():
+
+	def noise(eic):
+		return 1.0
+
+	return noise
+
+
+@pytest.mark.parametrize(
+		"noise",
+		[
+				pytest.param(lambda eic: 1.0, id="lambda"),
+				pytest.param(_closure_noise(), id="closure"),
+				pytest.param(functools.partial(rolling_mad_noise, window=64), id="partial"),
+				]
+		)
+def test_parameters_noise_not_importable(noise):
+	with pytest.raises(ValueError, match="Noise functions must be importable by name"):
+		ScreeningParameters(noise=noise)
+
+
+def test_parameters_as_kwargs():
+	kwargs = ScreeningParameters(points=5).as_kwargs(2)
+	assert kwargs["points"] == 5
+	assert kwargs["rt_windows"] is None
+	assert "rt_window" not in kwargs
+
+	kwargs = ScreeningParameters(rt_window=(100.0, 150.0)).as_kwargs(2)
+	assert kwargs["rt_windows"] == [(100.0, 150.0), (100.0, 150.0)]
+
+
+# window_analyzer is random, so the deterministic noise estimate is used to compare results.
+@pytest.mark.parametrize(
+		"parameters",
+		[
+				ScreeningParameters(noise="rolling_mad"),
+				ScreeningParameters(noise="rolling_mad", scans=3),
+				ScreeningParameters(noise="rolling_mad", rt_window=(115.0, 135.0)),
+				]
+		)
+def test_rescreen(tmp_path, im: IntensityMatrix, parameters: ScreeningParameters):
+	store = ResultsStore(tmp_path)
+	fingerprint = fingerprint_intensity_matrix(im)
+	loads = []
+
+	def loader():
+		loads.append(1)
+		return im
+
+	expected_peaks = find_peaks_for_analytes(im, ANALYTES, ADDUCTS, **parameters.as_kwargs(len(ANALYTES)))
+	expected = [records(peaks) for peaks in expected_peaks]
+
+	assert rescreen(store, fingerprint, loader, ANALYTES, ADDUCTS, parameters) == expected
+	assert len(loads) == 1
+	assert (store.hits, store.misses) == (0, 2)
+
+	# Every result is now stored, so the sample isn't loaded again.
+	assert rescreen(store, fingerprint, loader, ANALYTES, ADDUCTS, parameters) == expected
+	assert len(loads) == 1
+	assert (store.hits, store.misses) == (2, 2)
+
+
+def test_rescreen_new_analyte(tmp_path, im: IntensityMatrix):
+	store = ResultsStore(tmp_path)
+	fingerprint = fingerprint_intensity_matrix(im)
+	parameters = ScreeningParameters(noise="rolling_mad")
+
+	rescreen(store, fingerprint, im, [NICOTINAMIDE], ADDUCTS, parameters)
+	results = rescreen(store, fingerprint, im, ANALYTES, [plus_h, plus_sodium], parameters)
+
+	assert (store.hits, store.misses) == (1, 2)
+	expected = find_peaks_for_analytes(im, ANALYTES, ADDUCTS, noise="rolling_mad")
+	assert results == [records(peaks) for peaks in expected]
+
+
+def test_store_arrays(tmp_path):
+	store = ResultsStore(tmp_path)
+	store.put("sample", NICOTINAMIDE, AdductSet(ADDUCTS), ScreeningParameters(), [PeakRecord(25, 12.5, 10.0)])
+
+	(filename, ) = (tmp_path / "sample").iterdir()
+	assert numpy.load(filename)["area"].tolist() == [10.0]
@@ -0,0 +1,259 @@
+# stdlib
+import math
+
+# 3rd party
+import numpy
+import pytest
+from chemistry_tools.formulae import Formula
+from pyms.IntensityMatrix import IntensityMatrix
+from pyms.Peak import Peak
+from pyms.Spectrum import CompositeMassSpectrum, MassSpectrum
+
+# this package
+from pyms_lc_esi.adducts import get_adduct_spectra, plus_h, plus_sodium
+from pyms_lc_esi.peak_finder import make_im_for_adducts, peak_finder
+from pyms_lc_esi.peak_record import PeakRecord
+from pyms_lc_esi.spectra import (
+		AbundanceCutoff,
+		composite_spectra,
+		composite_spectrum_from_peak,
+		find_best_peak,
+		iso_dist_2_mass_spec,
+		isotope_pattern_scores,
+		score_peaks,
+		score_peaks_for_adducts
+		)
+from test_peak_finder import make_intensity_matrix
+
+FORMULAE = [
+		Formula.from_string(f) for f in ("C6H6N2O", "C7H7NO2", "C12H11N", "C8H10N4O2", "C5H11NO2S", "C3H7Cl")
+		]
+
+
+@pytest.fixture(scope="module")
+def im() -> IntensityMatrix:
+	return make_intensity_matrix()
+
+
+def baseline_iso_dist_2_mass_spec(iso_dist, min_abundance=0):
+	# The original implementation, via IsotopeDistribution.as_dataframe()
+	iso_df = iso_dist.as_dataframe(format_percentage=False)
+	iso_df = iso_df.astype({"Mass": float, "Abundance": float, "Relative Abundance": float})
+	iso_df = iso_df[iso_df["Abundance"] > min_abundance]
+	iso_df.sort_values(by=["Mass"], axis=0, ascending=True, inplace=True)
+	iso_df.reset_index(inplace=True, drop=True)
+
+	return list(iso_df["Mass"]), list(iso_df["Relative Abundance"])
+
+
+@pytest.mark.parametrize("formula", FORMULAE, ids=str)
+@pytest.mark.parametrize("adduct", [None, plus_h, plus_sodium])
+@pytest.mark.parametrize("min_abundance", [0, 0.0001, 0.001, 0.01, 0.5])
+def test_iso_dist_2_mass_spec(formula, adduct, min_abundance):
+	pytest.importorskip("pandas")
+
+	if adduct is not None:
+		formula = adduct(formula)
+
+	iso_dist = formula.isotope_distribution()
+	spectrum = iso_dist_2_mass_spec(iso_dist, min_abundance)
+
+	assert (spectrum.mass_list, spectrum.intensity_list) == baseline_iso_dist_2_mass_spec(iso_dist, min_abundance)
+	assert all(isinstance(mass, float) for mass in spectrum.mass_list)
+
+
+def brute_force(iso_dist, keep):
+	# Select isotopologues with ``keep(abundance, relative_abundance, rank)``, sorted by mass.
+	compositions = sorted(
+			iso_dist.values(),
+			key=lambda comp: comp.isotopic_composition_abundance,
+			reverse=True,
+			)
+	max_abundance = iso_dist.max_abundance
+
+	selected = []
+	for rank, comp in enumerate(compositions):
+		abundance = round(comp.isotopic_composition_abundance, 6)
+		relative_abundance = round(comp.isotopic_composition_abundance / max_abundance, 6)
+		if keep(abundance, relative_abundance, rank):
+			selected.append((float(f"{comp.mass:0.4f}"), relative_abundance))
+
+	selected.sort(key=lambda x: x[0])
+	return [mass for mass, _ in selected], [abundance for _, abundance in selected]
+
+
+@pytest.mark.parametrize("formula", FORMULAE, ids=str)
+@pytest.mark.parametrize("value", [0, 0.001, 0.01, 0.1, 0.5])
+def test_cutoff_absolute(formula, value):
+	pytest.importorskip("pandas")
+
+	iso_dist = formula.isotope_distribution()
+	spectrum = iso_dist_2_mass_spec(iso_dist, AbundanceCutoff(value, "absolute"))
+
+	assert (spectrum.mass_list, spectrum.intensity_list) == baseline_iso_dist_2_mass_spec(iso_dist, value)
+
+
+@pytest.mark.parametrize("formula", FORMULAE, ids=str)
+@pytest.mark.parametrize("value", [0, 0.001, 0.01, 0.1, 0.5, 1])
+def test_cutoff_relative(formula, value):
+	iso_dist = formula.isotope_distribution()
+	spectrum = iso_dist_2_mass_spec(iso_dist, AbundanceCutoff(value, "relative"))
+	expected = brute_force(iso_dist, lambda abundance, relative, rank: relative > value)
+
+	assert (spectrum.mass_list, spectrum.intensity_list) == expected
+	assert max(spectrum.intensity_list, default=1) == 1
+
+
+@pytest.mark.parametrize("formula", FORMULAE, ids=str)
+@pytest.mark.parametrize("value", [0, 1, 2, 3, 10, 1000])
+def test_cutoff_top_n(formula, value):
+	iso_dist = formula.isotope_distribution()
+	spectrum = iso_dist_2_mass_spec(iso_dist, AbundanceCutoff(value, "top_n"))
+	expected = brute_force(iso_dist, lambda abundance, relative, rank: rank < value and abundance > 0)
+
+	assert (spectrum.mass_list, spectrum.intensity_list) == expected
+	assert len(spectrum) <= value
+
+
+def test_cutoff_invalid_mode():
+	with pytest.raises(ValueError, match="'mode' must be in"):
+		AbundanceCutoff(0.1, "percentage")  # type: ignore[arg-type]
+
+
+def brute_force_score(reference, masses, intensities, mass_tol=0.05):
+	# Cosine similarity between the reference and the most intense matching mass in the spectrum.
+	matched = []
+	for ref_mass in reference.mass_list:
+		candidates = [
+				intensity for mass, intensity in zip(masses, intensities)
+				if (ref_mass - mass_tol) <= mass <= (ref_mass + mass_tol)
+				]
+		matched.append(max(candidates, default=0.0))
+
+	dot = sum(a * b for a, b in zip(matched, reference.intensity_list))
+	norm = math.sqrt(sum(a * a for a in matched)) * math.sqrt(sum(b * b for b in reference.intensity_list))
+	return dot / norm if norm else 0.0
+
+
+@pytest.mark.parametrize("mass_tol", [0.01, 0.05, 0.1, 0.5])
+@pytest.mark.parametrize("seed", range(5))
+def test_isotope_pattern_scores(mass_tol, seed):
+	rng = numpy.random.default_rng(seed)
+	reference = iso_dist_2_mass_spec(plus_h(FORMULAE[0]).isotope_distribution(), 0.0001)
+
+	masses = numpy.round(numpy.arange(120, 130, 0.02), 2)
+	intensities = rng.exponential(50, size=(20, len(masses)))
+	intensities[rng.random(intensities.shape) < 0.5] = 0
+	intensities[0] = 0  # no signal
+
+	scores = isotope_pattern_scores(reference, masses.tolist(), intensities, mass_tol=mass_tol)
+	expected = [brute_force_score(reference, masses.tolist(), row.tolist(), mass_tol) for row in intensities]
+
+	assert scores.tolist() == pytest.approx(expected)
+	assert scores[0] == 0
+
+
+def test_isotope_pattern_scores_perfect_match():
+	reference = MassSpectrum([123.05, 124.05, 125.05], [1.0, 0.1, 0.01])
+	masses = [122.0, 123.04, 123.06, 124.05, 124.9, 125.06]
+	intensities = numpy.array([[50, 1000, 0, 100, 50, 10], [0, 0, 1000, 100, 0, 10]], dtype=numpy.float64)
+
+	scores = isotope_pattern_scores(reference, masses, intensities, mass_tol=0.05)
+	assert scores.tolist() == pytest.approx([1, 1])
+
+
+def test_isotope_pattern_scores_no_matches():
+	reference = MassSpectrum([200.0, 201.0], [1.0, 0.1])
+	scores = isotope_pattern_scores(reference, [100.0, 101.0], numpy.ones((3, 2)))
+
+	assert scores.tolist() == [0, 0, 0]
+
+
+def test_score_peaks(im):
+	e_im = make_im_for_adducts(im, FORMULAE[0], [plus_h, plus_sodium])
+	peaks = list(peak_finder(e_im))
+	spectra = get_adduct_spectra(FORMULAE[0], [plus_h, plus_sodium])
+
+	expected = {
+			adduct: [
+					brute_force_score(reference, peak.mass_spectrum.mass_list, peak.mass_spectrum.intensity_list)
+					for peak in peaks
+					]
+			for adduct, reference in spectra.items()
+			}
+
+	reference = spectra[plus_h % 'M']
+	assert score_peaks(peaks, reference).tolist() == pytest.approx(expected[plus_h % 'M'])
+
+	scores = score_peaks_for_adducts(peaks, spectra)
+	assert list(scores) == list(spectra)
+	for adduct in spectra:
+		assert scores[adduct].tolist() == pytest.approx(expected[adduct])
+
+	ranked = find_best_peak(peaks, reference)
+	assert [score for _, score in ranked] == pytest.approx(sorted(expected[plus_h % 'M'], reverse=True))
+	assert sorted(ranked, key=lambda x: peaks.index(x[0])) == list(zip(peaks, score_peaks(peaks, reference).tolist()))
+
+
+def test_score_no_peaks():
+	reference = MassSpectrum([200.0, 201.0], [1.0, 0.1])
+
+	assert score_peaks([], reference).tolist() == []
+	assert score_peaks_for_adducts([], {"[M+H]+": reference})["[M+H]+"].tolist() == []
+	assert find_best_peak([], reference) == []
+
+
+def baseline_composite_spectrum(peak, im):
+	# The original approach, combining a MassSpectrum for each scan.
+	left_bound, apex, right_bound = peak.bounds
+	spectra = [im.get_ms_at_index(idx) for idx in range(apex - left_bound, apex + right_bound + 1)]
+	return CompositeMassSpectrum.from_spectra(spectra)
+
+
+def check_composite_spectra(spectra, expected):
+	assert len(spectra) == len(expected)
+
+	for spectrum, expected_spectrum in zip(spectra, expected):
+		assert isinstance(spectrum, CompositeMassSpectrum)
+		assert spectrum.mass_list == expected_spectrum.mass_list
+		assert spectrum.intensity_list == expected_spectrum.intensity_list
+		assert spectrum.size == expected_spectrum.size
+
+
+@pytest.mark.parametrize("full_matrix", [True, False])
+@pytest.mark.parametrize("compact", [True, False])
+def test_composite_spectra(im, full_matrix, compact):
+	e_im = make_im_for_adducts(im, FORMULAE[0], [plus_h, plus_sodium])
+	peaks = list(peak_finder(e_im))
+	assert peaks
+
+	source = im if full_matrix else e_im
+	expected = [baseline_composite_spectrum(peak, source) for peak in peaks]
+
+	if compact:
+		peaks = [PeakRecord.from_peak(peak) for peak in peaks]
+
+	check_composite_spectra(composite_spectra(peaks, source), expected)
+	check_composite_spectra([composite_spectrum_from_peak(peak, source) for peak in peaks], expected)
+
+
+@pytest.mark.parametrize("bounds", [(0, 0, 0), (0, 0, 5), (3, 10, 0), (5, 499, 0), (499, 499, 0), (0, 250, 0)])
+def test_composite_spectra_edges(im, bounds):
+	apex = bounds[1]
+	peak = PeakRecord(apex, im.time_list[apex], left_bound=apex - bounds[0], right_bound=apex + bounds[2])
+	check_composite_spectra(composite_spectra([peak], im), [baseline_composite_spectrum(peak, im)])
+
+
+@pytest.mark.parametrize("bounds", [(1, 0, 0), (0, 499, 1), (0, 600, 0)])
+def test_composite_spectra_outside_matrix(im, bounds):
+	peak = PeakRecord(bounds[1], 0, left_bound=bounds[1] - bounds[0], right_bound=bounds[1] + bounds[2])
+
+	with pytest.raises(ValueError, match=r"The bounds of the peak .* are outside the intensity matrix."):
+		composite_spectra([peak], im)
+
+
+def test_composite_spectra_no_bounds(im):
+	peak = Peak(12.5, im.get_ms_at_index(25))
+
+	with pytest.raises(ValueError, match="The peak has no bounds set!"):
+		composite_spectra([peak], im)
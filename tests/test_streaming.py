@@ -0,0 +1,56 @@
+# 3rd party
+import numpy
+import pytest
+from pyms.eic import build_extracted_intensity_matrix
+from pyms.IntensityMatrix import IntensityMatrix
+from pyms.Spectrum import Scan
+
+# this package
+from pyms_lc_esi.peak_finder import peak_finder
+from pyms_lc_esi.streaming import StreamingPeakFinder
+
+MASSES = [150.0, 155.0]
+
+
+def make_intensity_matrix(n_scans: int = 600) -> IntensityMatrix:
+	rng = numpy.random.default_rng(2)
+
+	mass_list = numpy.round(numpy.arange(140, 165.05, 0.1), 1)
+	time_list = numpy.arange(n_scans) * 0.5
+	intensity_array = rng.exponential(50, size=(n_scans, len(mass_list)))
+
+	scans = numpy.arange(n_scans)
+	for centre in rng.uniform(0, n_scans, size=20):
+		profile = rng.uniform(1e3, 1e5) * numpy.exp(-0.5 * ((scans - centre) / rng.uniform(2, 8))**2)
+		intensity_array += numpy.outer(profile, rng.uniform(0.2, 1, size=len(mass_list)))
+
+	return IntensityMatrix(time_list.tolist(), mass_list.tolist(), intensity_array)
+
+
+def test_same_as_peak_finder():
+	im = make_intensity_matrix()
+
+	# Each mass covers enough channels that summing the intensities in a different order changes the totals.
+	e_im = build_extracted_intensity_matrix(im, MASSES, left_bound=1, right_bound=1)
+	expected = [(peak.rt, peak.bounds, peak.area) for peak in peak_finder(e_im, noise=300.0)]
+
+	finder = StreamingPeakFinder(MASSES, noise_level=300.0, left_bound=1, right_bound=1)
+	peaks = []
+	for idx, rt in enumerate(im.time_list):
+		peaks.extend(finder.push(rt, im.get_ms_at_index(idx)))
+	peaks.extend(finder.finish())
+
+	assert sorted((peak.rt, peak.bounds, peak.area) for peak in peaks) == sorted(expected)
+
+
+@pytest.mark.parametrize("intensity", [0, 100])
+def test_flat_stretch_memory(intensity: float):
+	finder = StreamingPeakFinder(MASSES, noise_level=300.0)
+	scan = Scan(MASSES, [intensity] * len(MASSES))
+
+	for idx in range(20000):
+		finder.push(idx * 0.5, scan)
+
+	assert len(finder._tics) <= 4005
+	if intensity == 0:
+		assert len(finder._tics) < 10